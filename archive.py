@@ -0,0 +1,172 @@
+import json
+import struct
+import zlib
+from array import array
+from collections import defaultdict
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+import trend
+
+try:  # Parquet (zstd) when pyarrow is installed, else the built-in columnar format
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # pragma: no cover
+    pa = pq = None
+
+# ---------------- COLD ARCHIVE FILES ----------------
+#  Old, closed join rows of one link leave the hot `joins` table as one
+#  compressed columnar object in the bucket:
+#    id, joined_user_id, joined_at, left_at (epoch seconds), left_reason
+#  .parquet (zstd) with pyarrow, else .jcol = zlib-compressed int64
+#  columns + newline-joined reasons. A manifest row per object keeps the
+#  rollups (row totals, joined_at range, joins / leaves per IST day), so
+#  most stats never open the file.
+# -----------------------------------------------------
+
+_JCOL_HEADER = struct.Struct("<4sHxxQ")  # magic, version, n
+_JCOL_MAGIC = b"JCOL"
+_JCOL_VERSION = 1
+INT_COLUMNS = ("id", "joined_user_id", "joined_at", "left_at")
+
+
+def file_ext() -> str:
+    return "parquet" if pq is not None else "jcol"
+
+
+def to_columns(rows: Iterable[dict]) -> Dict[str, Any]:
+    """Join rows -> column arrays (times as epoch seconds, -1 = null)."""
+    cols: Dict[str, Any] = {c: array("q") for c in INT_COLUMNS}
+    cols["left_reason"] = []
+    for r in rows:
+        cols["id"].append(int(r["id"]))
+        cols["joined_user_id"].append(int(r["joined_user_id"]))
+        cols["joined_at"].append(trend.epoch_of(r.get("joined_at")))
+        cols["left_at"].append(trend.epoch_of(r.get("left_at")))
+        cols["left_reason"].append(r.get("left_reason") or "")
+    return cols
+
+
+def encode(cols: Dict[str, Any]) -> bytes:
+    """Serialize columns in the format of file_ext()."""
+    if pq is not None:
+        table = pa.table({
+            **{c: pa.array(cols[c], type=pa.int64()) for c in INT_COLUMNS},
+            "left_reason": pa.array(cols["left_reason"], type=pa.string()),
+        })
+        sink = pa.BufferOutputStream()
+        pq.write_table(table, sink, compression="zstd")
+        return sink.getvalue().to_pybytes()
+    body = b"".join(cols[c].tobytes() for c in INT_COLUMNS)
+    body += "\n".join(cols["left_reason"]).encode()
+    return _JCOL_HEADER.pack(_JCOL_MAGIC, _JCOL_VERSION, len(cols["id"])) + zlib.compress(body, 6)
+
+
+def decode(data: bytes, object_name: str) -> Dict[str, Any]:
+    """Inverse of encode(); the format comes from the object name's extension."""
+    if object_name.endswith(".parquet"):
+        if pq is None:
+            raise RuntimeError("pyarrow is required to read Parquet archives")
+        table = pq.read_table(pa.BufferReader(data))
+        cols: Dict[str, Any] = {c: array("q", table.column(c).to_pylist()) for c in INT_COLUMNS}
+        cols["left_reason"] = table.column("left_reason").to_pylist()
+        return cols
+    magic, version, n = _JCOL_HEADER.unpack_from(data, 0)
+    if magic != _JCOL_MAGIC or version != _JCOL_VERSION:
+        raise ValueError(f"not a join archive: {object_name}")
+    body = zlib.decompress(data[_JCOL_HEADER.size:])
+    cols = {}
+    for k, c in enumerate(INT_COLUMNS):
+        cols[c] = array("q", body[k * n * 8:(k + 1) * n * 8])
+    tail = body[len(INT_COLUMNS) * n * 8:].decode()
+    cols["left_reason"] = tail.split("\n") if n else []
+    return cols
+
+
+def iter_rows(cols: Dict[str, Any], since: Optional[datetime] = None,
+              until: Optional[datetime] = None) -> Iterator[dict]:
+    """Archived rows as join-row dicts, joined_at in [since, until]."""
+    lo = since.timestamp() if since is not None else None
+    hi = until.timestamp() if until is not None else None
+    for k, j in enumerate(cols["joined_at"]):
+        if (lo is not None and j < lo) or (hi is not None and j > hi):
+            continue
+        left = cols["left_at"][k]
+        yield {
+            "id": cols["id"][k],
+            "joined_user_id": cols["joined_user_id"][k],
+            "joined_at": _iso(j),
+            "left_at": _iso(left),
+            "left_reason": cols["left_reason"][k] or None,
+        }
+
+
+def _iso(epoch: int) -> Optional[str]:
+    return datetime.fromtimestamp(epoch, timezone.utc).isoformat() if epoch >= 0 else None
+
+
+# ---------------- ROLLUPS ----------------
+
+def ist_day(epoch: int) -> str:
+    return datetime.fromtimestamp(epoch, trend.IST).strftime("%Y-%m-%d")
+
+
+def rollup(cols: Dict[str, Any]) -> Dict[str, Any]:
+    """Manifest fields summarizing one archive object."""
+    daily: Dict[str, List[int]] = defaultdict(lambda: [0, 0])  # IST day -> [joins, leaves]
+    joined = [j for j in cols["joined_at"] if j >= 0]
+    left = [t for t in cols["left_at"] if t >= 0]
+    for j in joined:
+        daily[ist_day(j)][0] += 1
+    for t in left:
+        daily[ist_day(t)][1] += 1
+    return {
+        "rows": len(cols["id"]),
+        "left_rows": len(left),
+        "min_joined": min(joined) if joined else -1,
+        "max_joined": max(joined) if joined else -1,
+        "daily": json.dumps(dict(sorted(daily.items())), separators=(",", ":")),
+    }
+
+
+def daily_of(manifest: dict) -> Dict[str, List[int]]:
+    daily = manifest.get("daily") or {}
+    return json.loads(daily) if isinstance(daily, str) else daily
+
+
+def window_coverage(manifest: dict, since: Optional[datetime], until: Optional[datetime]) -> str:
+    """'all' / 'none' / 'part': how much of an archive's joined_at range a window covers."""
+    lo, hi = int(manifest["min_joined"]), int(manifest["max_joined"])
+    s = since.timestamp() if since is not None else float("-inf")
+    u = until.timestamp() if until is not None else float("inf")
+    if hi < s or lo > u:
+        return "none"
+    if s <= lo and hi <= u:
+        return "all"
+    return "part"
+
+
+def add_rollups(starts: List[int], joins: List[int], leaves: List[int], gran: str,
+                daily: Dict[str, List[int]]):
+    """Add per-IST-day rollups into trend.series() buckets (day / week granularity)."""
+    if not starts:
+        return
+    size, _ = trend.GRANULARITIES[gran]
+    first = starts[0]
+    for day, (j, l) in daily.items():
+        midnight = int(datetime.strptime(day, "%Y-%m-%d").replace(tzinfo=trend.IST).timestamp())
+        k = (trend.bucket_start(midnight, gran) - first) // size
+        if 0 <= k < len(starts):
+            joins[k] += j
+            leaves[k] += l
+
+
+def archived_window(cols: Dict[str, Any]) -> trend.WindowIndex:
+    """WindowIndex over an archive's rows (all of them have left)."""
+    return trend.WindowIndex.from_columns(cols["joined_at"], cols["left_at"])
+
+
+def object_name(uid: int, link_id: int, cols: Dict[str, Any]) -> str:
+    ids = cols["id"]
+    return f"archive/{uid}/{link_id}/{min(ids)}-{max(ids)}.{file_ext()}"
+
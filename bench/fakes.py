@@ -0,0 +1,667 @@
+import os
+import sys
+import time
+import random
+import asyncio
+import tempfile
+import itertools
+import importlib
+from collections import Counter
+from types import SimpleNamespace
+from datetime import datetime, timezone, timedelta
+from typing import Dict, List, Tuple, Any, Optional
+
+try:
+    import psutil  # optional: process memory on every platform
+except ImportError:
+    psutil = None
+try:
+    import resource  # Unix only
+except ImportError:
+    resource = None
+
+# ---------------- IN-PROCESS FAKES ----------------
+#  FakeSupabase: the subset of the supabase-py / PostgREST query builder
+#  that storage.SupabaseStorage uses, backed by python lists.
+#  FakeUserClient: the TelegramClient surface used by the sync / left
+#  paths (get_input_entity, get_entity, get_dialogs, __call__).
+#  FakeBotEvent: the NewMessage / CallbackQuery event surface the
+#  handlers use (respond, reply, edit, answer, get_message); the
+#  messages it sends are kept, so a session can tap their buttons.
+#  All count every round trip so benchmarks can report them; each can
+#  add artificial latency (and the user client FloodWaits) for bench.load.
+# ----------------------------------------------------
+
+
+class FakeResponse:
+    def __init__(self, data: List[dict], count: Optional[int] = None):
+        self.data = data
+        self.count = count
+
+
+def _parse_value(v: str) -> Any:
+    if v.startswith('"') and v.endswith('"'):
+        return v[1:-1]
+    if v == "null":
+        return None
+    try:
+        return int(v)
+    except ValueError:
+        return v
+
+
+def _split_top(expr: str) -> List[str]:
+    """Split a PostgREST logic expression on top-level commas."""
+    parts, depth, quoted, cur = [], 0, False, ""
+    for ch in expr:
+        if ch == '"':
+            quoted = not quoted
+        elif not quoted and ch == "(":
+            depth += 1
+        elif not quoted and ch == ")":
+            depth -= 1
+        if ch == "," and depth == 0 and not quoted:
+            parts.append(cur)
+            cur = ""
+        else:
+            cur += ch
+    if cur:
+        parts.append(cur)
+    return parts
+
+
+def _cmp(op: str, a: Any, b: Any) -> bool:
+    if op == "eq":
+        return a == b
+    if op == "neq":
+        return a != b
+    if op == "is":
+        return a is b
+    if a is None or b is None:
+        return False
+    if isinstance(a, str) != isinstance(b, str):
+        a, b = str(a), str(b)
+    if op == "gt":
+        return a > b
+    if op == "gte":
+        return a >= b
+    if op == "lt":
+        return a < b
+    if op == "lte":
+        return a <= b
+    raise ValueError(f"fake supabase: unsupported op {op}")
+
+
+def _logic(expr: str):
+    """Compile `a.op.v,and(b.op.v,...)` into a row predicate (OR of the parts)."""
+    preds = []
+    for part in _split_top(expr):
+        if part.startswith("and(") or part.startswith("or("):
+            kind, inner = part.split("(", 1)
+            subs = [_logic(p) for p in _split_top(inner[:-1])]
+            if kind == "and":
+                preds.append(lambda r, subs=subs: all(s(r) for s in subs))
+            else:
+                preds.append(lambda r, subs=subs: any(s(r) for s in subs))
+        else:
+            col, op, val = part.split(".", 2)
+            v = _parse_value(val)
+            preds.append(lambda r, col=col, op=op, v=v: _cmp(op, r.get(col), v))
+    if len(preds) == 1:
+        return preds[0]
+    return lambda r: any(p(r) for p in preds)
+
+
+class FakeQuery:
+    def __init__(self, db: "FakeSupabase", table: str):
+        self.db = db
+        self.table_name = table
+        self.op = "select"
+        self.columns = "*"
+        self.count_mode = None
+        self.filters = []
+        self.orders: List[Tuple[str, bool]] = []
+        self.limit_n: Optional[int] = None
+        self.offset_n = 0
+        self.payload: Any = None
+        self.on_conflict = ""
+        self.ignore_duplicates = False  # upsert: ON CONFLICT DO NOTHING
+        self.eqs: Dict[str, Any] = {}
+        self._negate = False
+
+    # ---- verbs ----
+    def select(self, columns: str = "*", count: Optional[str] = None):
+        self.op, self.columns, self.count_mode = "select", columns, count
+        return self
+
+    def insert(self, payload, **kw):
+        self.op, self.payload = "insert", payload
+        return self
+
+    def upsert(self, payload, on_conflict: str = "", ignore_duplicates: bool = False, **kw):
+        self.op, self.payload, self.on_conflict = "upsert", payload, on_conflict
+        self.ignore_duplicates = ignore_duplicates
+        return self
+
+    def update(self, payload, **kw):
+        self.op, self.payload = "update", payload
+        return self
+
+    def delete(self, **kw):
+        self.op = "delete"
+        return self
+
+    # ---- filters ----
+    def _add(self, pred):
+        if self._negate:
+            self._negate = False
+            self.filters.append(lambda r, p=pred: not p(r))
+        else:
+            self.filters.append(pred)
+        return self
+
+    @property
+    def not_(self):
+        self._negate = True
+        return self
+
+    def eq(self, col, v):
+        if not self._negate:
+            self.eqs[col] = v
+        return self._add(lambda r: r.get(col) == v)
+
+    def neq(self, col, v):
+        return self._add(lambda r: r.get(col) != v)
+
+    def gt(self, col, v):
+        return self._add(lambda r: _cmp("gt", r.get(col), v))
+
+    def gte(self, col, v):
+        return self._add(lambda r: _cmp("gte", r.get(col), v))
+
+    def lt(self, col, v):
+        return self._add(lambda r: _cmp("lt", r.get(col), v))
+
+    def lte(self, col, v):
+        return self._add(lambda r: _cmp("lte", r.get(col), v))
+
+    def is_(self, col, v):
+        want = None if v in (None, "null") else v
+        return self._add(lambda r: r.get(col) is want)
+
+    def in_(self, col, values):
+        vs = set(values)
+        return self._add(lambda r: r.get(col) in vs)
+
+    def or_(self, expr: str):
+        return self._add(_logic(expr))
+
+    def order(self, col: str, desc: bool = False, **kw):
+        self.orders.append((col, desc))
+        return self
+
+    def limit(self, n: int, **kw):
+        self.limit_n = n
+        return self
+
+    def range(self, start: int, end: int, **kw):
+        self.offset_n, self.limit_n = start, end - start + 1
+        return self
+
+    # ---- execution ----
+    def _matching(self) -> List[dict]:
+        rows = self.db.candidates(self.table_name, self.eqs)
+        fs = self.filters
+        return [r for r in rows if all(f(r) for f in fs)]
+
+    def _project(self, rows: List[dict]) -> List[dict]:
+        if self.columns.strip() == "*":
+            return [dict(r) for r in rows]
+        cols = [c.strip() for c in self.columns.split(",")]
+        return [{c: r.get(c) for c in cols} for r in rows]
+
+    def execute(self) -> FakeResponse:
+        self.db.round_trip(self.table_name, self.op)
+        if self.op == "select":
+            rows = self._matching()
+            total = len(rows)
+            for col, desc in reversed(self.orders):
+                rows.sort(key=lambda r: (r.get(col) is None, r.get(col)), reverse=desc)
+            if self.offset_n or self.limit_n is not None:
+                end = None if self.limit_n is None else self.offset_n + self.limit_n
+                rows = rows[self.offset_n:end]
+            if self.db.max_rows is not None:
+                rows = rows[:self.db.max_rows]  # PostgREST db-max-rows caps every response, limit or not
+            if self.count_mode and self.columns.strip() in ("id", "*") and self.limit_n is None:
+                # count-only queries: PostgREST returns the rows too, keep it cheap
+                return FakeResponse([{"id": r.get("id")} for r in rows], count=total)
+            return FakeResponse(self._project(rows), count=total if self.count_mode else None)
+        if self.op in ("insert", "upsert"):
+            payload = self.payload if isinstance(self.payload, list) else [self.payload]
+            keys = tuple(k.strip() for k in self.on_conflict.split(",") if k.strip())
+            return FakeResponse(self.db.write_rows(self.table_name, payload, keys if self.op == "upsert" else (),
+                                                   ignore=self.ignore_duplicates))
+        if self.op == "update":
+            rows = self._matching()
+            for r in rows:
+                r.update(self.payload)
+            self.db.drop_index(self.table_name, set(self.payload))
+            return FakeResponse([dict(r) for r in rows])
+        if self.op == "delete":
+            keep, gone = [], []
+            fs = self.filters
+            for r in self.db.tables.setdefault(self.table_name, []):
+                (gone if all(f(r) for f in fs) else keep).append(r)
+            self.db.tables[self.table_name] = keep
+            self.db.drop_index(self.table_name, None)
+            return FakeResponse(gone)
+        raise ValueError(self.op)
+
+
+class FakeStorageBucket:
+    def __init__(self, db: "FakeSupabase", name: str):
+        self.db = db
+        self.name = name
+
+    def upload(self, path, file, file_options=None):
+        self.db.round_trip(f"storage:{self.name}", "upload")
+        if isinstance(file, (bytes, bytearray)):
+            data = bytes(file)
+        else:
+            with open(file, "rb") as fh:
+                data = fh.read()
+        self.db.objects[(self.name, path)] = data
+        return {"path": path}
+
+    def download(self, path):
+        self.db.round_trip(f"storage:{self.name}", "download")
+        return self.db.objects[(self.name, path)]
+
+    def remove(self, paths):
+        self.db.round_trip(f"storage:{self.name}", "remove")
+        for path in paths:
+            self.db.objects.pop((self.name, path), None)
+        return [{"name": p} for p in paths]
+
+    def create_signed_url(self, path, expires_in):
+        return {"signedURL": f"fake://{self.name}/{path}"}
+
+
+class FakeStorageApi:
+    def __init__(self, db: "FakeSupabase"):
+        self.db = db
+
+    def from_(self, bucket: str) -> FakeStorageBucket:
+        return FakeStorageBucket(self.db, bucket)
+
+
+# columns with a lazily built hash index (eq filters on them skip the full scan)
+INDEXED_COLUMNS = ("id", "user_id", "chat_id", "invite_link_id", "joined_user_id")
+
+
+class FakeSupabase:
+    """In-process stand-in for supabase.Client (tables + storage)."""
+
+    def __init__(self, latency: float = 0.0, max_rows: Optional[int] = 1000):
+        self.latency = latency  # seconds slept (blocking, like the sync client) per round trip
+        self.max_rows = max_rows  # Supabase's default API max rows
+        self.tables: Dict[str, List[dict]] = {}
+        self.next_id: Dict[str, int] = Counter()
+        self.unique: Dict[Tuple[str, Tuple[str, ...]], Dict[tuple, dict]] = {}
+        self.by_col: Dict[Tuple[str, str], Dict[Any, List[dict]]] = {}
+        self.objects: Dict[Tuple[str, str], bytes] = {}
+        self.calls: Counter = Counter()
+        self.storage = FakeStorageApi(self)
+
+    def table(self, name: str) -> FakeQuery:
+        return FakeQuery(self, name)
+
+    def round_trip(self, table: str, op: str):
+        self.calls[f"{table}.{op}"] += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def drop_index(self, table: str, columns: Optional[set]):
+        """Forget indexes of `table` touching `columns` (None = all)."""
+        for k in [k for k in self.unique if k[0] == table and (columns is None or columns & set(k[1]))]:
+            del self.unique[k]
+        for k in [k for k in self.by_col if k[0] == table and (columns is None or k[1] in columns)]:
+            del self.by_col[k]
+
+    def candidates(self, table: str, eqs: Dict[str, Any]) -> List[dict]:
+        """Smallest eq-index bucket for the filters, or the whole table."""
+        rows = self.tables.setdefault(table, [])
+        best = rows
+        for col, v in eqs.items():
+            if col not in INDEXED_COLUMNS:
+                continue
+            idx = self.by_col.get((table, col))
+            if idx is None:
+                idx = {}
+                for r in rows:
+                    idx.setdefault(r.get(col), []).append(r)
+                self.by_col[(table, col)] = idx
+            bucket = idx.get(v, [])
+            if len(bucket) < len(best):
+                best = bucket
+        return best
+
+    def _index(self, table: str, keys: Tuple[str, ...]) -> Dict[tuple, dict]:
+        idx = self.unique.get((table, keys))
+        if idx is None:
+            idx = {tuple(r.get(k) for k in keys): r for r in self.tables.setdefault(table, [])}
+            self.unique[(table, keys)] = idx
+        return idx
+
+    def write_rows(self, table: str, payload: List[dict], conflict: Tuple[str, ...],
+                   ignore: bool = False) -> List[dict]:
+        rows = self.tables.setdefault(table, [])
+        idx = self._index(table, conflict) if conflict else None
+        out = []
+        for p in payload:
+            if idx is not None:
+                hit = idx.get(tuple(p.get(k) for k in conflict))
+                if hit is not None:
+                    if not ignore:  # ignored duplicates are not returned, like PostgREST
+                        hit.update(p)
+                        out.append(hit)
+                    continue
+            row = dict(p)
+            if "id" not in row and table != "user_sessions":
+                self.next_id[table] += 1
+                row["id"] = self.next_id[table]
+            rows.append(row)
+            for (t, keys), other in self.unique.items():
+                if t == table:
+                    other[tuple(row.get(k) for k in keys)] = row
+            for (t, col), idx in self.by_col.items():
+                if t == table:
+                    idx.setdefault(row.get(col), []).append(row)
+            out.append(row)
+        return out
+
+    def reset_calls(self):
+        self.calls.clear()
+
+
+# ---------------- FAKE TELEGRAM ----------------
+
+class FakeEntity:
+    def __init__(self, uid: int):
+        self.id = uid
+        self.username = f"user{uid}" if uid % 3 else None
+        self.first_name = f"U{uid}"
+        self.last_name = None
+
+
+class FakeUserClient:
+    """
+    Stand-in for an owner's TelegramClient.
+    chats: chat_id -> {"importers": [(user_id, datetime)], "members": set(user_id),
+                       "link": invite link (optional, for GetExportedChatInvites),
+                       "revoked" / "expire_date" / "usage_limit": state of that link (optional)}
+    cold=True: a restarted client whose entity cache is empty, so get_input_entity
+    raises ValueError for every chat until get_dialogs has been called.
+    """
+
+    def __init__(self, chats: Optional[Dict[int, Dict[str, Any]]] = None, dialogs: Optional[list] = None,
+                 latency: float = 0.0, flood_rate: float = 0.0, flood_seconds: int = 1,
+                 flood_sleep_threshold: int = 60, seed: int = 0, cold: bool = False):
+        self.chats: Dict[int, Dict[str, Any]] = chats or {}
+        self.dialogs = dialogs or []
+        self.calls: Counter = Counter()
+        self.latency = latency  # seconds per request (awaited)
+        self.flood_rate = flood_rate  # chance a request hits a FloodWait of flood_seconds
+        self.flood_seconds = flood_seconds
+        self.flood_sleep_threshold = flood_sleep_threshold  # Telethon sleeps shorter waits, raises longer ones
+        self.floods: Counter = Counter()  # "slept" / "raised"
+        self.rnd = random.Random(seed)
+        self.cold = cold
+        self.seen: set = set()  # chats get_dialogs has put in the entity cache
+
+    async def _delay(self, request):
+        from telethon import errors
+
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self.flood_rate and self.rnd.random() < self.flood_rate:
+            if self.flood_seconds > self.flood_sleep_threshold:
+                self.floods["raised"] += 1
+                raise errors.FloodWaitError(request, capture=self.flood_seconds)
+            self.floods["slept"] += 1
+            await asyncio.sleep(self.flood_seconds)
+
+    def is_connected(self) -> bool:
+        return True
+
+    async def is_user_authorized(self) -> bool:
+        return True
+
+    async def disconnect(self):
+        return None
+
+    async def get_input_entity(self, peer):
+        self.calls["get_input_entity"] += 1
+        if self.cold and int(peer) not in self.seen:
+            raise ValueError(f"Could not find the input entity for {peer}")
+        return peer
+
+    async def get_entity(self, peer):
+        self.calls["get_entity"] += 1
+        return FakeEntity(int(peer))
+
+    async def get_dialogs(self, limit: int = 100):
+        self.calls["get_dialogs"] += 1
+        self.seen.update(self.chats)
+        return self.dialogs[:limit]
+
+    async def __call__(self, request, ordered: bool = False):
+        from telethon import errors
+        from telethon.tl import types
+
+        name = type(request).__name__
+        self.calls[name] += 1
+        await self._delay(request)
+        if name == "GetChatInviteImportersRequest":
+            chat = self.chats[int(request.peer)]
+            imps = chat["importers"][: request.limit]
+            return types.messages.ChatInviteImporters(
+                count=len(chat["importers"]),
+                importers=[types.ChatInviteImporter(user_id=u, date=d) for u, d in imps],
+                users=[],
+            )
+        if name == "GetExportedChatInvitesRequest":
+            chat = self.chats[int(request.peer)]
+            link = chat.get("link", "https://t.me/+benchhash")
+            revoked = bool(chat.get("revoked"))
+            invites = [] if request.offset_link or bool(request.revoked) != revoked else [
+                SimpleNamespace(link=link, usage=len(chat["importers"]), requested=0, date=None, revoked=revoked,
+                                expire_date=chat.get("expire_date"), usage_limit=chat.get("usage_limit"))
+            ]
+            return SimpleNamespace(count=len(invites), invites=invites, users=[])
+        if name == "GetParticipantRequest":
+            chat = self.chats[int(request.channel)]
+            if int(request.participant) not in chat["members"]:
+                raise errors.UserNotParticipantError(request)
+            return True
+        raise NotImplementedError(f"FakeUserClient: {name}")
+
+
+class FakeBotEvent:
+    """
+    A NewMessage (text) or CallbackQuery (data) update from `sender_id`.
+    Replies go nowhere; `latency` is awaited per Bot API call and
+    `sent` counts them by method.
+    """
+
+    _msg_ids = itertools.count(1)
+
+    def __init__(self, sender_id: int, text: str = "", data: Optional[bytes] = None,
+                 msg_id: Optional[int] = None, latency: float = 0.0):
+        self.sender_id = self.chat_id = sender_id
+        self.raw_text = self.text = text
+        self.data = data
+        self.msg_id = msg_id  # message the button belongs to (callbacks)
+        self.latency = latency
+        self.is_private = True
+        self.pattern_match = None
+        self.sent: Counter = Counter()
+        self.messages: List[SimpleNamespace] = []  # sent by respond / reply: id, text, buttons
+
+    async def _api(self, method: str, msg_id: Optional[int] = None) -> SimpleNamespace:
+        self.sent[method] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return SimpleNamespace(id=msg_id or next(FakeBotEvent._msg_ids))
+
+    async def _send(self, method: str, text: str = "", buttons=None) -> SimpleNamespace:
+        msg = await self._api(method)
+        msg.text, msg.buttons = text, buttons
+        self.messages.append(msg)
+        return msg
+
+    async def respond(self, text: str = "", *args, buttons=None, **kwargs):
+        return await self._send("respond", text, buttons)
+
+    async def reply(self, text: str = "", *args, buttons=None, **kwargs):
+        return await self._send("reply", text, buttons)
+
+    def button_data(self, prefix: bytes) -> Optional[Tuple[int, bytes]]:
+        """(message id, callback data) of the newest sent button whose data starts with prefix."""
+        for msg in reversed(self.messages):
+            for row in msg.buttons or []:
+                for b in row if isinstance(row, (list, tuple)) else [row]:
+                    b = getattr(b, "button", b)  # custom.Button wraps the TL button
+                    data = getattr(b, "data", None) or getattr(getattr(b, "type", None), "data", None)
+                    if data and data.startswith(prefix):
+                        return msg.id, data
+        return None
+
+    async def edit(self, *args, **kwargs):
+        return await self._api("edit", self.msg_id)
+
+    async def answer(self, *args, **kwargs):
+        return await self._api("answer", self.msg_id)
+
+    async def get_message(self):
+        return SimpleNamespace(id=self.msg_id)
+
+
+class FakeDialog:
+    def __init__(self, entity, is_user: bool = False):
+        self.entity = entity
+        self.is_user = is_user
+
+
+def make_dialogs(n: int, seed: int = 7) -> List[FakeDialog]:
+    """Mixed dialogs: users, public/private channels, admin/non-admin groups."""
+    from telethon.tl import types
+
+    rnd = random.Random(seed)
+    out: List[FakeDialog] = []
+    for i in range(n):
+        kind = rnd.random()
+        if kind < 0.4:
+            out.append(FakeDialog(FakeEntity(10_000 + i), is_user=True))
+        elif kind < 0.8:
+            out.append(FakeDialog(types.Channel(
+                id=1_000_000 + i, title=f"Channel {i}", photo=types.ChatPhotoEmpty(), date=None,
+                creator=rnd.random() < 0.3, access_hash=i,
+                username=(f"pub{i}" if rnd.random() < 0.5 else None),
+                admin_rights=(types.ChatAdminRights(invite_users=True) if rnd.random() < 0.3 else None),
+            )))
+        else:
+            out.append(FakeDialog(types.Chat(
+                id=2_000_000 + i, title=f"Group {i}", photo=types.ChatPhotoEmpty(),
+                participants_count=10, date=None, version=1, creator=rnd.random() < 0.5,
+            )))
+    return out
+
+
+def make_link_chat(n_importers: int, left_ratio: float = 0.1, seed: int = 1,
+                   start: Optional[datetime] = None) -> Dict[str, Any]:
+    """Synthetic chat: n importers (newest first, like Telegram) and the members still inside."""
+    rnd = random.Random(seed)
+    start = start or datetime.now(timezone.utc) - timedelta(days=400)
+    step = 400 * 86400 / max(n_importers, 1)
+    importers = [(100_000_000 + i, start + timedelta(seconds=i * step)) for i in range(n_importers)]
+    importers.reverse()
+    members = {u for u, _ in importers if rnd.random() >= left_ratio}
+    return {"importers": importers, "members": members}
+
+
+# ---------------- PROCESS MEMORY ----------------
+
+def rss_bytes() -> Optional[int]:
+    """Current resident set size (None where nothing can read it: Windows without psutil)."""
+    if psutil is not None:
+        return psutil.Process().memory_info().rss
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def peak_rss_bytes() -> Optional[int]:
+    """Peak resident set size of the process (None where nothing can read it)."""
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024  # bytes on macOS, KiB elsewhere
+    if psutil is not None:
+        return getattr(psutil.Process().memory_info(), "peak_wset", None)  # Windows
+    return None
+
+
+# ---------------- BOT MODULE LOADER ----------------
+
+def load_bot():
+    """
+    Import login.py offline: dummy credentials, a temp working dir for
+    session files and a FakeSupabase-backed store.
+    Returns (login_module, fake_supabase).
+    """
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    if root not in sys.path:
+        sys.path.insert(0, root)
+    work = tempfile.mkdtemp(prefix="joinbot_bench_")
+    os.environ.update({
+        "API_ID": "1",
+        "API_HASH": "bench",
+        "BOT_TOKEN": "1:bench",
+        "SESSION_DIR": os.path.join(work, "sessions"),
+        "STORAGE_BACKEND": "supabase",
+        "SUPABASE_URL": "http://fake.invalid",
+        "SUPABASE_KEY": "bench",
+        "SUPABASE_BUCKET": "bench",
+    })
+    os.chdir(work)
+    login = importlib.import_module("login")
+    from storage import SupabaseStorage
+
+    fake = FakeSupabase()
+    login.store = SupabaseStorage(fake, bucket="bench")
+    return login, fake
+
+
+def seed_link(login, fake: FakeSupabase, uid: int, chat_id: int, chat: Dict[str, Any],
+              link: str = "https://t.me/+benchhash", stored_rows: bool = True) -> int:
+    """Create an invite link for uid and optionally pre-store one join row per importer (leavers marked left)."""
+    login.sp_save_invite_link(uid, chat_id, f"Bench {chat_id}", link, "normal")
+    link_id = next(int(r["id"]) for r in login.sp_list_invite_links(uid) if r["invite_link"] == link)
+    if stored_rows:
+        fake.write_rows("joins", [
+            {
+                "user_id": uid,
+                "chat_id": chat_id,
+                "invite_link_id": link_id,
+                "joined_user_id": u,
+                "joined_at": d.isoformat(),
+                # already-detected leavers, so a re-sync is a true steady state
+                "left_at": None if u in chat["members"] else (d + timedelta(hours=1)).isoformat(),
+                "left_reason": None if u in chat["members"] else "left",
+                "left_seen_at": None,
+            }
+            for u, d in chat["importers"]
+        ], ("user_id", "chat_id", "invite_link_id", "joined_user_id"))
+    return link_id
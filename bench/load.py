@@ -0,0 +1,263 @@
+"""
+End-to-end load simulation: the real handlers under concurrent traffic.
+
+    python -m bench.load                                   # 2000 owners open /stats at once, 30 s
+    python -m bench.load --owners 500 --stats-rate 50      # staggered arrivals (sessions / s)
+    python -m bench.load --leave-rate 500 --big-chat 100000
+    python -m bench.load --db-latency 0.005 --tg-latency 0.02 --flood-rate 0.01 --flood-seconds 2
+    python -m bench.load --background                      # + background syncs of every owner
+
+Every owner runs /stats sessions in a loop until --duration is over:
+/stats -> tap its link (sync + first page) -> next page -> close, with
+--think seconds between taps. Meanwhile one big chat emits leave
+events at --leave-rate. Updates go through the same entry points
+Telethon calls (router.on_message / router.on_callback,
+track_user_left), against bench.fakes with injected latency and
+FloodWaits. The outbox drainer runs as it does in production.
+
+Reports handler latency percentiles per update type, throughput, event
+loop lag and process memory over time.
+"""
+import argparse
+import asyncio
+import random
+import shutil
+import time
+import tracemalloc
+from collections import Counter, defaultdict
+from types import SimpleNamespace
+from typing import Dict, List
+
+from bench.fakes import FakeBotEvent, FakeSupabase, FakeUserClient, load_bot, make_link_chat, rss_bytes, seed_link
+
+login, _ = load_bot()
+import tracing  # noqa: E402
+from storage import SupabaseStorage  # noqa: E402  (login.py must be importable first)
+
+FIRST_UID = 1_000
+CHAT_BASE = -1002000000000
+BIG_OWNER = 1  # tracks the big chat; not one of the /stats owners
+BIG_CHAT = -1001000000000
+
+
+def rss_mb() -> float:
+    """Current resident set size (traced python allocations where it cannot be read)."""
+    rss = rss_bytes()
+    if rss is None:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        return tracemalloc.get_traced_memory()[0] / 1e6
+    return rss / 1e6
+
+
+def pct(values: List[float], p: float) -> float:
+    if not values:
+        return 0.0
+    s = sorted(values)
+    return s[min(len(s) - 1, int(p / 100 * len(s)))]
+
+
+class Sim:
+    def __init__(self, args: argparse.Namespace):
+        self.args = args
+        self.latency: Dict[str, List[float]] = defaultdict(list)  # update type -> seconds
+        self.errors: Counter = Counter()
+        self.lag: List[float] = []
+        self.series: List[tuple] = []
+        self.clients: List[FakeUserClient] = []
+        self.links: Dict[int, int] = {}  # owner uid -> link id
+        self.big_members: List[int] = []
+        self.done = 0
+        self.stop = asyncio.Event()
+
+    # ---- setup ----
+    def seed(self) -> FakeSupabase:
+        a = self.args
+        fake = FakeSupabase()
+        login.store = SupabaseStorage(fake, bucket="bench")
+        shutil.rmtree(login.MEMBERS_DIR, ignore_errors=True)
+        for d in (login.link_index, login.link_registry, login.link_counters, login.USER_CLIENT_CACHE):
+            d.clear()
+
+        def client(chats, seed):
+            c = FakeUserClient(chats, latency=a.tg_latency, flood_rate=a.flood_rate,
+                               flood_seconds=a.flood_seconds, seed=seed)
+            self.clients.append(c)
+            return c
+
+        for i in range(a.owners):
+            uid, chat_id = FIRST_UID + i, CHAT_BASE - i
+            chat = make_link_chat(a.link_size, seed=i)
+            chat["link"] = f"https://t.me/+load{i}"
+            self.links[uid] = seed_link(login, fake, uid, chat_id, chat, link=chat["link"])
+            login.USER_CLIENT_CACHE[uid] = client({chat_id: chat}, i)
+        big = make_link_chat(a.big_chat, seed=10 ** 6)
+        big["link"] = "https://t.me/+loadbig"
+        seed_link(login, fake, BIG_OWNER, BIG_CHAT, big, link=big["link"])
+        login.USER_CLIENT_CACHE[BIG_OWNER] = client({BIG_CHAT: big}, -1)
+        self.big_members = sorted(big["members"])
+        random.Random(3).shuffle(self.big_members)
+        fake.latency = a.db_latency  # seeding above is free
+        fake.reset_calls()
+        return fake
+
+    # ---- load generators ----
+    async def timed(self, kind: str, coro):
+        t0 = time.perf_counter()
+        try:
+            await coro
+        except Exception as ex:
+            self.errors[f"{kind}: {type(ex).__name__}"] += 1
+        finally:
+            self.latency[kind].append(time.perf_counter() - t0)
+            self.done += 1
+
+    async def think(self, rnd: random.Random):
+        if self.args.think:
+            await asyncio.sleep(rnd.uniform(0, 2 * self.args.think))
+
+    async def owner(self, uid: int, start: float):
+        a = self.args
+        rnd = random.Random(uid)
+        await asyncio.sleep(start)
+        router = login.router
+        while not self.stop.is_set():
+            cmd = FakeBotEvent(uid, "/stats", latency=a.bot_latency)
+            await self.timed("/stats", router.on_message(cmd))
+            await self.think(rnd)
+            picked = cmd.button_data(b"stats:")  # the link button of the picker /stats sent
+            if picked is None:
+                self.errors["/stats: no link picker"] += 1
+                continue
+            msg_id, data = picked
+            for data, kind in ((data, "stats:<link>"),
+                               (b"stats_page:next", "stats_page:next"),
+                               (b"stats_page:close", "stats_page:close")):
+                ev = FakeBotEvent(uid, data=data, msg_id=msg_id, latency=a.bot_latency)
+                await self.timed(kind, router.on_callback(ev))
+                await self.think(rnd)
+
+    async def leaves(self):
+        rate = self.args.leave_rate
+        if rate <= 0:
+            return
+        t0, sent = time.perf_counter(), 0
+        while not self.stop.is_set() and sent < len(self.big_members):
+            due = min(int((time.perf_counter() - t0) * rate), len(self.big_members))
+            for u in self.big_members[sent:due]:
+                ev = SimpleNamespace(chat_id=BIG_CHAT, user_id=u, user_left=True, user_kicked=False)
+                await self.timed("leave", login.track_user_left(ev))
+            sent = due
+            await asyncio.sleep(0.01)
+
+    async def background(self):
+        """Periodic refresh of every owner in the scheduler's background lane."""
+        while not self.stop.is_set():
+            await asyncio.gather(*(
+                self.timed("background sync", login.sync_importers_to_db(uid, interactive=False))
+                for uid in self.links
+            ))
+
+    # ---- observers ----
+    async def loop_lag(self, interval: float = 0.01):
+        loop = asyncio.get_running_loop()
+        while not self.stop.is_set():
+            t0 = loop.time()
+            await asyncio.sleep(interval)
+            self.lag.append(loop.time() - t0 - interval)
+
+    async def sampler(self, t0: float):
+        last = 0
+        while True:
+            await asyncio.sleep(self.args.sample)
+            row = (
+                time.perf_counter() - t0,
+                (self.done - last) / self.args.sample,
+                rss_mb(),
+                login.outbox.stats()["pending"],
+                sum(st["waiting"] for st in login.sync_scheduler.stats().values()),
+            )
+            last = self.done
+            self.series.append(row)
+            print(f"  t={row[0]:>6.1f}s  {row[1]:>8.0f} upd/s  rss={row[2]:>7.1f} MB  "
+                  f"outbox={row[3]:<6} sync queue={row[4]}")
+
+    async def run(self) -> Dict[str, object]:
+        a = self.args
+        fake = self.seed()
+        tracing.SLOW_HANDLER_SECONDS = a.trace_slow
+        rss0 = rss_mb()
+        print(f"load: {a.owners} owners x {a.link_size} joiners, big chat {a.big_chat}, "
+              f"db {a.db_latency * 1e3:g} ms, tg {a.tg_latency * 1e3:g} ms, bot {a.bot_latency * 1e3:g} ms, "
+              f"flood {a.flood_rate:g} x {a.flood_seconds}s, {a.duration:g}s")
+        t0 = time.perf_counter()
+        observers = [asyncio.ensure_future(c) for c in (self.loop_lag(), self.sampler(t0), login.outbox_loop())]
+        load = [self.owner(uid, i / a.stats_rate if a.stats_rate > 0 else 0.0) for i, uid in enumerate(self.links)]
+        load.append(self.leaves())
+        if a.background:
+            load.append(self.background())
+        workers = [asyncio.ensure_future(c) for c in load]
+        await asyncio.sleep(a.duration)
+        self.stop.set()
+        _, late = await asyncio.wait(workers, timeout=a.grace)  # let started sessions finish
+        for t in late:
+            t.cancel()
+        await asyncio.gather(*late, return_exceptions=True)
+        await login.drain_outbox()
+        took = time.perf_counter() - t0
+        for t in observers:
+            t.cancel()
+        await asyncio.gather(*observers, return_exceptions=True)
+        return self.report(fake, took, rss0, len(late))
+
+    def report(self, fake: FakeSupabase, took: float, rss0: float, cut: int) -> Dict[str, object]:
+        print(f"\n{'update':<18} {'n':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+        for kind, xs in self.latency.items():
+            print(f"{kind:<18} {len(xs):>8} {pct(xs, 50) * 1e3:>9.1f} {pct(xs, 95) * 1e3:>9.1f} "
+                  f"{pct(xs, 99) * 1e3:>9.1f} {max(xs) * 1e3:>9.1f}")
+        floods = sum((c.floods for c in self.clients), Counter())
+        rpc = sum(sum(c.calls.values()) for c in self.clients)
+        rss1 = rss_mb()
+        print(f"\nthroughput {self.done / took:.0f} updates/s ({self.done} in {took:.1f}s, {cut} workers cut off)")
+        print(f"loop lag   p50 {pct(self.lag, 50) * 1e3:.1f} ms  p99 {pct(self.lag, 99) * 1e3:.1f} ms  "
+              f"max {max(self.lag, default=0) * 1e3:.1f} ms")
+        print(f"memory     {rss0:.1f} -> {rss1:.1f} MB ({rss1 - rss0:+.1f})")
+        print(f"db         {sum(fake.calls.values())} round trips  rpc {rpc}  "
+              f"floodwaits slept={floods['slept']} raised={floods['raised']}")
+        for err, n in self.errors.most_common(5):
+            print(f"error      {n} x {err}")
+        return {
+            "seconds": took,
+            "updates": self.done,
+            "throughput": self.done / took if took else 0.0,
+            "latency": {k: {p: pct(xs, p) for p in (50, 95, 99)} for k, xs in self.latency.items()},
+            "loop_lag_p99": pct(self.lag, 99),
+            "rss_growth_mb": rss1 - rss0,
+            "series": self.series,  # (t, updates/s, rss MB, outbox pending, sync queue)
+            "errors": dict(self.errors),
+        }
+
+
+def main(argv: List[str] = None) -> Dict[str, object]:
+    ap = argparse.ArgumentParser(description="Concurrent end-to-end load on the bot handlers")
+    ap.add_argument("--owners", type=int, default=2000, help="owners running /stats sessions")
+    ap.add_argument("--link-size", type=int, default=20, help="joiners per owner link")
+    ap.add_argument("--stats-rate", type=float, default=0, help="owners starting per second (0 = all at once)")
+    ap.add_argument("--think", type=float, default=0.5, help="mean seconds between an owner's taps")
+    ap.add_argument("--big-chat", type=int, default=100_000, help="joiners stored for the big chat")
+    ap.add_argument("--leave-rate", type=float, default=200, help="leave events per second in the big chat")
+    ap.add_argument("--background", action="store_true", help="also re-sync every owner in the background lane")
+    ap.add_argument("--db-latency", type=float, default=0.002, help="seconds per DB round trip (blocking)")
+    ap.add_argument("--tg-latency", type=float, default=0.005, help="seconds per user-client MTProto request")
+    ap.add_argument("--bot-latency", type=float, default=0.01, help="seconds per bot reply / edit / answer")
+    ap.add_argument("--flood-rate", type=float, default=0.0, help="chance an MTProto request hits a FloodWait")
+    ap.add_argument("--flood-seconds", type=int, default=1, help="FloodWait length (over 60 s it is raised)")
+    ap.add_argument("--duration", type=float, default=30, help="seconds of load")
+    ap.add_argument("--grace", type=float, default=30, help="seconds to let running sessions finish")
+    ap.add_argument("--trace-slow", type=float, default=0, help="log span trees of handlers slower than this (0 = off)")
+    ap.add_argument("--sample", type=float, default=1.0, help="seconds between time-series samples")
+    return asyncio.run(Sim(ap.parse_args(argv)).run())
+
+
+if __name__ == "__main__":
+    main()
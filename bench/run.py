@@ -0,0 +1,358 @@
+"""
+Offline benchmarks for the bot's hot paths.
+
+    python -m bench.run                       # default sizes 1e3,1e4,1e5
+    python -m bench.run --sizes 1000,1000000  # up to 10^6 importers
+    python -m bench.run --only sync,leave
+    python -m bench.run --mem                 # tracemalloc peak (slows timings)
+
+Runs against bench.fakes (no Telegram / Supabase credentials needed) and
+reports wall time, throughput, DB round trips, MTProto RPCs and peak
+memory for every case. Without --mem the peak is the process max RSS
+(python allocations where it cannot be read: Windows without psutil).
+Concurrent end-to-end load on the handlers: python -m bench.load.
+"""
+import argparse
+import asyncio
+import shutil
+import time
+import tracemalloc
+from collections import Counter
+from types import SimpleNamespace
+from typing import Callable, Dict, List, Any
+
+from bench.fakes import (
+    FakeSupabase,
+    FakeUserClient,
+    load_bot,
+    make_dialogs,
+    make_link_chat,
+    peak_rss_bytes,
+    seed_link,
+)
+
+UID = 1
+CHAT_ID = -1001234567890
+TRACE_MEMORY = False  # set by --mem
+
+login, _ = load_bot()
+from storage import SupabaseStorage  # noqa: E402  (login.py must be importable first)
+
+
+def fresh_db() -> FakeSupabase:
+    fake = FakeSupabase()
+    login.store = SupabaseStorage(fake, bucket="bench")
+    shutil.rmtree(login.MEMBERS_DIR, ignore_errors=True)  # link ids restart at 1 in a new fake
+    login.link_index.clear()
+    login.link_registry.clear()
+    return fake
+
+
+def _top(c: Counter, n: int = 3) -> str:
+    return ", ".join(f"{k}={v}" for k, v in c.most_common(n)) or "-"
+
+
+def measure(case: str, size: int, n_ops: int, unit: str, fn: Callable[[], Any],
+            fake: FakeSupabase, client: FakeUserClient = None) -> Dict[str, Any]:
+    fake.reset_calls()
+    if client:
+        client.calls.clear()
+    trace = TRACE_MEMORY or peak_rss_bytes() is None  # no RSS probe here: python allocations instead
+    if trace:
+        tracemalloc.start()
+    t0 = time.perf_counter()
+    fn()
+    dt = time.perf_counter() - t0
+    if trace:
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    else:
+        peak = peak_rss_bytes()
+    row = {
+        "case": case,
+        "size": size,
+        "seconds": dt,
+        "throughput": n_ops / dt if dt else float("inf"),
+        "unit": unit,
+        "db": sum(fake.calls.values()),
+        "db_top": _top(fake.calls),
+        "rpc": sum(client.calls.values()) if client else 0,
+        "rpc_top": _top(client.calls) if client else "-",
+        "peak_mb": peak / 1e6,
+    }
+    print(
+        f"{case:<10} n={size:<8} {dt * 1e3:>10.1f} ms  {row['throughput']:>12.0f} {unit}/s  "
+        f"db={row['db']:<7} rpc={row['rpc']:<8} peak={row['peak_mb']:>8.1f} MB  "
+        f"[db: {row['db_top']}] [rpc: {row['rpc_top']}]"
+    )
+    return row
+
+
+# ---------------- CASES ----------------
+
+def bench_sync(size: int) -> Dict[str, Any]:
+    """sync_importers_to_db on one link whose N joiners are already stored (steady state)."""
+    fake = fresh_db()
+    chat = make_link_chat(size)
+    seed_link(login, fake, UID, CHAT_ID, chat)
+    client = FakeUserClient({CHAT_ID: chat})
+    login.USER_CLIENT_CACHE[UID] = client
+    try:
+        return measure("sync", size, size, "rows", lambda: asyncio.run(login.sync_importers_to_db(UID)),
+                       fake, client)
+    finally:
+        login.USER_CLIENT_CACHE.pop(UID, None)
+
+
+def bench_sync_idle(size: int, links: int = 50) -> Dict[str, Any]:
+    """Second sync of a portfolio of `links` links (N joiners in total) with no new joins."""
+    fake = fresh_db()
+    chats = {}
+    for i in range(links):
+        chat_id = CHAT_ID - i
+        chat = make_link_chat(max(size // links, 1), seed=i)
+        chat["link"] = f"https://t.me/+bench{i}"
+        seed_link(login, fake, UID, chat_id, chat, link=chat["link"])
+        chats[chat_id] = chat
+    client = FakeUserClient(chats)
+    login.USER_CLIENT_CACHE[UID] = client
+    login.link_counters.clear()
+    try:
+        asyncio.run(login.sync_importers_to_db(UID))  # first sync records usage counters
+        return measure("sync_idle", size, links, "links", lambda: asyncio.run(login.sync_importers_to_db(UID)),
+                       fake, client)
+    finally:
+        login.USER_CLIENT_CACHE.pop(UID, None)
+
+
+def bench_idset(size: int) -> Dict[str, Any]:
+    """MemberSet for N joiners: snapshot load (mmap) + diff of N fetched importers + active scan."""
+    import os
+    import tempfile
+    from idsets import MemberSet, to_stamp
+
+    fake = fresh_db()
+    chat = make_link_chat(size)
+    rows = [{"joined_user_id": u, "joined_at": d, "left_at": None if u in chat["members"] else d}
+            for u, d in chat["importers"]]
+    path = os.path.join(tempfile.mkdtemp(prefix="idset_"), "link.ids")
+    MemberSet.from_rows(rows).save(path)
+    ids = [u for u, _ in chat["importers"]]
+    stamps = [to_stamp(d) for _, d in chat["importers"]]
+
+    def run():
+        ms = MemberSet.load(path)
+        assert not ms.diff(ids, stamps)
+        ms.active_ids()
+
+    row = measure("idset", size, size, "ids", run, fake)
+    print(f"           snapshot {os.path.getsize(path) / max(size, 1):.1f} bytes/member")
+    return row
+
+
+def bench_leave(size: int, events: int = 1000) -> Dict[str, Any]:
+    """track_user_left for `events` leave updates in a chat with N stored joiners."""
+    fake = fresh_db()
+    chat = make_link_chat(size)
+    seed_link(login, fake, UID, CHAT_ID, chat)
+    users = [u for u, _ in chat["importers"][:events]]
+
+    async def run():
+        for u in users:
+            ev = SimpleNamespace(chat_id=CHAT_ID, user_id=u, user_left=True, user_kicked=False)
+            await login.track_user_left(ev)
+        await login.drain_outbox()
+
+    return measure("leave", size, len(users), "events", lambda: asyncio.run(run()), fake)
+
+
+def bench_stats(size: int) -> Dict[str, Any]:
+    """Count path behind /stats and the window commands: joins + left for 7 windows."""
+    fake = fresh_db()
+    chat = make_link_chat(size)
+    link_id = seed_link(login, fake, UID, CHAT_ID, chat)
+    windows = ["all", "hour", "today", "yesterday", "week", "month", "year"]
+
+    def run():
+        for w in windows:
+            _, since, until = login.stats_window(w)
+            login.sp_count_joins_for_link(UID, link_id, since=since, until=until)
+            login.sp_count_left_for_link(UID, link_id, since=since, until=until)
+
+    return measure("stats", size, len(windows), "windows", run, fake)
+
+
+def bench_windows(size: int, rounds: int = 1000) -> Dict[str, Any]:
+    """Same 7 windows from the in-memory index: one build, then `rounds` /overview renders."""
+    fake = fresh_db()
+    chat = make_link_chat(size)
+    link_id = seed_link(login, fake, UID, CHAT_ID, chat)
+    windows = [login.stats_window(w) for w in login.OVERVIEW_WINDOWS]
+
+    async def run():
+        for _ in range(rounds):
+            for _, since, until in windows:
+                await login.link_window_counts(UID, link_id, since=since, until=until)
+
+    return measure("windows", size, rounds * len(windows), "windows", lambda: asyncio.run(run()), fake)
+
+
+def bench_dialogs(size: int, rounds: int = 200) -> Dict[str, Any]:
+    """top_dialog_pairs over `size` dialogs (capped at the 200 the bot fetches)."""
+    fake = fresh_db()
+    client = FakeUserClient(dialogs=make_dialogs(min(size, 200)))
+
+    async def run():
+        for _ in range(rounds):
+            await login.top_dialog_pairs(client, login.TOP_N)
+
+    return measure("dialogs", size, rounds, "calls", lambda: asyncio.run(run()), fake, client)
+
+
+def bench_calendar(size: int) -> Dict[str, Any]:
+    """build_calendar_kb with a highlighted range, min(size, 10^4) renders."""
+    fake = fresh_db()
+    renders = min(size, 10_000)
+
+    def run():
+        for i in range(renders):
+            login.build_calendar_kb(2024, 1 + i % 12, "2024-05-03", "2024-05-20")
+
+    return measure("calendar", size, renders, "renders", run, fake)
+
+
+def bench_keyboards(size: int) -> Dict[str, Any]:
+    """Callback-style keyboard renders: calendar navigation/day taps, multi-select toggles, link pickers."""
+    import random
+    import keyboards
+
+    fake = fresh_db()
+    renders = min(size, 100_000)
+    rnd = random.Random(3)
+    links = [{"id": i, "chat_id": -100 - i, "chat_title": f"Chat {i}"} for i in range(10)]
+    keyboards.cache_clear()
+
+    def run():
+        for i in range(renders):
+            kind = i % 3
+            if kind == 0:
+                day = 1 + rnd.randrange(28)
+                keyboards.build_calendar_kb(2024, 1 + rnd.randrange(12), "2024-05-03", f"2024-06-{day:02d}")
+            elif kind == 1:
+                keyboards.multi_kb(14, {rnd.randrange(14) for _ in range(3)})
+            else:
+                keyboards.link_picker_kb(rnd.choice(("stats", "export", "dr_link")), links[: 1 + rnd.randrange(10)],
+                                         b"cancel")
+
+    row = measure("keyboards", size, renders, "renders", run, fake)
+    print("           cache " + ", ".join(f"{n}: {h} hit / {m} miss" for n, h, m, _ in keyboards.cache_info()))
+    return row
+
+
+def bench_explain(size: int) -> Dict[str, Any]:
+    """Query plans of the storage hot queries (sqlite here, Postgres too when DATABASE_URL is set)."""
+    import os
+    import re
+    import tempfile
+    import migrate
+    from storage import SqliteStorage
+
+    fake = fresh_db()
+    chat = make_link_chat(size)
+    db = SqliteStorage(os.path.join(tempfile.mkdtemp(prefix="explain_"), "bot.db"))
+    link_id = int(db.save_invite_link(UID, CHAT_ID, "Bench", "https://t.me/+benchhash", "normal")["id"])
+    db.upsert_session(UID, "+10000000000", "bench.session")
+    db.upsert_joins([
+        {"user_id": UID, "chat_id": CHAT_ID, "invite_link_id": link_id, "joined_user_id": u,
+         "joined_at": d.isoformat(), "left_at": None if u in chat["members"] else d.isoformat(),
+         "left_reason": None, "left_seen_at": None}
+        for u, d in chat["importers"]
+    ])
+    # no ANALYZE: without statistics sqlite only picks a table scan when no index fits
+    u, d = chat["importers"][0]
+    hot = {  # storage call -> the statements it sends (captured below)
+        "list_invite_links": lambda: db.list_invite_links(UID),
+        "chat_links": lambda: db.chat_links(CHAT_ID),
+        "recent_sessions": lambda: db.recent_sessions(100),
+        "session_owners": lambda: db.session_owners(0, 1000),
+        "fetch_joins": lambda: db.fetch_joins(UID, link_id, since=d, after=(d.isoformat(), 1 << 40)),
+        "count_joins": lambda: db.count_joins(UID, link_id, since=d, until=d),
+        "count_left": lambda: db.count_left(UID, link_id, since=d, until=d),
+        "latest_join": lambda: db.latest_join(UID, CHAT_ID, u),
+        "latest_joins": lambda: db.latest_joins(UID, CHAT_ID, [u, u + 1]),
+        "mark_left_rows": lambda: db.mark_left_rows([1, 2], "left"),
+        "mark_left_members": lambda: db.mark_left_members(UID, link_id, [u], "left"),
+        "archivable_joins": lambda: db.archivable_joins(UID, link_id, d, 1000, after_id=1),
+        "list_archives": lambda: db.list_archives(UID, link_id),
+        "pending_archives": lambda: db.pending_archives(),
+        "tombstoned_links": lambda: db.tombstoned_links(100),
+        "delete_join_chunk": lambda: db.delete_join_chunk(UID, link_id, 500),
+    }
+    table_scan = re.compile(r"^SCAN (\w+)$")  # a full pass over a table, no index
+    plans: List[tuple] = []
+
+    def run():
+        for name, call in hot.items():
+            sent: List[str] = []
+            db.db.set_trace_callback(sent.append)
+            try:
+                call()
+            finally:
+                db.db.set_trace_callback(None)
+            for sql in sent:
+                if sql.split(None, 1)[0].upper() in ("SELECT", "UPDATE", "DELETE"):
+                    detail = [r[3] for r in db.db.execute("EXPLAIN QUERY PLAN " + sql)]
+                    plans.append((name, detail, [m.group(1) for m in map(table_scan.match, detail) if m]))
+
+    row = measure("explain", size, len(hot), "queries", run, fake)
+    bad = [name for name, _, scans in plans if scans]
+    for name, detail, scans in plans:
+        print(f"           {'FAIL' if scans else 'ok  '} {name:<18} {' | '.join(detail)}")
+    if os.getenv("DATABASE_URL") and migrate.pg is not None:
+        conn = migrate.connect(os.environ["DATABASE_URL"])
+        try:
+            print("           postgres:")
+            if not migrate.print_plans(migrate.check_plans(conn)):
+                bad.append("postgres")
+        finally:
+            conn.close()
+    assert not bad, f"hot queries without an index: {', '.join(bad)}"
+    return row
+
+
+CASES: Dict[str, Callable[[int], Dict[str, Any]]] = {
+    "sync": bench_sync,
+    "sync_idle": bench_sync_idle,
+    "idset": bench_idset,
+    "leave": bench_leave,
+    "stats": bench_stats,
+    "windows": bench_windows,
+    "dialogs": bench_dialogs,
+    "calendar": bench_calendar,
+    "keyboards": bench_keyboards,
+    "explain": bench_explain,
+}
+
+
+def main(argv: List[str] = None) -> List[Dict[str, Any]]:
+    ap = argparse.ArgumentParser(description="Offline hot-path benchmarks")
+    ap.add_argument("--sizes", default="1000,10000,100000",
+                    help="comma separated importer counts (10^3 .. 10^6)")
+    ap.add_argument("--only", default=",".join(CASES), help="comma separated cases")
+    ap.add_argument("--mem", action="store_true", help="trace python allocations (peak per case)")
+    args = ap.parse_args(argv)
+
+    global TRACE_MEMORY
+    TRACE_MEMORY = args.mem
+
+    sizes = [int(float(s)) for s in args.sizes.split(",") if s]
+    results = []
+    for name in [c.strip() for c in args.only.split(",") if c.strip()]:
+        fn = CASES[name]
+        for size in sizes:
+            results.append(fn(size))
+    return results
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,212 @@
+import mmap
+import os
+import struct
+from array import array
+from datetime import datetime, timezone
+from typing import Any, Iterable, List, Optional, Sequence
+
+try:  # vectorized path; everything also works (slower) without numpy
+    import numpy as np
+except ImportError:  # pragma: no cover
+    np = None
+
+# ---------------- COMPACT JOINER-ID SETS ----------------
+#  Per-link membership kept as two parallel columns sorted by id:
+#    ids    int64  joined_user_id
+#    stamps int32  +joined_at while active, -left_at once left
+#                  (seconds since STAMP_EPOCH, good until 2088)
+#  = 12 bytes per member. Snapshots are plain files in SESSION_DIR
+#  mapped with mmap, so a restart does not re-read the joins table and
+#  a leave event patches one stamp in place.
+# ---------------------------------------------------------
+
+STAMP_EPOCH = 1577836800  # 2020-01-01T00:00:00Z
+_HEADER = struct.Struct("<4sHxxQ")  # magic, version, n  (16 bytes, keeps ids 8-aligned)
+_MAGIC = b"JIDS"
+_VERSION = 1
+
+
+def to_stamp(value: Any) -> int:
+    """datetime / ISO string -> positive int32 stamp (>= 1)."""
+    if value is None or value == "":
+        return 1
+    if not isinstance(value, datetime):
+        try:
+            value = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+        except ValueError:
+            return 1
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return max(1, int(value.timestamp()) - STAMP_EPOCH)
+
+
+def from_stamp(stamp: int) -> datetime:
+    return datetime.fromtimestamp(abs(int(stamp)) + STAMP_EPOCH, timezone.utc)
+
+
+class MemberSet:
+    """Sorted joiner ids of one link with their join / leave stamps."""
+
+    __slots__ = ("ids", "stamps", "_mm")
+
+    def __init__(self, ids=None, stamps=None, _mm: Optional[mmap.mmap] = None):
+        if np is not None:
+            self.ids = np.asarray(ids if ids is not None else [], dtype="<i8")
+            self.stamps = np.asarray(stamps if stamps is not None else [], dtype="<i4")
+        else:
+            self.ids = ids if isinstance(ids, array) else array("q", ids or [])
+            self.stamps = stamps if isinstance(stamps, array) else array("i", stamps or [])
+        self._mm = _mm  # set while stamps are a writable view of a mapped snapshot
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @property
+    def nbytes(self) -> int:
+        return len(self.ids) * 12
+
+    # ---- build ----
+    @classmethod
+    def from_rows(cls, rows: Iterable[dict]) -> "MemberSet":
+        """From joins rows (joined_user_id, joined_at, left_at)."""
+        latest = {}
+        for r in rows:
+            uid = int(r["joined_user_id"])
+            stamp = -to_stamp(r["left_at"]) if r.get("left_at") else to_stamp(r.get("joined_at"))
+            latest[uid] = stamp
+        ids = sorted(latest)
+        return cls(ids, [latest[i] for i in ids])
+
+    # ---- lookups ----
+    def active_ids(self) -> List[int]:
+        if np is not None:
+            return self.ids[self.stamps > 0].tolist()
+        return [i for i, s in zip(self.ids, self.stamps) if s > 0]
+
+    def left_count(self) -> int:
+        if np is not None:
+            return int((self.stamps < 0).sum())
+        return sum(1 for s in self.stamps if s < 0)
+
+    def stamps_of(self, user_ids: Sequence[int]) -> List[int]:
+        """Stored stamp of each id (0 when unknown)."""
+        if np is not None:
+            if not len(self.ids):
+                return [0] * len(user_ids)
+            q = np.asarray(user_ids, dtype="<i8")
+            pos = np.minimum(np.searchsorted(self.ids, q), len(self.ids) - 1)
+            return np.where(self.ids[pos] == q, self.stamps[pos], 0).tolist()
+        stored = dict(zip(self.ids, self.stamps))
+        return [stored.get(u, 0) for u in user_ids]
+
+    def diff(self, user_ids: Sequence[int], joined: Sequence[int]) -> List[int]:
+        """
+        Positions in (user_ids, joined) that need a write: unknown ids, or a
+        join stamp newer than the stored join (missed leave) / leave (rejoin).
+        """
+        if np is not None:
+            f_ids = np.asarray(user_ids, dtype="<i8")
+            f_j = np.asarray(joined, dtype="<i4")
+            if not len(self.ids):
+                return list(range(len(f_ids)))
+            pos = np.minimum(np.searchsorted(self.ids, f_ids), len(self.ids) - 1)
+            found = self.ids[pos] == f_ids
+            need = ~found | (f_j > np.abs(self.stamps[pos]))
+            return np.nonzero(need)[0].tolist()
+        stored = dict(zip(self.ids, self.stamps))
+        out = []
+        for k, (u, j) in enumerate(zip(user_ids, joined)):
+            s = stored.get(u)
+            if s is None or j > abs(s):
+                out.append(k)
+        return out
+
+    # ---- updates ----
+    def merge_joined(self, user_ids: Sequence[int], joined: Sequence[int]) -> "MemberSet":
+        """New set with these ids active at these join stamps."""
+        if np is not None:
+            ids = np.concatenate([self.ids, np.asarray(user_ids, dtype="<i8")])
+            stamps = np.concatenate([self.stamps, np.asarray(joined, dtype="<i4")])
+            # last occurrence wins: reverse, unique keeps the first of each id
+            uniq, first = np.unique(ids[::-1], return_index=True)
+            return MemberSet(uniq, stamps[::-1][first])
+        latest = dict(zip(self.ids, self.stamps))
+        latest.update(zip(user_ids, joined))
+        ids = sorted(latest)
+        return MemberSet(ids, [latest[i] for i in ids])
+
+    def mark_left(self, user_ids: Iterable[int], when: Any = None) -> int:
+        """Flip active ids to left in place (works on a writable snapshot). Returns how many flipped."""
+        stamp = to_stamp(when or datetime.now(timezone.utc))
+        user_ids = list(user_ids)
+        if not user_ids or not len(self.ids):
+            return 0
+        if np is not None:
+            if not self.stamps.flags.writeable:  # read-only mapping: edit a private copy
+                self.stamps = self.stamps.copy()
+                self._mm = None
+            q = np.asarray(user_ids, dtype="<i8")
+            pos = np.minimum(np.searchsorted(self.ids, q), len(self.ids) - 1)
+            hit = pos[(self.ids[pos] == q) & (self.stamps[pos] > 0)]
+            self.stamps[hit] = -stamp
+            return int(len(hit))
+        from bisect import bisect_left
+
+        n = 0
+        for u in user_ids:
+            k = bisect_left(self.ids, u)
+            if k < len(self.ids) and self.ids[k] == u and self.stamps[k] > 0:
+                self.stamps[k] = -stamp
+                n += 1
+        return n
+
+    # ---- snapshots ----
+    def save(self, path: str):
+        """Atomic write (tmp + rename); readers keep their old mapping."""
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp = f"{path}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(_HEADER.pack(_MAGIC, _VERSION, len(self.ids)))
+            if np is not None:
+                f.write(np.ascontiguousarray(self.ids, dtype="<i8").tobytes())
+                f.write(np.ascontiguousarray(self.stamps, dtype="<i4").tobytes())
+            else:
+                f.write(self.ids.tobytes())
+                f.write(self.stamps.tobytes())
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: str, writable: bool = False) -> Optional["MemberSet"]:
+        """Map a snapshot (None if missing / unreadable). writable=True patches the file in place."""
+        try:
+            f = open(path, "r+b" if writable else "rb")
+        except OSError:
+            return None
+        with f:
+            try:
+                size = os.fstat(f.fileno()).st_size
+                if size < _HEADER.size:
+                    return None
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_WRITE if writable else mmap.ACCESS_READ)
+            except (OSError, ValueError):
+                return None
+        magic, version, n = _HEADER.unpack_from(mm, 0)
+        if magic != _MAGIC or version != _VERSION or size != _HEADER.size + n * 12:
+            mm.close()
+            return None
+        off = _HEADER.size
+        if np is not None:
+            ids = np.frombuffer(mm, dtype="<i8", count=n, offset=off)
+            stamps = np.frombuffer(mm, dtype="<i4", count=n, offset=off + n * 8)
+            return cls(ids, stamps, _mm=mm if writable else None)
+        ids = array("q", mm[off:off + n * 8])
+        stamps = array("i", mm[off + n * 8:off + n * 12])
+        mm.close()
+        return cls(ids, stamps)
+
+    def flush(self, path: str):
+        """Persist in-place edits: msync a writable mapping, else rewrite the file."""
+        if self._mm is not None:
+            self._mm.flush()
+        else:
+            self.save(path)
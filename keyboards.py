@@ -0,0 +1,162 @@
+import calendar
+from functools import lru_cache
+from typing import Iterable, List, Optional, Sequence, Set, Tuple
+
+from telethon import Button
+
+# ---------------- INLINE KEYBOARDS ----------------
+#  Memoized keyboard builders. Every keyboard is a tuple of tuples of
+#  buttons keyed by its inputs, so a callback that re-renders the same
+#  calendar / selection / link list gets the cached object back.
+#  Cached keyboards are shared: never mutate what these return.
+# ---------------------------------------------------
+
+KB_CACHE_SIZE = 4096
+LINK_PICKER_MAX = 10  # links shown in a picker
+
+Keyboard = Tuple[Tuple[Button, ...], ...]
+
+# ---- shared static rows / cells ----
+NOOP = Button.inline(" ", data=b"cal_noop")
+WEEKDAY_ROW = tuple(Button.inline(d, data=b"cal_noop") for d in ("Mo", "Tu", "We", "Th", "Fr", "Sa", "Su"))
+CAL_ACTIONS_ROW = (
+    Button.inline("✖ Cancel", data=b"cal_cancel"),
+    Button.inline("🔄 Reset", data=b"cal_reset"),
+)
+MSEL_ACTIONS_ROW = (
+    Button.inline("✅ Done", data=b"msel_done"),
+    Button.inline("✖ Cancel", data=b"msel_cancel"),
+)
+
+
+# ---------------- CALENDAR ----------------
+
+@lru_cache(maxsize=256)
+def _month_grid(year: int, month: int) -> Tuple[Tuple[Tuple[int, str], ...], ...]:
+    """Weeks of (day, 'YYYY-MM-DD') cells, day 0 = padding."""
+    return tuple(
+        tuple((d, f"{year:04d}-{month:02d}-{d:02d}" if d else "") for d in week)
+        for week in calendar.monthcalendar(year, month)
+    )
+
+
+@lru_cache(maxsize=256)
+def _nav_row(year: int, month: int) -> Tuple[Button, ...]:
+    return (
+        Button.inline("⬅️", data=f"cal_nav:prev:{year}:{month}".encode()),
+        Button.inline(f"{calendar.month_name[month]} {year}", data=b"cal_noop"),
+        Button.inline("➡️", data=f"cal_nav:next:{year}:{month}".encode()),
+    )
+
+
+@lru_cache(maxsize=KB_CACHE_SIZE)
+def _calendar_kb(year: int, month: int, start: Optional[str], end: Optional[str]) -> Keyboard:
+    rows = [_nav_row(year, month), WEEKDAY_ROW]
+    for week in _month_grid(year, month):
+        row = []
+        for day, dstr in week:
+            if not day:
+                row.append(NOOP)
+                continue
+            # ISO dates compare correctly as strings
+            if dstr == end:
+                label = f"🔴{day}"
+            elif dstr == start:
+                label = f"🟢{day}"
+            elif start and end and start < dstr < end:
+                label = f"•{day}"
+            else:
+                label = str(day)
+            row.append(Button.inline(label, data=f"cal_day:{dstr}".encode()))
+        rows.append(tuple(row))
+    rows.append(CAL_ACTIONS_ROW)
+    return tuple(rows)
+
+
+def _date_key(value: Optional[str]) -> Optional[str]:
+    return value[:10] if value else None
+
+
+def build_calendar_kb(year: int, month: int, selected_start: Optional[str], selected_end: Optional[str]) -> Keyboard:
+    """
+    Inline calendar for a month.
+    selected_start/end are 'YYYY-MM-DD' strings (for highlighting).
+    """
+    return _calendar_kb(year, month, _date_key(selected_start), _date_key(selected_end))
+
+
+# ---------------- MULTI-SELECT ----------------
+
+@lru_cache(maxsize=KB_CACHE_SIZE)
+def _multi_kb(n: int, mask: int) -> Keyboard:
+    rows, row = [], []
+    for i in range(1, n + 1):
+        label = f"✅ {i}" if mask >> (i - 1) & 1 else str(i)
+        row.append(Button.inline(label, data=f"msel:{i}".encode()))
+        if len(row) == 7:
+            rows.append(tuple(row))
+            row = []
+    if row:
+        rows.append(tuple(row))
+    rows.append(MSEL_ACTIONS_ROW)
+    return tuple(rows)
+
+
+def selection_mask(selected: Iterable[int]) -> int:
+    mask = 0
+    for i in selected:
+        mask |= 1 << i
+    return mask
+
+
+def multi_kb(n: int, selected: Set[int]) -> Keyboard:
+    """Generic multi-select keyboard (selected = 0-based indexes)."""
+    return _multi_kb(n, selection_mask(i for i in selected if 0 <= i < n))
+
+
+# ---------------- LINK PICKERS ----------------
+
+def _short_title(row: dict) -> str:
+    title = row.get("chat_title") or f"id:{row.get('chat_id')}"
+    return (title[:40] + "…") if len(title) > 40 else title
+
+
+@lru_cache(maxsize=64)
+def _cancel_button(data: bytes) -> Button:
+    return Button.inline("✖ Cancel", data=data)
+
+
+@lru_cache(maxsize=KB_CACHE_SIZE)
+def _link_picker_kb(prefix: str, links: Tuple[Tuple[int, str], ...], cancel_data: bytes) -> Keyboard:
+    rows = [(Button.inline(title, data=f"{prefix}:{link_id}".encode()),) for link_id, title in links]
+    rows.append((_cancel_button(cancel_data),))
+    return tuple(rows)
+
+
+def link_picker_kb(prefix: str, rows: Sequence[dict], cancel_data: bytes) -> Keyboard:
+    """One button per invite link (first LINK_PICKER_MAX) with `<prefix>:<id>` data + Cancel."""
+    links = tuple((int(r["id"]), _short_title(r)) for r in rows[:LINK_PICKER_MAX])
+    return _link_picker_kb(prefix, links, cancel_data)
+
+
+# ---------------- CACHE STATS ----------------
+
+CACHED_BUILDERS = {
+    "calendar": _calendar_kb,
+    "multi": _multi_kb,
+    "link_picker": _link_picker_kb,
+}
+
+
+def cache_info() -> List[Tuple[str, int, int, int]]:
+    """(builder, hits, misses, size) per memoized keyboard builder."""
+    out = []
+    for name, fn in CACHED_BUILDERS.items():
+        ci = fn.cache_info()
+        out.append((name, ci.hits, ci.misses, ci.currsize))
+    return out
+
+
+def cache_clear():
+    for fn in CACHED_BUILDERS.values():
+        fn.cache_clear()
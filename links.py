@@ -0,0 +1,78 @@
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# ---------------- INVITE-LINK REGISTRY ----------------
+#  The active invite_links rows of one owner, newest first, indexed by
+#  link id, chat id and invite hash. login.py keeps one per owner,
+#  builds it from a single list query and updates it write-through on
+#  save / delete, so handlers look links up without a DB round trip.
+#  Writes replace the row list instead of editing it, so a handler that
+#  is iterating `rows` across an await never sees it change. Frozen
+#  links stay in `rows` (their stats remain readable); `live()` skips them.
+# -------------------------------------------------------
+
+
+def invite_hash(full_link: str) -> str:
+    """t.me/+HASH or t.me/joinchat/HASH -> HASH"""
+    return full_link.rsplit("/", 1)[-1].lstrip("+").replace("joinchat/", "")
+
+
+class LinkRegistry:
+    """Active invite links of one owner."""
+
+    __slots__ = ("rows", "by_id", "by_chat", "by_hash")
+
+    def __init__(self, rows: Iterable[dict] = ()):
+        self._reindex(list(rows))
+
+    def _reindex(self, rows: List[dict]):
+        self.rows: List[dict] = rows  # newest first, like list_invite_links
+        self.by_id: Dict[int, dict] = {int(r["id"]): r for r in rows}
+        self.by_chat: Dict[int, List[dict]] = {}
+        self.by_hash: Dict[str, dict] = {}
+        for r in rows:
+            self.by_chat.setdefault(int(r["chat_id"]), []).append(r)
+            self.by_hash[invite_hash(r["invite_link"])] = r
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def get(self, link_id: int) -> Optional[dict]:
+        return self.by_id.get(int(link_id))
+
+    def in_chat(self, chat_id: int) -> List[dict]:
+        return self.by_chat.get(int(chat_id), [])
+
+    def with_hash(self, link_hash: str) -> Optional[dict]:
+        return self.by_hash.get(link_hash)
+
+    def live(self) -> List[dict]:
+        """Rows still synced: everything but frozen (dead on Telegram's side) links."""
+        return [r for r in self.rows if not r.get("frozen_at")]
+
+    def chat_hashes(self) -> Dict[int, set]:
+        """chat id -> invite hashes of the owner's live links in it."""
+        out: Dict[int, set] = {}
+        for r in self.live():
+            out.setdefault(int(r["chat_id"]), set()).add(invite_hash(r["invite_link"]))
+        return out
+
+    # ---- write-through ----
+    def put(self, row: dict):
+        """Insert / replace a saved row (same id or same chat + link) as the newest."""
+        key: Tuple[int, str] = (int(row["chat_id"]), row["invite_link"])
+        rest = [
+            r for r in self.rows
+            if int(r["id"]) != int(row["id"]) and (int(r["chat_id"]), r["invite_link"]) != key
+        ]
+        self._reindex([row] + rest)
+
+    def remove(self, link_ids: Iterable[int]):
+        gone = {int(i) for i in link_ids}
+        if gone & self.by_id.keys():
+            self._reindex([r for r in self.rows if int(r["id"]) not in gone])
+
+    def update(self, link_id: int, **fields):
+        """Set columns of a cached row (e.g. usage_count) without a refetch."""
+        r = self.by_id.get(int(link_id))
+        if r is not None:
+            r.update(fields)
@@ -1,16 +1,42 @@
 import os
 import re
-import calendar
+import csv
+import gzip
+import hashlib
+import itertools
+import json
+import logging
+import sys
+import tempfile
+import time
+import weakref
+from array import array
 
 import asyncio
 from datetime import datetime, timezone, timedelta
-from typing import Dict, List, Tuple, Set, Any, Optional
+from functools import wraps
+from typing import Dict, List, Tuple, Set, Any, Optional, Iterable, Iterator, Callable
 from dotenv import load_dotenv
-from supabase import create_client, Client
 from telethon import TelegramClient, events, errors, Button
 from telethon import types as tl_types  # for User/Chat/Channel/UpdateBotChatInviteRequester, InputUserEmpty
 from telethon.tl import functions, types
 from telethon.utils import get_peer_id
+
+from storage import Storage, make_storage
+from metrics import REGISTRY, timed_call, start_http_server
+import tracing
+from tracing import span, traced_handler, LoopWatchdog
+from profiler import SamplingProfiler, format_tasks
+from keyboards import build_calendar_kb, multi_kb, link_picker_kb
+from ratelimit import TokenBucket
+from idsets import STAMP_EPOCH, MemberSet, to_stamp
+from sessions import SqliteSessionStore, StoredSession
+from outbox import Outbox, OutboxItem, runs
+from links import LinkRegistry, invite_hash
+from router import Router
+from scheduler import FairScheduler
+import trend
+import archive
 # ---------------- ENV & GLOBALS ----------------
 
 load_dotenv()
@@ -24,21 +50,216 @@ SUPABASE_URL = os.getenv("SUPABASE_URL", "")
 SUPABASE_KEY = os.getenv("SUPABASE_KEY") or os.getenv("SUPABASE_SERVICE_ROLE_KEY", "")
 
 SESSION_DIR = os.getenv("SESSION_DIR", "sessions")
+SESSION_BACKEND = os.getenv("SESSION_BACKEND", "sqlite").lower()  # user-client sessions: sqlite | db | files
+SESSION_DB_PATH = os.path.join(SESSION_DIR, "sessions.db")  # SESSION_BACKEND=sqlite
+MEMBERS_DIR = os.path.join(SESSION_DIR, "members")  # per-link joiner-id snapshots (idsets.MemberSet)
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "supabase").lower()  # supabase | sqlite
+SQLITE_PATH = os.getenv("SQLITE_PATH") or os.path.join(SESSION_DIR, "joinbot.db")
+SUPABASE_BUCKET = os.getenv("SUPABASE_BUCKET", "")
+SUPABASE_RPC = os.getenv("SUPABASE_RPC", "0") == "1"  # set once the RPC functions (migrations 0004, 0005, 0009) are applied
 TOP_N = 14  # how many pinned chats to show in selection
+EXPORT_PAGE_SIZE = 1000  # rows per keyset page while streaming /export
+EXPORT_DOC_MAX_BYTES = 45 * 1024 * 1024  # bigger exports go to SUPABASE_BUCKET
+
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))  # 0 = no HTTP exposition
+ADMIN_UIDS: Set[int] = {int(x) for x in os.getenv("ADMIN_UIDS", "").replace(" ", "").split(",") if x}
+tracing.SLOW_HANDLER_SECONDS = float(os.getenv("TRACE_SLOW_SECONDS", "1.0"))  # 0 = don't log span trees
+LOOP_LAG_THRESHOLD = float(os.getenv("LOOP_LAG_THRESHOLD", "0.25"))  # seconds the loop may block
+PROFILE_MAX_SECONDS = 300  # upper bound for /profile <seconds>
+WARMUP_MAX_CLIENTS = int(os.getenv("WARMUP_MAX_CLIENTS", "50"))  # recent owners pre-connected at boot (0 = off)
+WARMUP_CONCURRENCY = int(os.getenv("WARMUP_CONCURRENCY", "8"))
+BOT_PROFILE_HASH_FILE = os.path.join(SESSION_DIR, "bot_profile.sha256")
+JOIN_REQUEST_RATE = float(os.getenv("JOIN_REQUEST_RATE", "25"))  # approve/decline RPCs per second per owner
+JOIN_REQUEST_PAGE = 100  # pending requests fetched per GetChatInviteImporters page
+JOIN_REQUEST_BATCH = 20  # HideChatJoinRequest calls sent per container
+# cold archive: rows that left this many days ago move to the bucket (0 = off; keep it
+# set once archives exist, reads of archived ranges depend on it). At least 2 days.
+ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", "0"))
+if 0 < ARCHIVE_AFTER_DAYS < 2:
+    ARCHIVE_AFTER_DAYS = 2
+ARCHIVE_MIN_ROWS = int(os.getenv("ARCHIVE_MIN_ROWS", "500"))  # smallest batch worth an archive object
+ARCHIVE_BATCH = 50_000  # rows per archive object
+ARCHIVE_PAGE = 1000  # rows per archivable_joins request (PostgREST returns at most 1000)
+ARCHIVE_INTERVAL = 6 * 3600  # seconds between background archival runs
+ARCHIVE_CACHE_MAX = 64  # decoded archive objects kept in memory
+OWNER_PAGE = 1000  # owners per session_owners request (background passes over every owner)
+OUTBOX_PATH = os.path.join(SESSION_DIR, "outbox.db")  # queued join / leave writes (outbox.Outbox)
+OUTBOX_BATCH = 500  # outbox items applied per round
+OUTBOX_MAX_ATTEMPTS = 100  # then an item is parked as dead (backoff caps at 5 min, ~8h in total)
+OUTBOX_POISON_ATTEMPTS = 6  # for an item that fails while the rest of its batch lands (~2 min in total)
+OUTBOX_SETTLE_SECONDS = 3.0  # a sync waits this long for its writes to land before returning
+SYNC_SLOTS = int(os.getenv("SYNC_SLOTS", "8"))  # link syncs running at once, all owners together
+SYNC_OWNER_SLOTS = int(os.getenv("SYNC_OWNER_SLOTS", "2"))  # link syncs running at once for one owner
+SYNC_COST_MEMBERS = 1000  # scheduler cost of a link sync = 1 + members / this
+LEAVE_PROBE_INTERVAL = float(os.getenv("LEAVE_PROBE_MINUTES", "60")) * 60  # leave probe period of links with unchanged usage
+LINK_REGISTRY_MAX = 10_000  # owners whose invite links stay cached (links.LinkRegistry)
+LINK_RECONCILE_INTERVAL = float(os.getenv("LINK_RECONCILE_HOURS", "6")) * 3600  # dead-link check period (0 = off)
+DIALOGS_RELOAD_INTERVAL = 600  # seconds before a chat-cache miss may reload a client's dialogs again
+REAP_CHUNK = 500  # join rows of a removed link deleted per request
+REAP_PAUSE = 0.2  # seconds between chunks, so other writers get the table
+REAP_MAX_LINKS = 100  # removed links picked up per reaper pass
+REAP_INTERVAL = 600  # seconds between passes when nothing wakes the reaper (retries, resume)
+REAP_OUTBOX_WAIT = 30  # seconds the reaper waits for a removed link's queued writes before retrying later
+
+
+def check_config():
+    """Fail fast on missing credentials (called at startup, not at import)."""
+    assert API_ID and API_HASH and BOT_TOKEN, "Set API_ID, API_HASH, BOT_TOKEN in .env"
+    if STORAGE_BACKEND == "supabase":
+        assert SUPABASE_URL and SUPABASE_KEY, "Set SUPABASE_URL and SUPABASE_KEY / SUPABASE_SERVICE_ROLE_KEY in .env"
+    assert SESSION_BACKEND in ("sqlite", "db", "files"), "SESSION_BACKEND must be sqlite, db or files"
+
 
+os.makedirs(SESSION_DIR, exist_ok=True)
 
+store: Storage = make_storage(
+    STORAGE_BACKEND,
+    supabase_url=SUPABASE_URL,
+    supabase_key=SUPABASE_KEY,
+    bucket=SUPABASE_BUCKET,
+    sqlite_path=SQLITE_PATH,
+    archives=ARCHIVE_AFTER_DAYS > 0,
+    rpc=SUPABASE_RPC,
+)
+
+# where user-client auth keys live (sessions.StoredSession); None = one .session file per owner
+if SESSION_BACKEND == "db":
+    session_store = store
+elif SESSION_BACKEND == "files":
+    session_store = None
+else:
+    session_store = SqliteSessionStore(SESSION_DB_PATH)
+
+outbox = Outbox(OUTBOX_PATH)
+
+
+
+# ---------------- METRICS ----------------
+
+DB_CALLS = REGISTRY.counter("joinbot_db_calls_total", "sp_* storage calls by op and status")
+DB_SECONDS = REGISTRY.histogram("joinbot_db_call_seconds", "sp_* storage call latency")
+MT_CALLS = REGISTRY.counter("joinbot_mtproto_calls_total", "MTProto requests by type and status")
+MT_SECONDS = REGISTRY.histogram("joinbot_mtproto_call_seconds", "MTProto request latency")
+FLOOD_WAITS = REGISTRY.counter("joinbot_flood_waits_total", "FloodWait occurrences by request type and outcome")
+FLOOD_WAIT_SECONDS = REGISTRY.counter("joinbot_flood_wait_seconds_total", "Seconds of FloodWait imposed by Telegram")
+SYNC_SECONDS = REGISTRY.histogram("joinbot_sync_link_seconds", "sync_importers_to_db time per link")
+SYNC_SKIPPED = REGISTRY.counter("joinbot_sync_links_skipped_total", "Links not re-synced because their usage counter was unchanged")
+SYNC_LAST_SECONDS = REGISTRY.gauge("joinbot_sync_link_last_seconds", "Duration of the most recent link sync (any link)")
+SYNC_QUEUE_WAIT = REGISTRY.histogram("joinbot_sync_queue_wait_seconds", "Time a link sync waited for a scheduler slot, by lane")
+SYNC_QUEUE_POSITION = REGISTRY.histogram(
+    "joinbot_sync_queue_position", "Link syncs already waiting in the lane when one was queued",
+    buckets=(0, 1, 2, 5, 10, 25, 50, 100, 250, 500, 1000),
+)
+JOIN_REQUESTS = REGISTRY.counter("joinbot_join_requests_total", "Join requests handled by action, method and outcome")
+ARCHIVED_ROWS = REGISTRY.counter("joinbot_archived_rows_total", "Join rows moved from the joins table to archive objects")
+REAPED_ROWS = REGISTRY.counter("joinbot_reaped_rows_total", "Join rows of removed links deleted by the reaper")
+LINKS_FROZEN = REGISTRY.counter("joinbot_links_frozen_total", "Invite links frozen as dead on Telegram's side, by reason")
+OUTBOX_ITEMS = REGISTRY.counter("joinbot_outbox_items_total", "Outbox items by op and outcome (queued / applied / retry / dead / dropped)")
+STARTUP_SECONDS = REGISTRY.gauge("joinbot_startup_phase_seconds", "Duration of each startup phase")
+REGISTRY.gauge(
+    "joinbot_user_client_cache_size", "Connected user clients in USER_CLIENT_CACHE",
+    fn=lambda: {(): len(USER_CLIENT_CACHE)},
+)
+REGISTRY.gauge(
+    "joinbot_outbox_size", "Outbox items waiting to be applied (pending) or given up on (dead)",
+    fn=lambda: {(("state", k),): v for k, v in outbox.stats().items() if k != "oldest_age"},
+)
+REGISTRY.gauge(
+    "joinbot_outbox_oldest_seconds", "Age of the oldest pending outbox item",
+    fn=lambda: {(): outbox.stats()["oldest_age"]},
+)
+REGISTRY.gauge(
+    "joinbot_reaper_links", "Removed links whose join rows are being deleted right now",
+    fn=lambda: {(): len(reap_progress)},
+)
+REGISTRY.gauge(
+    "joinbot_sync_queue", "Link syncs waiting / running in the scheduler, by lane",
+    fn=lambda: {
+        (("lane", lane), ("state", k)): st[k]
+        for lane, st in sync_scheduler.stats().items() for k in ("waiting", "running")
+    },
+)
+REGISTRY.gauge(
+    "joinbot_state_entries", "Entries in the in-memory state dicts",
+    fn=lambda: {(("dict", name),): len(d) for name, d in STATE_DICTS.items()},
+)
+
+
+def _sync_admitted(lane: str, waited: float, position: int):
+    SYNC_QUEUE_WAIT.observe(waited, lane=lane)
+    SYNC_QUEUE_POSITION.observe(position, lane=lane)
+
+
+# fair share of link syncs between owners; interactive requests first
+sync_scheduler = FairScheduler(SYNC_SLOTS, SYNC_OWNER_SLOTS, on_admit=_sync_admitted)
+
+
+def db_op(fn):
+    """Record count / latency of an sp_* call under its function name (+ tracing span)."""
+    timed = timed_call(DB_CALLS, DB_SECONDS, "op", fn.__name__)(fn)
+
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        with span(fn.__name__):
+            return timed(*args, **kwargs)
+
+    return wrapper
+
+
+class MeteredClient(TelegramClient):
+    """
+    TelegramClient that records every MTProto request (type, latency, FloodWaits)
+    and runs every registered event handler inside a tracing span.
+    """
 
-assert API_ID and API_HASH and BOT_TOKEN, "Set API_ID, API_HASH, BOT_TOKEN in .env"
-assert SUPABASE_URL and SUPABASE_KEY, "Set SUPABASE_URL and SUPABASE_KEY / SUPABASE_SERVICE_ROLE_KEY in .env"
+    def add_event_handler(self, callback, event=None, traced: bool = True):
+        """traced=False for dispatchers whose routes carry their own span (router.Router)."""
+        return super().add_event_handler(traced_handler(callback) if traced else callback, event)
 
-os.makedirs(SESSION_DIR, exist_ok=True)
+    async def __call__(self, request, ordered=False, flood_sleep_threshold=None):
+        name = "batch" if isinstance(request, list) else type(request).__name__
+        t0 = time.perf_counter()
+        status = "ok"
+        try:
+            with span(f"mtproto:{name}"):
+                return await super().__call__(request, ordered=ordered, flood_sleep_threshold=flood_sleep_threshold)
+        except errors.FloodWaitError as ex:
+            status = "flood"
+            FLOOD_WAITS.inc(request=name, outcome="raised")
+            FLOOD_WAIT_SECONDS.inc(ex.seconds, request=name)
+            raise
+        except BaseException:
+            status = "error"
+            raise
+        finally:
+            MT_SECONDS.observe(time.perf_counter() - t0, request=name)
+            MT_CALLS.inc(request=name, status=status)
 
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+
+class _FloodSleepCounter(logging.Handler):
+    """Telethon sleeps through short FloodWaits itself and only logs them; count those too."""
+
+    def emit(self, record: logging.LogRecord):
+        if "flood wait" in str(record.msg) and isinstance(record.args, tuple) and len(record.args) >= 4:
+            FLOOD_WAITS.inc(request=str(record.args[3]), outcome="slept")
+            FLOOD_WAIT_SECONDS.inc(float(record.args[1]), request=str(record.args[3]))
+
+
+_flood_log = logging.getLogger("telethon.client.users")
+_flood_log.setLevel(logging.INFO)
+_flood_log.addHandler(_FloodSleepCounter())
 
 
 # ---------------- SUPABASE + SUBSCRIPTION HELPERS ----------------
 
-bot = TelegramClient("join_counter_bot", API_ID, API_HASH).start(bot_token=BOT_TOKEN)
+# constructed here so handlers can register; connected by bot.start() in __main__
+bot = MeteredClient("join_counter_bot", API_ID, API_HASH)
+
+# commands, callback buttons and conversation text all go through one router
+router = Router(wrap=traced_handler)
+bot.add_event_handler(router.on_message, events.NewMessage(), traced=False)
+bot.add_event_handler(router.on_callback, events.CallbackQuery(), traced=False)
 
 # ---- in-memory state ----
 login_state: Dict[int, Dict[str, Any]] = {}
@@ -46,21 +267,57 @@ select_state: Dict[int, Dict[str, Any]] = {}   # selection flows (create/remove
 # create link preference (approve vs normal)
 create_link_pref: Dict[int, str] = {}  # uid -> "approval" | "normal"
 USER_CLIENT_CACHE: Dict[int, TelegramClient] = {}
+link_registry: Dict[int, LinkRegistry] = {}  # owner uid -> active links, least recently used first
+link_counters: Dict[int, Tuple[int, int]] = {}  # invite_link id -> (usage, requested) at last full sync
+leave_probed: Dict[int, float] = {}  # invite_link id -> time.monotonic() of its last leave probe
+# one connect per uid (warm-up vs first command); an entry lives only while someone holds or awaits it
+_client_locks: "weakref.WeakValueDictionary[int, asyncio.Lock]" = weakref.WeakValueDictionary()
+# user client -> time.monotonic() of its last full get_dialogs (resolve_peer), and the lock around it
+dialogs_loaded: "weakref.WeakKeyDictionary[TelegramClient, float]" = weakref.WeakKeyDictionary()
+_dialog_locks: "weakref.WeakKeyDictionary[TelegramClient, asyncio.Lock]" = weakref.WeakKeyDictionary()
 stats_state: Dict[int, Dict[str, Any]] = {}    # stats link selection context
 date_select_state: Dict[int, Dict[str, Any]] = {}  # uid -> {step, link_id, month, year, start_date, end_date, ...}
+export_state: Dict[int, Dict[str, Any]] = {}  # uid -> {label, since, until, fmt}
+trend_state: Dict[int, str] = {}  # uid -> granularity picked in /trend
+overview_state: Dict[int, bool] = {}  # uid -> /overview link picker open
 
 # per-message stats pagination state
 stats_pages: Dict[Tuple[int, int], Dict[str, Any]] = {}
 
+STATE_DICTS: Dict[str, Dict] = {
+    "login_state": login_state,
+    "select_state": select_state,
+    "create_link_pref": create_link_pref,
+    "stats_state": stats_state,
+    "date_select_state": date_select_state,
+    "export_state": export_state,
+    "trend_state": trend_state,
+    "overview_state": overview_state,
+    "stats_pages": stats_pages,
+}
+
 PHONE_RE = re.compile(r"^\+\d{6,15}$", re.IGNORECASE)
 OTP_RE = re.compile(r"^(?:HELLO\s*)?(\d{4,8})$", re.IGNORECASE)
 
 
 # ---------------- TELEGRAM HELPERS ----------------
 
-def session_path(uid: int, phone: str) -> str:
+def session_name(uid: int, phone: str) -> str:
+    """Session key stored in user_sessions.session_file (also the legacy file name)."""
     digits = "".join([c for c in phone if c.isdigit()])
-    return os.path.join(SESSION_DIR, f"{uid}_{digits}.session")
+    return f"{uid}_{digits}.session"
+
+
+def user_session(name: str):
+    """Telethon session for a user client: StoredSession, or the .session file path (files backend)."""
+    legacy = os.path.join(SESSION_DIR, name)
+    if session_store is None:
+        return legacy
+    return StoredSession(session_store, name, legacy_path=legacy)
+
+
+def new_user_client(name: str) -> TelegramClient:
+    return MeteredClient(user_session(name), API_ID, API_HASH)
 
 
 async def safe_connect(client: TelegramClient, retries: int = 3, delay: int = 2):
@@ -95,6 +352,31 @@ def title_of(ent) -> str:
     return f"id:{getattr(ent, 'id', '')}"
 
 
+async def resolve_peer(uc: TelegramClient, chat_id: int):
+    """
+    InputPeer of a chat. On an entity-cache miss (a chat the session has not
+    seen yet) load every dialog once, at most every DIALOGS_RELOAD_INTERVAL
+    per client, and retry. ValueError if the chat is still unknown.
+    """
+    try:
+        return await uc.get_input_entity(chat_id)
+    except ValueError:
+        pass
+    lock = _dialog_locks.get(uc)
+    if lock is None:
+        lock = _dialog_locks[uc] = asyncio.Lock()
+    async with lock:
+        try:
+            return await uc.get_input_entity(chat_id)  # loaded by whoever held the lock
+        except ValueError:
+            last = dialogs_loaded.get(uc)
+            if last is not None and time.monotonic() - last < DIALOGS_RELOAD_INTERVAL:
+                raise
+        await uc.get_dialogs(limit=None)
+        dialogs_loaded[uc] = time.monotonic()
+    return await uc.get_input_entity(chat_id)
+
+
 async def top_dialog_pairs(client: TelegramClient, limit: int = TOP_N) -> List[Tuple[int, str]]:
     """
     Return only PRIVATE groups/channels (no 1-1 chats),
@@ -154,22 +436,6 @@ def numbered_list_from_pairs(pairs: List[Tuple[int, str]]) -> str:
     return "\n".join([f"{i + 1}. {pairs[i][1]}" for i in range(len(pairs))])
 
 
-def multi_kb(n: int, selected: Set[int]) -> List[List[Button]]:
-    """Generic multi-select keyboard."""
-    rows, row = [], []
-    for i in range(1, n + 1):
-        label = f"{'✅ ' if (i - 1) in selected else ''}{i}"
-        row.append(Button.inline(label, data=f"msel:{i}".encode()))
-        if len(row) == 7:
-            rows.append(row)
-            row = []
-    if row:
-        rows.append(row)
-    rows.append([Button.inline("✅ Done", data=b"msel_done"),
-                 Button.inline("✖ Cancel", data=b"msel_cancel")])
-    return rows
-
-
 # ---------------- SUPABASE + SUBSCRIPTION HELPERS ----------------
 
 
@@ -180,91 +446,106 @@ def multi_kb(n: int, selected: Set[int]) -> List[List[Button]]:
 
 
 
+@db_op
 def sp_get_session(uid: int) -> Optional[dict]:
-    res = supabase.table("user_sessions").select("*").eq("user_id", uid).limit(1).execute()
-    return res.data[0] if res.data else None
+    return store.get_session(uid)
 
 
+@db_op
 def sp_upsert_session(uid: int, phone: str, session_file: str):
-    payload = {
-        "user_id": uid,
-        "phone": phone,
-        "session_file": session_file,
-        "is_active": True,
-        "created_at": datetime.now(timezone.utc).isoformat(),
-    }
-    try:
-        supabase.table("user_sessions").upsert(payload, on_conflict="user_id").execute()
-    except Exception:
-        existing = supabase.table("user_sessions").select("user_id").eq("user_id", uid).limit(1).execute()
-        if existing and existing.data:
-            supabase.table("user_sessions").update(payload).eq("user_id", uid).execute()
-        else:
-            supabase.table("user_sessions").insert(payload).execute()
+    store.upsert_session(uid, phone, session_file)
 
 
+@db_op
 def sp_delete_session(uid: int):
-    supabase.table("user_sessions").delete().eq("user_id", uid).execute()
+    store.delete_session(uid)
+
+
+@db_op
+def sp_session_owners(after: int, limit: int) -> List[dict]:
+    return store.session_owners(after, limit)
+
+
+async def iter_session_owners(page_size: int = OWNER_PAGE):
+    """user_id of every owner with an active session, one keyset page per worker-thread call."""
+    after = 0
+    while True:
+        page = await asyncio.to_thread(sp_session_owners, after, page_size)
+        for r in page:
+            yield int(r["user_id"])
+        if len(page) < page_size:
+            return
+        after = int(page[-1]["user_id"])
 
 
+@db_op
 def sp_save_invite_link(
     uid: int,
     chat_id: int,
     chat_title: str,
     link: str,
     link_type: str,   # 👈 NEW
-):
-    supabase.table("invite_links").upsert(
-        {
-            "user_id": uid,
-            "chat_id": chat_id,
-            "chat_title": chat_title,
-            "invite_link": link,
-            "link_type": link_type,   # ✅ SAVE TYPE
-            "is_active": True,
-            "created_at": datetime.now(timezone.utc).isoformat(),
-        },
-        on_conflict="user_id,chat_id,invite_link",
-    ).execute()
+) -> Optional[dict]:
+    row = store.save_invite_link(uid, chat_id, chat_title, link, link_type)
+    reg = link_registry.get(uid)
+    if reg is not None:
+        if row:
+            reg.put(row)
+        else:  # backend did not echo the row: refetch on next use
+            link_registry.pop(uid, None)
+    return row
+
+
+@db_op
+def sp_list_invite_links(uid: int) -> List[dict]:
+    """Straight from the DB; handlers use owner_links(uid)."""
+    return store.list_invite_links(uid)
 
 
-def sp_list_invite_links(uid: int) -> List[dict]:
-    res = (
-        supabase.table("invite_links")
-        .select("*")
-        .eq("user_id", uid)
-        .eq("is_active", True)
-        .order("created_at", desc=True)
-        .execute()
-    )
-    return res.data or []
+def owner_links(uid: int) -> LinkRegistry:
+    """Cached active invite links of an owner (one list query on a miss, write-through after)."""
+    return _cached(link_registry, uid, LINK_REGISTRY_MAX, lambda: LinkRegistry(sp_list_invite_links(uid)))
 
 
+@db_op
 def sp_soft_delete_links(uid: int, link_ids: List[int]):
     """
-    Remove selected invite_links and all their join rows from the DB.
+    Tombstone selected invite_links (removed_at set, is_active = false):
+    gone from every list at once; the reaper deletes their join rows in
+    the background.
     """
     if not link_ids:
         return
+    store.tombstone_links(uid, link_ids)
+    removed_links.update(link_ids)
+    _reap_wake.set()
+    reg = link_registry.get(uid)
+    if reg is not None:
+        reg.remove(link_ids)
+
+
+@db_op
+def sp_set_link_counters(link_id: int, usage: int, requested: int):
+    store.set_link_counters(link_id, usage, requested)
 
-    # 1) delete join rows
-    supabase.table("joins") \
-        .delete() \
-        .eq("user_id", uid) \
-        .in_("invite_link_id", link_ids) \
-        .execute()
 
-    # 2) delete invite_links rows
-    supabase.table("invite_links") \
-        .delete() \
-        .eq("user_id", uid) \
-        .in_("id", link_ids) \
-        .execute()
+@db_op
+def sp_freeze_links(uid: int, link_ids: List[int], reason: str):
+    """Freeze dead links: they keep their rows and counts but leave the sync / leave paths."""
+    if not link_ids:
+        return
+    store.freeze_links(uid, link_ids, reason)
+    reg = link_registry.get(uid)
+    if reg is not None:
+        frozen_at = datetime.now(timezone.utc).isoformat()
+        for link_id in link_ids:
+            reg.update(link_id, frozen_at=frozen_at, frozen_reason=reason)
 
 
-def sp_replace_joins_for_link(uid: int, invite_link_id: int, rows: List[dict]):
+async def sp_replace_joins_for_link(uid: int, invite_link_id: int, rows: List[dict]):
     """
-    Upsert join rows WITHOUT usernames.
+    Upsert join rows WITHOUT usernames (queued in the outbox, applied by drain_outbox).
+    Callers pass only new / rejoined rows (see MemberSet.diff).
     Important:
       - Unique user per link (won't double count)
       - If user re-joins, we CLEAR left_at so "current joined" becomes correct.
@@ -287,24 +568,40 @@ def sp_replace_joins_for_link(uid: int, invite_link_id: int, rows: List[dict]):
             "left_seen_at": None,
         })
 
-    supabase.table("joins").upsert(
-        clean_rows,
-        on_conflict="user_id,chat_id,invite_link_id,joined_user_id"
-    ).execute()
+    await queue_writes("upsert_joins", [
+        (f"join:{uid}:{r['invite_link_id']}:{r['joined_user_id']}:{r['joined_at']}", r) for r in clean_rows
+    ], link=(uid, invite_link_id))
 
 
-def _count_from_response(res) -> int:
-    try:
-        if hasattr(res, "count") and res.count is not None:
-            return int(res.count)
-    except Exception:
-        pass
-    try:
-        return len(res.data or [])
-    except Exception:
-        return 0
+@db_op
+def sp_upsert_joins(rows: List[dict]):
+    store.upsert_joins(rows)
+
+
+async def sp_mark_left_members(uid: int, invite_link_id: int, joined_user_ids: List[int], reason: str):
+    """Queue a left mark (timestamped now) for these joiners of one link."""
+    if not joined_user_ids:
+        return
+    when = datetime.now(timezone.utc).isoformat()
+    digest = hashlib.sha1(",".join(map(str, joined_user_ids)).encode()).hexdigest()[:16]
+    await queue_writes("mark_left_members", [(
+        f"left:{uid}:{invite_link_id}:{when}:{digest}",
+        {"uid": uid, "invite_link_id": invite_link_id, "ids": list(joined_user_ids), "reason": reason, "when": when},
+    )], link=(uid, invite_link_id))
+
 
+@db_op
+def sp_mark_left_members_now(uid: int, invite_link_id: int, joined_user_ids: List[int], reason: str, when: str):
+    store.mark_left_members(uid, invite_link_id, joined_user_ids, reason, when=when)
 
+
+@db_op
+def sp_mark_members_left(chat_id: int, leaves: List[dict]) -> List[dict]:
+    """Latest open join row of these members (joined_user_id, reason, when), per owner tracking the chat, marked left."""
+    return store.mark_members_left(chat_id, leaves)
+
+
+@db_op
 def sp_count_joins_for_link(
     uid: int,
     invite_link_id: int,
@@ -312,68 +609,63 @@ def sp_count_joins_for_link(
     until: Optional[datetime] = None,
 ) -> int:
     """Count joins for a specific invite_link."""
-    q = (
-        supabase.table("joins")
-        .select("id", count="exact")
-        .eq("user_id", uid)
-        .eq("invite_link_id", invite_link_id)
-    )
-    if since:
-        q = q.gte("joined_at", since.isoformat())
-    if until:
-        q = q.lte("joined_at", until.isoformat())
-    res = q.execute()
-    return _count_from_response(res)
+    return store.count_joins(uid, invite_link_id, since=since, until=until)
 
 
+@db_op
 def sp_count_left_for_link(
     uid: int,
     invite_link_id: int,
     since: Optional[datetime] = None,
     until: Optional[datetime] = None,
 ) -> int:
-    q = (
-        supabase.table("joins")
-        .select("id", count="exact")
-        .eq("user_id", uid)
-        .eq("invite_link_id", invite_link_id)
-        .not_.is_("left_at", "null")
-    )
-    if since:
-        q = q.gte("joined_at", since.isoformat())
-    if until:
-        q = q.lte("joined_at", until.isoformat())
-    res = q.execute()
-    return _count_from_response(res)
+    return store.count_left(uid, invite_link_id, since=since, until=until)
 
 
+@db_op
 def sp_fetch_joins_for_link(
     uid: int,
     invite_link_id: int,
     since: Optional[datetime] = None,
     until: Optional[datetime] = None,
-    offset: int = 0,
+    after: Optional[Tuple[str, int]] = None,
     limit: int = 20,
+    desc: bool = True,
+    columns: str = "*",
 ) -> List[dict]:
     """
     Fetch a page of join rows for one invite_link, newest first.
+    Keyset paging: pass the (joined_at, id) of the last row of the
+    previous page as `after` (no OFFSET, so every page costs the same).
     """
-    q = (
-        supabase.table("joins")
-        .select("*")
-        .eq("user_id", uid)
-        .eq("invite_link_id", invite_link_id)
+    return store.fetch_joins(
+        uid, invite_link_id, since=since, until=until,
+        after=after, limit=limit, desc=desc, columns=columns,
     )
-    if since:
-        q = q.gte("joined_at", since.isoformat())
-    if until:
-        q = q.lte("joined_at", until.isoformat())
 
-    # newest first
-    q = q.order("joined_at", desc=True).range(offset, offset + limit - 1)
 
-    res = q.execute()
-    return res.data or []
+def sp_iter_joins_for_link(
+    uid: int,
+    invite_link_id: int,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    page_size: int = 1000,
+    columns: str = "*",
+) -> Iterator[dict]:
+    """Yield every join row for a link (oldest first), one keyset page at a time."""
+    after: Optional[Tuple[str, int]] = None
+    while True:
+        page = sp_fetch_joins_for_link(
+            uid, invite_link_id, since=since, until=until,
+            after=after, limit=page_size, desc=False, columns=columns,
+        )
+        if not page:
+            return
+        yield from page
+        if len(page) < page_size:
+            return
+        last = page[-1]
+        after = (last["joined_at"], int(last["id"]))
 
 
 def _safe_ascii(s: str) -> str:
@@ -387,13 +679,29 @@ def _safe_ascii(s: str) -> str:
 
 # ---------------- STATS PAGE RENDER HELPER ----------------
 
+STATS_PAGE_COLUMNS = "id,joined_user_id,joined_at,left_at"
+
+
+def _fetch_stats_page(uid: int, ctx: Dict[str, Any], after: Optional[Tuple[str, int]]) -> "asyncio.Future":
+    """Fetch one joiner page for a stats context in a worker thread."""
+    return asyncio.ensure_future(asyncio.to_thread(
+        sp_fetch_joins_for_link,
+        uid, ctx["link_id"],
+        since=ctx["since"], until=ctx["until"],
+        after=after, limit=ctx["page_size"], columns=STATS_PAGE_COLUMNS,
+    ))
+
+
 async def render_stats_page(event, uid: int, ctx: Dict[str, Any]):
     """
-    FAST summary stats only:
-    - Total joins (unique users ever joined via link)
+    Summary stats + one page of the joiner list:
+    - Total joins (unique users ever joined via link; a rejoin after the
+      old row was archived counts again, see COLD ARCHIVE)
     - Total left
     - Current joined = joins - left
-    - No user IDs, no join list
+    - Joined user IDs, newest first, keyset-paged by (joined_at, id)
+    ctx["cursors"][i] is the cursor page i starts after; the next page is
+    prefetched in the background while the user reads this one.
     """
     link_id = ctx["link_id"]
     label = ctx["label"]
@@ -403,25 +711,31 @@ async def render_stats_page(event, uid: int, ctx: Dict[str, Any]):
     title = ctx["title"]
     link = ctx["link"]
     created_at = ctx.get("created_at")
+    page = ctx["page"]
+    page_size = ctx["page_size"]
+    after = ctx["cursors"][page]
 
     IST = timezone(timedelta(hours=5, minutes=30))
 
     # left count (same filter range)
-    left_q = (
-        supabase.table("joins")
-        .select("id", count="exact")
-        .eq("user_id", uid)
-        .eq("invite_link_id", link_id)
-        .not_.is_("left_at", "null")
-    )
-    if since:
-        left_q = left_q.gte("joined_at", since.isoformat())
-    if until:
-        left_q = left_q.lte("joined_at", until.isoformat())
-    left_count = _count_from_response(left_q.execute())
+    _, left_count = await link_window_counts(uid, link_id, since=since, until=until)
 
     active_count = total - left_count
 
+    # joiner page: use the prefetched one when it is for this cursor
+    pending = ctx.pop("prefetch", None)
+    if pending and pending[0] == after:
+        fut = pending[1]
+    else:
+        if pending:
+            pending[1].cancel()
+        fut = _fetch_stats_page(uid, ctx, after)
+    try:
+        page_rows = await fut
+    except Exception as ex:
+        print("stats page fetch error:", ex)
+        page_rows = []
+
     lines: List[str] = []
     lines.append(f"📊 **{label} stats**")
     lines.append(f"`{title}`")
@@ -445,15 +759,45 @@ async def render_stats_page(event, uid: int, ctx: Dict[str, Any]):
     lines.append(f"👥 Total joins: `{total}`")
     lines.append(f"🚪 Total left: `{left_count}`")
     lines.append(f"🟢 Current joined: `{active_count}`")
+    if ctx.get("pending") is not None:
+        lines.append(f"⏳ Pending requests: `{ctx['pending']}`")
 
-    buttons = [[Button.inline("✖ Close", data=b"stats_page:close")]]
+    if page_rows:
+        lines.append("")
+        lines.append(f"🧾 Joiners (page {page + 1}):")
+        for i, r in enumerate(page_rows, start=page * page_size + 1):
+            try:
+                j_ist = datetime.fromisoformat(str(r["joined_at"]).replace("Z", "+00:00")).astimezone(IST)
+                j_str = j_ist.strftime("%d %b %H:%M")
+            except Exception:
+                j_str = str(r.get("joined_at") or "")[:16]
+            mark = " 🚪" if r.get("left_at") else ""
+            lines.append(f"{i}. `{r['joined_user_id']}` — {j_str}{mark}")
+
+    has_next = len(page_rows) == page_size and (page + 1) * page_size < total
+    nav: List[Button] = []
+    if page > 0:
+        nav.append(Button.inline("⬅️ Prev", data=b"stats_page:prev"))
+    if has_next:
+        last = page_rows[-1]
+        next_after = (last["joined_at"], int(last["id"]))
+        if len(ctx["cursors"]) > page + 1:
+            ctx["cursors"][page + 1] = next_after
+        else:
+            ctx["cursors"].append(next_after)
+        ctx["prefetch"] = (next_after, _fetch_stats_page(uid, ctx, next_after))
+        nav.append(Button.inline("Next ➡️", data=b"stats_page:next"))
+
+    buttons = [nav] if nav else []
+    if ctx.get("pending"):
+        buttons.append(join_request_action_kb(link_id)[0])
+    buttons.append([Button.inline("✖ Close", data=b"stats_page:close")])
     await event.edit("\n".join(lines), parse_mode="md", buttons=buttons)
 
 
 # ---------------- USER CLIENT HANDLING ----------------
 
-async def get_user_client(uid: int) -> TelegramClient:
-    """Return cached TelegramClient for this user (login session)."""
+def _cached_client(uid: int) -> Optional[TelegramClient]:
     client = USER_CLIENT_CACHE.get(uid)
     if client:
         try:
@@ -461,21 +805,34 @@ async def get_user_client(uid: int) -> TelegramClient:
                 return client
         except Exception:
             pass
+    return None
+
+
+async def get_user_client(uid: int, sess: Optional[dict] = None) -> TelegramClient:
+    """Return cached TelegramClient for this user (login session)."""
+    client = _cached_client(uid)
+    if client:
+        return client
+
+    lock = _client_locks.setdefault(uid, asyncio.Lock())
+    async with lock:
+        client = _cached_client(uid)  # connected while we waited
+        if client:
+            return client
 
-    sess = sp_get_session(uid)
-    if not sess:
-        raise RuntimeError("No saved session. Use /login first.")
+        sess = sess or sp_get_session(uid)
+        if not sess:
+            raise RuntimeError("No saved session. Use /login first.")
 
-    local = os.path.join(SESSION_DIR, sess["session_file"])
-    client = TelegramClient(local, API_ID, API_HASH)
-    await safe_connect(client)
+        client = new_user_client(sess["session_file"])
+        await safe_connect(client)
 
-    if not await client.is_user_authorized():
-        await client.disconnect()
-        raise RuntimeError("Session exists but not authorized. /login again.")
+        if not await client.is_user_authorized():
+            await client.disconnect()
+            raise RuntimeError("Session exists but not authorized. /login again.")
 
-    USER_CLIENT_CACHE[uid] = client
-    return client
+        USER_CLIENT_CACHE[uid] = client
+        return client
 
 
 async def is_logged_in(uid: int) -> bool:
@@ -514,6 +871,8 @@ def commands_text() -> str:
         "📆 /week_status — Joins in last 7 days",
         "🗓️ /month_status — Joins in last 30 days",
         "📈 /year_status — Joins in last 365 days",
+        "🧮 /overview — All windows for one link at once",
+        "📤 /export — Download raw join data (CSV / NDJSON)",
         "",
         "🔐 /login — Login your Telegram account",
         "🛑 /stoplogin — Cancel login process",
@@ -534,7 +893,7 @@ def commands_text() -> str:
 
 # ---------------- /start /help /status /demo ----------------
 
-@bot.on(events.NewMessage(pattern=r"^/start$"))
+@router.command("start")
 async def cmd_start(event):
     await event.respond(
         commands_text().replace("{BOT}", "Join Counter Bot"),
@@ -543,7 +902,7 @@ async def cmd_start(event):
 
 
 
-@bot.on(events.NewMessage(pattern=r"^/help$"))
+@router.command("help")
 async def help_cmd(e):
     txt = (
         "ℹ️ **How to use this bot (simple flow)**\n\n"
@@ -564,7 +923,7 @@ async def help_cmd(e):
 
 
 
-@bot.on(events.NewMessage(pattern=r"^/status$"))
+@router.command("status")
 async def status_cmd(e):
     data = sp_get_session(e.sender_id)
     if not data:
@@ -582,7 +941,7 @@ async def status_cmd(e):
 
 # ---------------- LOGIN / LOGOUT FLOW ----------------
 
-@bot.on(events.NewMessage(pattern=r"^/login$"))
+@router.command("login")
 async def login_cmd(e):
     uid = e.sender_id
     if await is_logged_in(uid):
@@ -599,7 +958,7 @@ async def login_cmd(e):
     )
 
 
-@bot.on(events.NewMessage(pattern=r"^/stoplogin$"))
+@router.command("stoplogin")
 async def stoplogin_cmd(e):
     uid = e.sender_id
     if uid in login_state:
@@ -609,7 +968,7 @@ async def stoplogin_cmd(e):
     await e.respond("ℹ️ No login in progress.")
 
 
-@bot.on(events.NewMessage)
+@router.text(lambda uid: uid in login_state)
 async def login_flow(e):
     """Handles /login steps (phone → OTP → 2FA password)."""
     uid = e.sender_id
@@ -626,14 +985,14 @@ async def login_flow(e):
                 parse_mode="md",
             )
         phone = msg
-        local = session_path(uid, phone)
-        client = TelegramClient(local, API_ID, API_HASH)
+        name = session_name(uid, phone)
+        client = new_user_client(name)
         st["phone"] = phone
         try:
             await client.connect()
             if await client.is_user_authorized():
                 me = await client.get_me()
-                sp_upsert_session(uid, phone, os.path.basename(local))
+                sp_upsert_session(uid, phone, name)
                 await e.respond(
                     f"✅ Already logged in as **{me.first_name}**.\n"
                     "Use /create_link to generate invite links.",
@@ -686,14 +1045,14 @@ async def login_flow(e):
                 parse_mode="md",
             )
 
-        local = session_path(uid, phone)
-        client = TelegramClient(local, API_ID, API_HASH)
+        name = session_name(uid, phone)
+        client = new_user_client(name)
         try:
             await client.connect()
             try:
                 await client.sign_in(phone, otp, phone_code_hash=code_hash)
                 me = await client.get_me()
-                sp_upsert_session(uid, phone, os.path.basename(local))
+                sp_upsert_session(uid, phone, name)
                 await e.respond(
                     f"✅ Logged in as **{me.first_name}**.\n"
                     "Now use /create_link to generate invite links.",
@@ -708,7 +1067,7 @@ async def login_flow(e):
                 except Exception:
                     hint = ""
                 st["step"] = "2fa"
-                st["twofa_session_path"] = local
+                st["twofa_session"] = name
                 msg_hint = f" (hint: `{hint}`)" if hint else ""
                 await e.respond(
                     f"🔐 2FA enabled. Please enter your **Telegram password**{msg_hint}.\n\n"
@@ -734,19 +1093,19 @@ async def login_flow(e):
     if st["step"] == "2fa":
         password = msg
         phone = st.get("phone")
-        local = st.get("twofa_session_path") or session_path(uid, phone or "")
-        if not phone or not local:
+        name = st.get("twofa_session") or session_name(uid, phone or "")
+        if not phone or not name:
             login_state.pop(uid, None)
             return await e.respond(
                 "⚠️ Session expired. Start `/login` again.",
                 parse_mode="md",
             )
-        client = TelegramClient(local, API_ID, API_HASH)
+        client = new_user_client(name)
         try:
             await client.connect()
             await client.sign_in(password=password)
             me = await client.get_me()
-            sp_upsert_session(uid, phone, os.path.basename(local))
+            sp_upsert_session(uid, phone, name)
             await e.respond(
                 f"✅ 2FA verified. Logged in as **{me.first_name}**.\n"
                 "Now use /create_link to generate invite links.",
@@ -769,106 +1128,38 @@ async def login_flow(e):
             except Exception:
                 pass
 
-def build_calendar_kb(year: int, month: int, selected_start: Optional[str], selected_end: Optional[str]) -> List[List[Button]]:
-    """
-    Inline calendar for a month.
-    selected_start/end are 'YYYY-MM-DD' strings (for highlighting).
-    """
-    cal = calendar.monthcalendar(year, month)
-
-    header = f"{calendar.month_name[month]} {year}"
-    rows: List[List[Button]] = []
-
-    # Month header row (non-clickable title) + nav
-    rows.append([
-        Button.inline("⬅️", data=f"cal_nav:prev:{year}:{month}".encode()),
-        Button.inline(header, data=b"cal_noop"),
-        Button.inline("➡️", data=f"cal_nav:next:{year}:{month}".encode()),
-    ])
-
-    # Weekday row
-    rows.append([
-        Button.inline("Mo", data=b"cal_noop"),
-        Button.inline("Tu", data=b"cal_noop"),
-        Button.inline("We", data=b"cal_noop"),
-        Button.inline("Th", data=b"cal_noop"),
-        Button.inline("Fr", data=b"cal_noop"),
-        Button.inline("Sa", data=b"cal_noop"),
-        Button.inline("Su", data=b"cal_noop"),
-    ])
-
-    # Days
-    for week in cal:
-        week_row: List[Button] = []
-        for day in week:
-            if day == 0:
-                week_row.append(Button.inline(" ", data=b"cal_noop"))
-                continue
-
-            dstr = f"{year:04d}-{month:02d}-{day:02d}"
-
-            # highlight selected range
-            label = str(day)
-            if selected_start == dstr:
-                label = f"🟢{day}"
-            if selected_end == dstr:
-                label = f"🔴{day}"
-
-            # simple range highlight (optional)
-            if selected_start and selected_end:
-                try:
-                    s = datetime.fromisoformat(selected_start)
-                    e = datetime.fromisoformat(selected_end)
-                    cur = datetime.fromisoformat(dstr)
-                    if s <= cur <= e and dstr not in (selected_start, selected_end):
-                        label = f"•{day}"
-                except Exception:
-                    pass
-
-            week_row.append(Button.inline(label, data=f"cal_day:{dstr}".encode()))
-        rows.append(week_row)
-
-    # action row
-    rows.append([
-        Button.inline("✖ Cancel", data=b"cal_cancel"),
-        Button.inline("🔄 Reset", data=b"cal_reset"),
-    ])
-    return rows
-
-
 # ---------- START MENU INLINE BUTTON HANDLERS ----------
 
-@bot.on(events.CallbackQuery(pattern=b"menu_login"))
+@router.callback(b"menu_login")
 async def cb_menu_login(event):
     await event.answer()
     await event.respond("👤 Login ke liye command use karo:\n\n`/login`\n\nYahi se tum apna Telegram account connect karoge.", parse_mode="md")
 
-@bot.on(events.CallbackQuery(pattern=b"menu_create_link"))
+@router.callback(b"menu_create_link")
 async def cb_menu_create_link(event):
     await event.answer()
     await event.respond("🧷 Naya invite link banane ke liye:\n\n/create_link\n\nYeh command sirf un groups/channels ke liye kaam karegi jahan tum admin ho.", parse_mode="md")
 
-@bot.on(events.CallbackQuery(pattern=b"menu_links"))
+@router.callback(b"menu_links")
 async def cb_menu_links(event):
     await event.answer()
     await event.respond("📋 Apne sab active links dekhne ke liye:\n\n`/links`", parse_mode="md")
 
-@bot.on(events.CallbackQuery(pattern=b"menu_stats"))
+@router.callback(b"menu_stats")
 async def cb_menu_stats(event):
     await event.answer()
     await event.respond("📊 Joins ka stats dekhne ke liye:\n\n`/stats`\n\nYa jo bhi tumne stats wali command rakhi hai (agar naam alag hai to yahan update kar lena).", parse_mode="md")
 
 
 
-@bot.on(events.CallbackQuery(pattern=b"resend_otp"))
+@router.callback(b"resend_otp")
 async def cb_resend_otp(event):
     uid = event.sender_id
     st = login_state.get(uid)
     if not st or not st.get("phone"):
         return await event.answer("No login in progress. Use /login.", alert=True)
     phone = st["phone"]
-    local = session_path(uid, phone)
-    client = TelegramClient(local, API_ID, API_HASH)
+    client = new_user_client(session_name(uid, phone))
     try:
         await safe_connect(client)
         res = await client.send_code_request(phone)
@@ -887,7 +1178,7 @@ async def cb_resend_otp(event):
             pass
 
 
-@bot.on(events.NewMessage(pattern=r"^/logout$"))
+@router.command("logout")
 async def logout_cmd(e):
     if not await is_logged_in(e.sender_id):
         return await e.respond("ℹ️ Not logged in.", parse_mode="md")
@@ -904,7 +1195,7 @@ async def logout_cmd(e):
     )
 
 
-@bot.on(events.CallbackQuery(pattern=b"logout_confirm"))
+@router.callback(b"logout_confirm")
 async def logout_confirm_cb(event):
     uid = event.sender_id
     data = sp_get_session(uid)
@@ -917,7 +1208,12 @@ async def logout_confirm_cb(event):
             await client.disconnect()
         except Exception:
             pass
-    # delete session file
+    # delete stored auth key + legacy session file
+    if session_store is not None:
+        try:
+            session_store.delete_auth(data["session_file"])
+        except Exception as ex:
+            print("delete session auth err:", ex)
     path = os.path.join(SESSION_DIR, data["session_file"])
     if os.path.exists(path):
         try:
@@ -928,14 +1224,14 @@ async def logout_confirm_cb(event):
     await event.edit("👋 Logged out. You can `/login` again anytime.", buttons=None)
 
 
-@bot.on(events.CallbackQuery(pattern=b"logout_cancel"))
+@router.callback(b"logout_cancel")
 async def logout_cancel_cb(event):
     await event.edit("✖ Logout cancelled. You are still logged in.", buttons=None)
 
 
 # ---------------- CREATE LINK FLOW (GROUPS/CHANNELS ONLY) ----------------
 
-@bot.on(events.NewMessage(pattern=r"^/create_link$"))
+@router.command("create_link")
 async def create_link_cmd(e):
     if not await is_logged_in(e.sender_id):
         return await e.respond("🔒 Please `/login` first.", parse_mode="md")
@@ -959,13 +1255,13 @@ async def create_link_cmd(e):
         ],
     )
 
-@bot.on(events.NewMessage(pattern=r"^/select_date$"))
+@router.command("select_date")
 async def select_date_cmd(e):
     uid = e.sender_id
     if not await is_logged_in(uid):
         return await e.respond("🔒 Please `/login` first.", parse_mode="md")
 
-    rows = sp_list_invite_links(uid)
+    rows = owner_links(uid).rows
     if not rows:
         return await e.respond("ℹ️ No active invite links. Use `/create_link` first.", parse_mode="md")
 
@@ -980,17 +1276,12 @@ async def select_date_cmd(e):
         "label": "Custom Range",
     }
 
-    btn_rows: List[List[Button]] = []
-    for r in rows[:10]:
-        title = r.get("chat_title") or f"id:{r.get('chat_id')}"
-        short = (title[:40] + "…") if len(title) > 40 else title
-        btn_rows.append([Button.inline(short, data=f"dr_link:{r['id']}".encode())])
-    btn_rows.append([Button.inline("✖ Cancel", data=b"dr_cancel")])
+    btn_rows = link_picker_kb("dr_link", rows, b"dr_cancel")
 
     await e.respond("📅 **Select link first:**", parse_mode="md", buttons=btn_rows)
 
 
-@bot.on(events.CallbackQuery(pattern=b"^pin_create_links$"))
+@router.callback(b"pin_create_links")
 async def cb_pin_create_links(event):
     uid = event.sender_id
     try:
@@ -1018,7 +1309,7 @@ async def cb_pin_create_links(event):
         buttons=multi_kb(len(pairs), set()),
     )
 
-@bot.on(events.CallbackQuery(pattern=b"^dr_link:"))
+@router.callback(b"dr_link:")
 async def cb_dr_link(event):
     uid = event.sender_id
     st = date_select_state.get(uid)
@@ -1042,7 +1333,7 @@ async def cb_dr_link(event):
         buttons=kb
     )
 
-@bot.on(events.CallbackQuery(pattern=b"^cal_nav:"))
+@router.callback(b"cal_nav:")
 async def cb_cal_nav(event):
     uid = event.sender_id
     st = date_select_state.get(uid)
@@ -1072,7 +1363,7 @@ async def cb_cal_nav(event):
     await event.edit(title, parse_mode="md", buttons=kb)
 
 
-@bot.on(events.CallbackQuery(pattern=b"^cal_day:"))
+@router.callback(b"cal_day:")
 async def cb_cal_day(event):
     uid = event.sender_id
     st = date_select_state.get(uid)
@@ -1129,13 +1420,11 @@ async def cb_cal_day(event):
         await sync_importers_to_db(uid)
 
         # counts
-        total = sp_count_joins_for_link(uid, link_id, since=since_utc, until=until_utc)
-        left_total = sp_count_left_for_link(uid, link_id, since=since_utc, until=until_utc)
+        total, left_total = await link_window_counts(uid, link_id, since=since_utc, until=until_utc)
         active_total = total - left_total
 
         # link info
-        rows = sp_list_invite_links(uid)
-        chosen = next((r for r in rows if int(r["id"]) == link_id), None)
+        chosen = owner_links(uid).get(link_id)
 
         title = chosen.get("chat_title") if chosen else "Unknown"
         link = chosen.get("invite_link") if chosen else "-"
@@ -1157,7 +1446,7 @@ async def cb_cal_day(event):
         return await event.edit("\n".join(msg_lines), parse_mode="md", buttons=[[Button.inline("✖ Close", data=b"stats_page:close")]])
 
 
-@bot.on(events.CallbackQuery(pattern=b"^cal_reset$"))
+@router.callback(b"cal_reset")
 async def cb_cal_reset(event):
     uid = event.sender_id
     st = date_select_state.get(uid)
@@ -1172,24 +1461,24 @@ async def cb_cal_reset(event):
     await event.edit("🟢 Select **START date** (calendar):", parse_mode="md", buttons=kb)
 
 
-@bot.on(events.CallbackQuery(pattern=b"^cal_cancel$"))
+@router.callback(b"cal_cancel")
 async def cb_cal_cancel(event):
     date_select_state.pop(event.sender_id, None)
     await event.edit("✖ Date selection cancelled.", buttons=None)
 
 
-@bot.on(events.CallbackQuery(pattern=b"^dr_cancel$"))
+@router.callback(b"dr_cancel")
 async def cb_dr_cancel(event):
     date_select_state.pop(event.sender_id, None)
     await event.edit("✖ Cancelled.", buttons=None)
 
 
-@bot.on(events.CallbackQuery(pattern=b"^cal_noop$"))
+@router.callback(b"cal_noop")
 async def cb_cal_noop(event):
     await event.answer()
 
 
-@bot.on(events.CallbackQuery(pattern=b"^cl_type:"))
+@router.callback(b"cl_type:")
 async def cb_choose_create_link_type(event):
     uid = event.sender_id
     choice = event.data.decode().split(":", 1)[1]  # approval | normal
@@ -1210,7 +1499,7 @@ async def cb_choose_create_link_type(event):
     )
 
 
-@bot.on(events.CallbackQuery(pattern=b"^msel:"))
+@router.callback(b"msel:")
 async def cb_toggle(event):
     uid = event.sender_id
     st = select_state.get(uid)
@@ -1247,7 +1536,7 @@ async def cb_toggle(event):
     )
 
 
-@bot.on(events.CallbackQuery(pattern=b"^msel_done$"))
+@router.callback(b"msel_done")
 async def cb_msel_done(event):
     uid = event.sender_id
     st = select_state.get(uid)
@@ -1355,7 +1644,7 @@ async def cb_msel_done(event):
     return await event.edit("ℹ️ Nothing to do.", buttons=None)
 
 
-@bot.on(events.CallbackQuery(pattern=b"^rem_confirm$"))
+@router.callback(b"rem_confirm")
 async def cb_rem_confirm(event):
     uid = event.sender_id
     st = select_state.get(uid)
@@ -1370,13 +1659,14 @@ async def cb_rem_confirm(event):
         return await event.edit("ℹ️ No links to delete.", buttons=None)
 
     sp_soft_delete_links(uid, link_ids)
+    drop_link_members(uid, link_ids)
     await event.edit(
-        f"🗑️ Deleted **{count}** invite link(s) and all associated join data.",
+        f"🗑️ Removed **{count}** invite link(s). Their join data is being deleted in the background.",
         buttons=None,
     )
 
 
-@bot.on(events.CallbackQuery(pattern=b"^rem_cancel$"))
+@router.callback(b"rem_cancel")
 async def cb_rem_cancel(event):
     uid = event.sender_id
     st = select_state.get(uid)
@@ -1385,7 +1675,7 @@ async def cb_rem_cancel(event):
     await event.edit("✖ Deletion cancelled. No links were removed.", buttons=None)
 
 
-@bot.on(events.CallbackQuery(pattern=b"^msel_cancel$"))
+@router.callback(b"msel_cancel")
 async def cb_msel_cancel(event):
     select_state.pop(event.sender_id, None)
     await event.edit("✖ Selection cancelled.", buttons=None)
@@ -1393,12 +1683,12 @@ async def cb_msel_cancel(event):
 
 # ---------------- LIST / REMOVE LINKS ----------------
 
-@bot.on(events.NewMessage(pattern=r"^/links$"))
+@router.command("links")
 async def links_cmd(e):
     uid = e.sender_id
     if not await is_logged_in(uid):
         return await e.respond("🔒 Please `/login` first.", parse_mode="md")
-    rows = sp_list_invite_links(uid)
+    rows = owner_links(uid).rows
     if not rows:
         return await e.respond(
             "ℹ️ No active invite links yet. Use /create_link.",
@@ -1411,6 +1701,8 @@ async def links_cmd(e):
         created = str(r.get("created_at") or "")[:19]
         link_type = r.get("link_type", "normal")
         badge = "🛂 _required approval_" if link_type == "approval" else ""
+        if r.get("frozen_at"):
+            badge += f" 🧊 _frozen ({r.get('frozen_reason') or 'dead'})_"
         lines.append(
             f"- `{title}` {badge}\n"
             f"  {link}\n"
@@ -1419,12 +1711,12 @@ async def links_cmd(e):
     await e.respond("\n".join(lines), parse_mode="md")
 
 
-@bot.on(events.NewMessage(pattern=r"^/remove_link$"))
+@router.command("remove_link")
 async def remove_link_cmd(e):
     uid = e.sender_id
     if not await is_logged_in(uid):
         return await e.respond("🔒 Please `/login` first.", parse_mode="md")
-    rows = sp_list_invite_links(uid)
+    rows = owner_links(uid).rows
     if not rows:
         return await e.respond("ℹ️ No active links to remove.", parse_mode="md")
     pairs = []
@@ -1447,14 +1739,132 @@ async def remove_link_cmd(e):
     )
 
 
+# ---------------- LINK REAPER (JOIN ROWS OF REMOVED LINKS) ----------------
+#  /remove_link only tombstones links. The reaper deletes their join rows
+#  REAP_CHUNK at a time (bounded requests, no long table lock), stores
+#  the running count in reaped_rows, and deletes the link row (plus its
+#  archives) once none are left. Tombstones live in the DB, so a restart
+#  resumes where the last pass stopped. Outbox writes of a removed link
+#  are dropped by the drainer, and the link row goes only once none is
+#  pending, so a sync that was running during the removal cannot leave
+#  rows behind.
+
+_reap_wake = asyncio.Event()  # set by sp_soft_delete_links
+reap_progress: Dict[int, int] = {}  # link id -> join rows deleted, while being reaped
+removed_links: Set[int] = set()  # tombstoned (or already reaped) link ids: drain_outbox drops their writes
+
+
+@db_op
+def sp_tombstoned_links(limit: int) -> List[dict]:
+    return store.tombstoned_links(limit)
+
+
+@db_op
+def sp_delete_join_chunk(uid: int, link_id: int, limit: int) -> int:
+    return store.delete_join_chunk(uid, link_id, limit)
+
+
+@db_op
+def sp_link_removed(link_id: int) -> bool:
+    return store.link_removed(link_id)
+
+
+@db_op
+def sp_set_link_reaped(link_id: int, rows: int):
+    store.set_link_reaped(link_id, rows)
+
+
+@db_op
+def sp_delete_links(uid: int, link_ids: List[int]):
+    store.delete_links(uid, link_ids)
+
+
+async def outbox_link_clear(link_id: int, timeout: float = REAP_OUTBOX_WAIT) -> bool:
+    """Wait (bounded) until no outbox write of this removed link is pending (the drainer drops them)."""
+    deadline = time.monotonic() + timeout
+    while await asyncio.to_thread(outbox.pending_for_link, link_id):
+        if time.monotonic() >= deadline:
+            return False
+        if _outbox_lock.locked() or not await drain_outbox():
+            await asyncio.sleep(REAP_PAUSE)
+    return True
+
+
+async def reap_link(uid: int, link_id: int, done: int = 0) -> int:
+    """Delete one removed link's join rows chunk by chunk, then the link. Returns rows deleted now."""
+    deleted = 0
+    reap_progress[link_id] = done
+    try:
+        while True:
+            n = await asyncio.to_thread(sp_delete_join_chunk, uid, link_id, REAP_CHUNK)
+            deleted += n
+            REAPED_ROWS.inc(n)
+            reap_progress[link_id] = done + deleted
+            if n < REAP_CHUNK:
+                break
+            try:
+                await asyncio.to_thread(sp_set_link_reaped, link_id, done + deleted)
+            except Exception as ex:
+                # e.g. invite_links without reaped_rows (migrations/0006 not applied): memory only
+                print("set_link_reaped error:", ex)
+            await asyncio.sleep(REAP_PAUSE)
+        if not await outbox_link_clear(link_id):
+            print(f"reaper: outbox writes of link {link_id} still pending, delete retried next pass")
+            return deleted
+        if not await asyncio.to_thread(sp_link_removed, link_id):
+            print(f"reaper: link {link_id} is no longer tombstoned, left in place")
+            removed_links.discard(link_id)
+            return deleted
+        await asyncio.to_thread(sp_delete_links, uid, [link_id])  # archives + link row (+ any late rows)
+    finally:
+        reap_progress.pop(link_id, None)
+    return deleted
+
+
+async def reap_links() -> int:
+    """One reaper pass over the removed links. Returns join rows deleted."""
+    total = 0
+    for r in await asyncio.to_thread(sp_tombstoned_links, REAP_MAX_LINKS):
+        uid, link_id = int(r["user_id"]), int(r["id"])
+        removed_links.add(link_id)  # tombstoned before a restart
+        try:
+            n = await reap_link(uid, link_id, int(r.get("reaped_rows") or 0))
+        except Exception as ex:
+            print(f"reaper {uid}/{link_id} error:", ex)
+            continue
+        total += n
+        print(f"🧹 reaped link {link_id} of {uid}: {n} join rows")
+    return total
+
+
+async def reaper_loop():
+    while True:
+        _reap_wake.clear()
+        try:
+            await reap_links()
+        except Exception as ex:
+            print("reaper error:", ex)
+        try:
+            await asyncio.wait_for(_reap_wake.wait(), REAP_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+
+
 # ---------------- SYNC IMPORTERS → JOINS TABLE ----------------
 
-async def sync_importers_to_db(uid: int):
+async def sync_importers_to_db(uid: int, interactive: bool = True):
     """
     For each invite_link: fetch Telegram invite importers and refresh joins table.
     Uses GetChatInviteImporters with proper peer + link hash.
+    Links whose Telegram usage counter is unchanged since their last full
+    sync skip the importer fetch (counters come from GetExportedChatInvites,
+    per chat). Usage never drops on a leave, so their members are still
+    probed for leaves every LEAVE_PROBE_INTERVAL.
+    Each link sync waits for its fair turn in sync_scheduler; background
+    refreshes pass interactive=False.
     """
-    rows = sp_list_invite_links(uid)
+    links = owner_links(uid)
+    rows = links.live()  # frozen links keep their final counts
     if not rows:
         return
 
@@ -1464,118 +1874,417 @@ async def sync_importers_to_db(uid: int):
         print("sync_importers_to_db error (get_user_client):", ex)
         return
 
+    by_chat = links.chat_hashes()
+    counters: Dict[str, Tuple[int, int]] = {}
+    for chat_id, hashes in by_chat.items():
+        try:
+            counters.update(await fetch_link_counters(uc, chat_id, hashes))
+        except Exception as ex:
+            # no counters -> those links get a full sync
+            print(f"GetExportedChatInvites error for {chat_id}:", ex)
+
+    now = time.monotonic()
     for r in rows:
-        invite_link_id = int(r["id"])
-        chat_id = int(r["chat_id"])
-        full_link = r["invite_link"]
+        cur = counters.get(invite_hash(r["invite_link"]))
+        prev = last_link_counters(r)
+        importers = cur is None or prev is None or cur[0] != prev[0]
+        if not importers:
+            SYNC_SKIPPED.inc()
+            if now - leave_probed.get(int(r["id"]), float("-inf")) < LEAVE_PROBE_INTERVAL:
+                continue
+        members = (cur or prev or (0, 0))[0]
+        async with sync_scheduler.slot(uid, 1 + members / SYNC_COST_MEMBERS, interactive):
+            t0 = time.perf_counter()
+            try:
+                synced = await sync_link(uc, uid, r, importers=importers)
+            finally:
+                took = time.perf_counter() - t0
+                SYNC_SECONDS.observe(took)
+                SYNC_LAST_SECONDS.set(took)
+        if synced and cur is not None:
+            await remember_link_counters(uid, int(r["id"]), cur)
+    await outbox_settle((uid, int(r["id"])) for r in rows)
+
+
+async def iter_exported_invites(uc: TelegramClient, peer, revoked: bool = False):
+    """The owner's own invite links of one chat (active or revoked ones), 100 per RPC."""
+    offset_date, offset_link = None, None
+    while True:
+        res = await uc(
+            functions.messages.GetExportedChatInvitesRequest(
+                peer=peer,
+                admin_id=types.InputUserSelf(),
+                limit=100,
+                revoked=revoked,
+                offset_date=offset_date,
+                offset_link=offset_link,
+            )
+        )
+        invites = getattr(res, "invites", []) or []
+        for inv in invites:
+            yield inv
+        if len(invites) < 100:
+            return
+        offset_date, offset_link = invites[-1].date, invites[-1].link
 
-        # 1) extract hash part
-        link_part = full_link.rsplit("/", 1)[-1]
-        link_part = link_part.lstrip("+").replace("joinchat/", "")
 
-        try:
-            # 2) convert chat_id to InputPeer
-            peer = await uc.get_input_entity(chat_id)
-        except Exception as ex:
-            print(f"sync_importers_to_db get_input_entity error for {chat_id}:", ex)
-            continue
+def invite_counters(inv) -> Tuple[int, int]:
+    return int(getattr(inv, "usage", 0) or 0), int(getattr(inv, "requested", 0) or 0)
+
+
+async def fetch_link_counters(uc: TelegramClient, chat_id: int, hashes: Set[str]) -> Dict[str, Tuple[int, int]]:
+    """invite hash -> (usage, requested) for the owner's links in one chat (100 links per RPC)."""
+    peer = await resolve_peer(uc, chat_id)
+    out: Dict[str, Tuple[int, int]] = {}
+    async for inv in iter_exported_invites(uc, peer):
+        h = invite_hash(getattr(inv, "link", "") or "")
+        if h in hashes:
+            out[h] = invite_counters(inv)
+            if len(out) >= len(hashes):
+                break
+    return out
+
+
+def last_link_counters(r: dict) -> Optional[Tuple[int, int]]:
+    cur = link_counters.get(int(r["id"]))
+    if cur is None and r.get("usage_count") is not None:
+        cur = (int(r["usage_count"]), int(r.get("requested_count") or 0))
+    return cur
+
+
+async def remember_link_counters(uid: int, link_id: int, cur: Tuple[int, int]):
+    link_counters[link_id] = cur
+    reg = link_registry.get(uid)
+    if reg is not None:
+        reg.update(link_id, usage_count=cur[0], requested_count=cur[1])
+    try:
+        await asyncio.to_thread(sp_set_link_counters, link_id, cur[0], cur[1])
+    except Exception as ex:
+        # e.g. invite_links without usage_count / requested_count columns: memory only
+        print("set_link_counters error:", ex)
+
+
+def members_path(uid: int, link_id: int) -> str:
+    return os.path.join(MEMBERS_DIR, f"{uid}_{link_id}.ids")
+
+
+def build_link_members(uid: int, link_id: int) -> MemberSet:
+    """Joiner-id set from every stored row of a link (blocking: keyset pages, archives first)."""
+    hot = sp_iter_joins_for_link(uid, link_id, page_size=EXPORT_PAGE_SIZE, columns="id,joined_user_id,joined_at,left_at")
+    return MemberSet.from_rows(itertools.chain(archived_rows(uid, link_id), hot))  # later rows win
+
 
+async def load_link_members(uid: int, link_id: int) -> MemberSet:
+    """
+    Joiner-id set of a link: mapped snapshot, else built from the joins
+    table once in a worker thread. A read that fails part way raises, so
+    no snapshot is ever saved from a partial set.
+    """
+    ms = MemberSet.load(members_path(uid, link_id))
+    if ms is None:
+        ms = await asyncio.to_thread(build_link_members, uid, link_id)
+        ms.save(members_path(uid, link_id))
+    return ms
+
+
+def drop_link_members(uid: int, link_ids: List[int]):
+    for link_id in link_ids:
+        invalidate_trend(uid, link_id)
+        drop_link_index(uid, link_id)
+        link_archives.pop((uid, link_id), None)
+        leave_probed.pop(link_id, None)
         try:
-            # 3) GetChatInviteImporters call
-            result = await uc(
-                functions.messages.GetChatInviteImportersRequest(
-                    peer=peer,
-                    link=link_part,
-                    offset_date=None,
-                    offset_user=tl_types.InputUserEmpty(),
-                    limit=1000,
-                    requested=False,
-                )
-            )
-        except Exception as ex:
-            print("GetChatInviteImporters error:", ex)
-            continue
+            os.remove(members_path(uid, link_id))
+        except OSError:
+            pass
 
-        importers = getattr(result, "importers", []) or []
-        join_rows: List[dict] = []
 
-        for imp in importers:
+async def sync_link(uc: TelegramClient, uid: int, r: dict, importers: bool = True) -> bool:
+    """
+    Sync one invite_link row: importers -> joins table, then left detection.
+    importers=False only probes the stored members for leaves. False if
+    the chat or the importers could not be fetched.
+    """
+    invite_link_id = int(r["id"])
+    chat_id = int(r["chat_id"])
+
+    try:
+        # convert chat_id to InputPeer
+        peer = await resolve_peer(uc, chat_id)
+    except Exception as ex:
+        print(f"sync_importers_to_db resolve_peer error for {chat_id}:", ex)
+        return False
+
+    try:
+        members = await load_link_members(uid, invite_link_id)
+    except Exception as ex:
+        print(f"load members error for link {invite_link_id}:", ex)
+        return False
+    written = 0
+    if importers:
+        synced = await sync_link_importers(uc, uid, r, peer, members)
+        if synced is None:
+            return False
+        members, written = synced
+
+    # ✅ LEFT DETECT BLOCK (PASTE HERE)
+    # For each joined_user_id already stored for this link -> check if still member
+    gone: List[int] = []
+    try:
+        for member_uid in members.active_ids():
             try:
-                user_id = int(getattr(imp, "user_id", 0) or 0)
-                if not user_id:
-                    continue
+                # If user is still in chat, this will succeed
+                await uc(functions.channels.GetParticipantRequest(
+                    channel=peer,
+                    participant=member_uid
+                ))
+            except Exception:
+                # Not in chat anymore -> mark as left
+                gone.append(member_uid)
+    except Exception as ex:
+        print("left-check error:", ex)
+    leave_probed[invite_link_id] = time.monotonic()
 
-                # -------- NEW: resolve joined_username --------
-                try:
-                    ent = await uc.get_entity(user_id)
+    try:
+        gone_joined = [st + STAMP_EPOCH for st in members.stamps_of(gone) if st > 0]
+        await sp_mark_left_members(uid, invite_link_id, gone, "left")
+        members.mark_left(gone)
+        index_link_joins(uid, invite_link_id, left=gone_joined)
+    except Exception as ex:
+        print("mark left error:", ex)
+    if written or gone:
+        members.save(members_path(uid, invite_link_id))
+        invalidate_trend(uid, invite_link_id)
+    return True
 
-                    if getattr(ent, "username", None):
-                        username = "@" + ent.username
-                    elif getattr(ent, "first_name", None) or getattr(ent, "last_name", None):
-                        username = f"{(ent.first_name or '')} {(ent.last_name or '')}".strip()
-                    else:
-                        username = f"id:{user_id}"
-                except Exception:
-                    # if we can't fetch entity, just store id
-                    username = f"id:{user_id}"
-
-                # joined_at time
-                join_date = getattr(imp, "date", None)
-                if isinstance(join_date, datetime):
-                    joined_at = join_date.astimezone(timezone.utc)
-                else:
-                    joined_at = datetime.now(timezone.utc)
-
-                # row to insert
-                join_rows.append(
-                    {
-                        "user_id": uid,  # owner of this link
-                        "chat_id": chat_id,
-                        "invite_link_id": invite_link_id,
-                        "joined_user_id": user_id,
-                        "joined_at": joined_at.isoformat(),
-                    }
-                )
 
-            except Exception as ex:
-                print("importer parse err:", ex)
-                continue
+async def sync_link_importers(uc: TelegramClient, uid: int, r: dict, peer,
+                              members: MemberSet) -> Optional[Tuple[MemberSet, int]]:
+    """Importers of one link -> joins table. Returns (updated members, rows written), None if the fetch failed."""
+    invite_link_id = int(r["id"])
+    chat_id = int(r["chat_id"])
+
+    # extract hash part
+    link_part = invite_hash(r["invite_link"])
+
+    try:
+        # GetChatInviteImporters call
+        result = await uc(
+            functions.messages.GetChatInviteImportersRequest(
+                peer=peer,
+                link=link_part,
+                offset_date=None,
+                offset_user=tl_types.InputUserEmpty(),
+                limit=1000,
+                requested=False,
+            )
+        )
+    except Exception as ex:
+        print("GetChatInviteImporters error:", ex)
+        return None
 
-        sp_replace_joins_for_link(uid, invite_link_id, join_rows)
+    importers = getattr(result, "importers", []) or []
+    join_rows: List[dict] = []
 
-        # ✅ LEFT DETECT BLOCK (PASTE HERE)
-        # For each joined_user_id already stored for this link -> check if still member
+    for imp in importers:
         try:
-            existing = (
-                supabase.table("joins")
-                .select("id,joined_user_id,left_at")
-                .eq("user_id", uid)
-                .eq("invite_link_id", invite_link_id)
-                .execute()
-            ).data or []
+            user_id = int(getattr(imp, "user_id", 0) or 0)
+            if not user_id:
+                continue
 
-            for row in existing:
-                if row.get("left_at"):
-                    continue
+            # joined_at time
+            join_date = getattr(imp, "date", None)
+            if isinstance(join_date, datetime):
+                joined_at = join_date.astimezone(timezone.utc)
+            else:
+                joined_at = datetime.now(timezone.utc)
 
-                member_uid = int(row["joined_user_id"])
+            # row to insert
+            join_rows.append(
+                {
+                    "user_id": uid,  # owner of this link
+                    "chat_id": chat_id,
+                    "invite_link_id": invite_link_id,
+                    "joined_user_id": user_id,
+                    "joined_at": joined_at.isoformat(),
+                }
+            )
 
-                try:
-                    # If user is still in chat, this will succeed
-                    await uc(functions.channels.GetParticipantRequest(
-                        channel=peer,
-                        participant=member_uid
-                    ))
-                except Exception:
-                    # Not in chat anymore -> mark as left
-                    supabase.table("joins").update({
-                        "left_at": datetime.now(timezone.utc).isoformat(),
-                        "left_reason": "left",
-                        "left_seen_at": datetime.now(timezone.utc).isoformat(),
-                    }).eq("id", row["id"]).execute()
+        except Exception as ex:
+            print("importer parse err:", ex)
+            continue
+
+    # only new / rejoined importers are written; unchanged rows and left marks stay as stored
+    fetched_ids = [r["joined_user_id"] for r in join_rows]
+    fetched_stamps = [to_stamp(r["joined_at"]) for r in join_rows]
+    need = members.diff(fetched_ids, fetched_stamps)
+    if need:
+        known = len(members)
+        await sp_replace_joins_for_link(uid, invite_link_id, [join_rows[i] for i in need])
+        members = members.merge_joined([fetched_ids[i] for i in need], [fetched_stamps[i] for i in need])
+        if len(members) - known == len(need):
+            index_link_joins(uid, invite_link_id, joined=[trend.epoch_of(join_rows[i]["joined_at"]) for i in need])
+        else:  # a rejoin moved the joined_at of an existing row
+            drop_link_index(uid, invite_link_id)
+    return members, len(need)
+
+
+# ---------------- DEAD LINK RECONCILIATION ----------------
+#  Links revoked in the Telegram app, expired, at their usage limit or in
+#  a chat the owner can no longer read are frozen (frozen_at /
+#  frozen_reason): they stay listed with their counts, but sync and
+#  leave events skip them. One pass checks each chat of an owner in bulk
+#  through GetExportedChatInvites (the revoked list only when a link is
+#  missing from the active one). A link with joins since its last sync
+#  gets one final sync before it freezes. chat_left needs Telegram's
+#  answer (CHAT_GONE_ERRORS); a chat whose access hash is unknown even
+#  after get_dialogs is skipped, not frozen.
+
+CHAT_GONE_ERRORS = (
+    errors.ChannelPrivateError, errors.ChatAdminRequiredError, errors.ChannelInvalidError,
+    errors.ChatIdInvalidError, errors.PeerIdInvalidError,
+)
+_reconcile_running = False
+
+
+def dead_link_reason(inv, now: datetime) -> Optional[str]:
+    """Why an exported invite no longer lets anyone in (None while it works)."""
+    if getattr(inv, "revoked", False):
+        return "revoked"
+    expires = getattr(inv, "expire_date", None)
+    if expires is not None and expires <= now:
+        return "expired"
+    limit = getattr(inv, "usage_limit", None)
+    if limit and invite_counters(inv)[0] >= limit:
+        return "exhausted"
+    return None
+
+
+async def find_dead_links(uc: TelegramClient, uid: int, chat_id: int,
+                          rows: Dict[str, dict]) -> List[Tuple[dict, str, Optional[Tuple[int, int]]]]:
+    """(row, reason, final counters) for the dead ones among one chat's links (invite hash -> row)."""
+    try:
+        peer = await resolve_peer(uc, chat_id)
+    except ValueError:
+        # unknown access hash even after get_dialogs: no answer from Telegram, so nothing to freeze on
+        print(f"reconcile {uid}: chat {chat_id} did not resolve, links left as they are")
+        return []
+
+    seen: Dict[str, Any] = {}
+    try:
+        for revoked in (False, True):
+            async for inv in iter_exported_invites(uc, peer, revoked):
+                h = invite_hash(getattr(inv, "link", "") or "")
+                if h in rows:
+                    seen.setdefault(h, inv)
+            if len(seen) == len(rows):
+                break
+    except CHAT_GONE_ERRORS:
+        return [(r, "chat_left", None) for r in rows.values()]
+
+    now = datetime.now(timezone.utc)
+    out = []
+    for h, inv in seen.items():  # links in neither list (another admin's, deleted) are left alone
+        reason = dead_link_reason(inv, now)
+        if reason:
+            out.append((rows[h], reason, invite_counters(inv)))
+    return out
+
+
+async def reconcile_owner(uid: int) -> Dict[str, int]:
+    """Freeze an owner's dead links. Returns reason -> links frozen."""
+    by_chat: Dict[int, Dict[str, dict]] = {}
+    for r in owner_links(uid).live():
+        by_chat.setdefault(int(r["chat_id"]), {})[invite_hash(r["invite_link"])] = r
+    if not by_chat:
+        return {}
+    uc = await get_user_client(uid)
+
+    frozen: Dict[str, List[int]] = {}
+    for chat_id, rows in by_chat.items():
+        try:
+            dead = await find_dead_links(uc, uid, chat_id, rows)
+        except Exception as ex:
+            print(f"reconcile {uid} chat {chat_id} error:", ex)
+            continue
+        for r, reason, cur in dead:
+            prev = last_link_counters(r)
+            if cur is not None and (prev is None or prev[0] != cur[0]):
+                # joins since the last sync: record them while the link still syncs
+                async with sync_scheduler.slot(uid, 1 + cur[0] / SYNC_COST_MEMBERS, interactive=False):
+                    synced = await sync_link(uc, uid, r)
+                if synced:
+                    await remember_link_counters(uid, int(r["id"]), cur)
+            frozen.setdefault(reason, []).append(int(r["id"]))
+
+    for reason, link_ids in frozen.items():
+        try:
+            sp_freeze_links(uid, link_ids, reason)
+        except Exception as ex:
+            # e.g. invite_links without frozen_at (migrations/0005 not applied)
+            print("freeze_links error:", ex)
+            continue
+        LINKS_FROZEN.inc(len(link_ids), reason=reason)
+    if frozen:
+        await outbox_settle((uid, link_id) for link_ids in frozen.values() for link_id in link_ids)
+    return {k: len(v) for k, v in frozen.items()}
+
+
+async def run_reconcile() -> Dict[str, int]:
+    """One dead-link pass over every owner with a saved session."""
+    global _reconcile_running
+    stats: Dict[str, int] = {"owners": 0, "frozen": 0}
+    if _reconcile_running:
+        return stats
+    _reconcile_running = True
+    try:
+        async for uid in iter_session_owners():
+            try:
+                frozen = await reconcile_owner(uid)
+            except Exception as ex:
+                print(f"reconcile {uid} error:", ex)
+                continue
+            stats["owners"] += 1
+            for reason, n in frozen.items():
+                stats[reason] = stats.get(reason, 0) + n
+                stats["frozen"] += n
+    finally:
+        _reconcile_running = False
+    return stats
 
+
+async def reconcile_loop():
+    await asyncio.sleep(120)  # let startup traffic and the warm-up settle
+    while True:
+        t0 = time.perf_counter()
+        try:
+            st = await run_reconcile()
+            if st["frozen"]:
+                print(f"🧊 dead links: {st} in {time.perf_counter() - t0:.1f}s")
         except Exception as ex:
-            print("left-check error:", ex)
+            print("reconcile error:", ex)
+        await asyncio.sleep(LINK_RECONCILE_INTERVAL)
+
+
+@router.command("reconcile")
+async def reconcile_cmd(e):
+    """Admin: check every owner's links for revoked / expired / exhausted ones now."""
+    if not is_admin(e.sender_id):
+        return
+    if _reconcile_running:
+        return await e.respond("⏳ A link check is already running.")
+    msg = await e.respond("🧊 Checking links for revoked / expired / exhausted ones...")
+    t0 = time.perf_counter()
+    try:
+        st = await run_reconcile()
+    except Exception as ex:
+        print("reconcile error:", ex)
+        return await msg.edit(f"❌ Link check failed: `{ex}`", parse_mode="md")
+    await msg.edit(
+        f"🧊 Link check done in {time.perf_counter() - t0:.1f}s\n"
+        + ", ".join(f"{k} `{v}`" for k, v in st.items()),
+        parse_mode="md",
+    )
 
 
 @bot.on(events.ChatAction)
@@ -1595,57 +2304,554 @@ async def track_user_left(e: events.ChatAction.Event):
         chat_id = int(e.chat_id)
         joined_user_id = int(e.user_id)
         reason = "kicked" if e.user_kicked else "left"
+        # whole seconds: the drainer marks the leaves of one second in one update
+        when = datetime.now(timezone.utc).replace(microsecond=0).isoformat()
 
-        # Kaun-kaun owner is chat ko track kar raha hai
-        res = (
-            supabase.table("invite_links")
-            .select("user_id")
-            .eq("chat_id", chat_id)
-            .eq("is_active", True)
-            .execute()
-        )
-        owners = list({int(r["user_id"]) for r in (res.data or [])})
+        # owners lookup + left mark happen in the outbox drainer (apply_leave_events)
+        await queue_writes("leave_event", [(
+            f"leave:{chat_id}:{joined_user_id}:{when}",
+            {"chat_id": chat_id, "user_id": joined_user_id, "reason": reason, "when": when},
+        )])
 
-        if not owners:
-            return
+    except Exception as ex:
+        print("track_user_left error:", ex)
 
-        for uid in owners:
-            # latest join row ko left mark karo
-            jr = (
-                supabase.table("joins")
-                .select("id,left_at")
-                .eq("user_id", uid)
-                .eq("chat_id", chat_id)
-                .eq("joined_user_id", joined_user_id)
-                .order("joined_at", desc=True)
-                .limit(1)
-                .execute()
-            )
 
-            if not jr.data:
-                continue
+# ---------------- WRITE OUTBOX (QUEUED JOIN / LEAVE WRITES) ----------------
+#  Join upserts and left marks go to a local durable outbox (outbox.py)
+#  and return at once; drain_outbox replays them in order, in batches,
+#  with backoff while the DB is slow or down. The fsync'd put runs in a
+#  thread and is shared by every write queued meanwhile. A run of leave
+#  events is applied per chat in one batch. In-memory state that the
+#  sync path already updated (MemberSet snapshots, window indexes) is
+#  only corrected here when it was rebuilt from the DB in between.
+#  outbox_settle waits for the writes of given links only (those queued
+#  by this process), not for the whole queue.
+
+_outbox_lock = asyncio.Lock()  # one drain at a time
+_outbox_wake = asyncio.Event()  # set by queue_writes
+_outbox_waiters: List[asyncio.Future] = []  # outbox_settle calls waiting for the drainer to make progress
+_put_queue: List[Tuple[str, List[Tuple[str, Any]], Optional[Tuple[int, int]], asyncio.Future]] = []
+_put_task: Optional[asyncio.Task] = None  # the put running now; later writes wait for the next one
+# (uid, invite_link_id) -> outbox keys queued for it and not applied yet, and key -> its link
+outbox_pending: Dict[Tuple[int, int], Set[str]] = {}
+_outbox_key_link: Dict[str, Tuple[int, int]] = {}
+
+
+async def queue_writes(op: str, items: List[Tuple[str, Any]], link: Optional[Tuple[int, int]] = None) -> int:
+    """
+    Append (idempotency key, payload) writes to the outbox and wake the
+    drainer. Returns how many were new. link = (uid, invite_link_id) the
+    writes belong to, for outbox_settle.
+    """
+    global _put_task
+    if not items:
+        return 0
+    if link is not None:  # before the put: the drainer may apply them before it returns
+        outbox_pending.setdefault(link, set()).update(key for key, _ in items)
+        _outbox_key_link.update((key, link) for key, _ in items)
+    fut = asyncio.get_running_loop().create_future()
+    _put_queue.append((op, items, link, fut))
+    if _put_task is None or _put_task.done():
+        _put_task = asyncio.create_task(_flush_puts())
+    return await fut
+
+
+async def _flush_puts():
+    """Put everything queued so far in one outbox transaction, until nothing is left."""
+    while _put_queue:
+        batch = _put_queue[:]
+        del _put_queue[:]
+        try:
+            new = await asyncio.to_thread(outbox.put_many, [(op, items) for op, items, _, _ in batch])
+        except Exception as ex:
+            for op, items, link, fut in batch:
+                outbox_forget([key for key, _ in items])
+                if not fut.done():
+                    fut.set_exception(ex)
+            continue
+        for (op, items, link, fut), keys in zip(batch, new):
+            if len(keys) < len(items):  # already queued (or parked as dead) before: not waited for
+                have = set(keys)
+                outbox_forget([key for key, _ in items if key not in have])
+            if keys:
+                OUTBOX_ITEMS.inc(len(keys), op=op, outcome="queued")
+            if not fut.done():
+                fut.set_result(len(keys))
+        _outbox_wake.set()
+
+
+def outbox_forget(keys: List[str]):
+    """These writes landed (or were given up on): wake outbox_settle calls waiting for their links."""
+    for key in keys:
+        link = _outbox_key_link.pop(key, None)
+        pending = outbox_pending.get(link)
+        if pending is not None:
+            pending.discard(key)
+            if not pending:
+                del outbox_pending[link]
+    for fut in _outbox_waiters:
+        if not fut.done():
+            fut.set_result(None)
+    _outbox_waiters.clear()
+
+
+def apply_leave_events(evs: List[dict]) -> List[Tuple[dict, List[Tuple[int, int, int]]]]:
+    """
+    Mark the latest join row of each leaving user left for every owner
+    tracking the chat, one batch per chat. Returns (event, [(uid, link_id,
+    joined epoch) marked]) per applied event; a second leave of the same
+    member in the batch is dropped (it would find the row already left).
+    """
+    by_chat: Dict[int, Dict[int, dict]] = {}
+    for ev in evs:
+        by_chat.setdefault(int(ev["chat_id"]), {}).setdefault(int(ev["user_id"]), ev)
+    out = []
+    for chat_id, leaves in by_chat.items():
+        rows = sp_mark_members_left(chat_id, [
+            {"joined_user_id": u, "reason": ev["reason"], "when": ev["when"]} for u, ev in leaves.items()
+        ])
+        marked: Dict[int, List[Tuple[int, int, int]]] = {}
+        for r in rows:
+            if r.get("invite_link_id") is not None:
+                marked.setdefault(int(r["joined_user_id"]), []).append(
+                    (int(r["user_id"]), int(r["invite_link_id"]), trend.epoch_of(r.get("joined_at")))
+                )
+        out.extend((ev, marked.get(u, [])) for u, ev in leaves.items())
+    return out
 
-            row = jr.data[0]
-            if row.get("left_at"):
-                continue
 
-            supabase.table("joins").update(
-                {
-                    "left_at": datetime.now(timezone.utc).isoformat(),
-                    "left_reason": reason,
-                    "left_seen_at": datetime.now(timezone.utc).isoformat(),
-                }
-            ).eq("id", row["id"]).execute()
+JOIN_KEY = ("user_id", "chat_id", "invite_link_id", "joined_user_id")  # joins upsert conflict target
 
-    except Exception as ex:
-        print("track_user_left error:", ex)
 
+def join_units(group: List[OutboxItem]) -> List[Tuple[dict, List[OutboxItem]]]:
+    """
+    upsert_joins items merged per join row: (newest payload, items it covers).
+    One upsert may not touch a row twice (a join and a rejoin of the same
+    member queued together), so only the latest joined_at is sent.
+    """
+    units: Dict[tuple, Tuple[dict, List[OutboxItem]]] = {}
+    for it in group:
+        key = tuple(it.payload[k] for k in JOIN_KEY)
+        unit = units.get(key)
+        if unit is None:
+            units[key] = (it.payload, [it])
+            continue
+        if trend.epoch_of(it.payload.get("joined_at")) >= trend.epoch_of(unit[0].get("joined_at")):
+            units[key] = (it.payload, unit[1])
+        unit[1].append(it)
+    return list(units.values())
 
-# ---------------- STATS COMMANDS (PER LINK, WITH SELECTION) ----------------
 
-async def _stats_template(
-    e,
-    label: str,
+async def apply_join_units(units: List[Tuple[dict, list]]) -> Tuple[list, list, Optional[str]]:
+    """
+    Upsert these rows; when the batch fails, split it in halves to isolate
+    the failing rows. Returns (applied units, failed units, last error).
+    A left half that lands nothing (DB down, or its only row is bad) gets
+    its right half tried once, unsplit, so an outage costs ~2*log2(n) calls.
+    """
+    try:
+        await asyncio.to_thread(sp_upsert_joins, [row for row, _ in units])
+        return units, [], None
+    except Exception as ex:
+        error = f"{type(ex).__name__}: {ex}"
+    if len(units) == 1:
+        return [], units, error
+    mid = len(units) // 2
+    applied, failed, err = await apply_join_units(units[:mid])
+    if applied:
+        right_applied, right_failed, right_err = await apply_join_units(units[mid:])
+        return applied + right_applied, failed + right_failed, right_err or err
+    try:
+        await asyncio.to_thread(sp_upsert_joins, [row for row, _ in units[mid:]])
+        return units[mid:], failed, err
+    except Exception as ex:
+        return [], units, f"{type(ex).__name__}: {ex}"
+
+
+def outbox_links_written(since: Dict[Tuple[int, int], float]):
+    """Drop caches of links whose rows just landed; indexes built after `since` (queue time) missed them."""
+    for key, queued in since.items():
+        invalidate_trend(*key)
+        idx = link_index.get(key)
+        if idx is None or idx.built_at >= queued:
+            drop_link_index(*key)
+
+
+def outbox_leaves_applied(applied: List[Tuple[dict, List[Tuple[int, int, int]]]], started: float):
+    by_link: Dict[Tuple[int, int], List[Tuple[dict, int]]] = {}
+    for ev, marked in applied:
+        for uid, link_id, joined in marked:
+            by_link.setdefault((uid, link_id), []).append((ev, joined))
+    for (uid, link_id), evs in by_link.items():
+        path = members_path(uid, link_id)
+        ms = MemberSet.load(path, writable=True)
+        if ms is not None:
+            by_when: Dict[str, List[int]] = {}
+            for ev, _ in evs:
+                by_when.setdefault(ev["when"], []).append(ev["user_id"])
+            if sum(ms.mark_left(users, when) for when, users in by_when.items()):
+                ms.flush(path)
+        invalidate_trend(uid, link_id)
+        idx = link_index.get((uid, link_id))
+        if idx is not None and idx.built_at >= started:
+            drop_link_index(uid, link_id)  # may already hold these rows as left
+        else:
+            index_link_joins(uid, link_id, left=[joined for _, joined in evs])
+
+
+async def drain_outbox(until: Optional[Callable[[], bool]] = None) -> int:
+    """
+    Apply due outbox items oldest first; stops at the first failure (order
+    is kept). A run of upsert_joins is one upsert per batch; rows that fail
+    while the rest of it lands back off on their own (OUTBOX_POISON_ATTEMPTS)
+    instead of holding the batch. until() is checked between rounds (stop
+    early once it is true). Returns items applied.
+    """
+    applied = 0
+    async with _outbox_lock:
+        while True:
+            if until is not None and until():
+                return applied
+            items = await asyncio.to_thread(outbox.head, OUTBOX_BATCH)
+            if not items:
+                return applied
+            for op, group in runs(items):
+                if op in ("upsert_joins", "mark_left_members"):
+                    dropped = [it for it in group if int(it.payload["invite_link_id"]) in removed_links]
+                    if dropped:  # the link was removed: its rows are being reaped, do not write new ones
+                        await asyncio.to_thread(outbox.done, [it.seq for it in dropped])
+                        outbox_forget([it.key for it in dropped])
+                        OUTBOX_ITEMS.inc(len(dropped), op=op, outcome="dropped")
+                        applied += len(dropped)
+                        group = [it for it in group if int(it.payload["invite_link_id"]) not in removed_links]
+                        if not group:
+                            continue
+                done = []
+                error = None
+                failed: List[OutboxItem] = []  # upsert_joins rows isolated as failing
+                try:
+                    if op == "upsert_joins":
+                        ok, bad, error = await apply_join_units(join_units(group))
+                        done = [it for _, its in ok for it in its]
+                        failed = [it for _, its in bad for it in its]
+                    elif op == "mark_left_members":
+                        for it in group:
+                            p = it.payload
+                            await asyncio.to_thread(
+                                sp_mark_left_members_now, p["uid"], p["invite_link_id"], p["ids"], p["reason"], p["when"]
+                            )
+                            done.append(it)
+                    elif op == "leave_event":
+                        started = time.time()
+                        marked = await asyncio.to_thread(apply_leave_events, [it.payload for it in group])
+                        outbox_leaves_applied(marked, started)
+                        done = group
+                    else:
+                        raise ValueError(f"unknown outbox op {op!r}")
+                except Exception as ex:
+                    error = f"{type(ex).__name__}: {ex}"
+                if done:
+                    await asyncio.to_thread(outbox.done, [it.seq for it in done])
+                    outbox_forget([it.key for it in done])
+                    OUTBOX_ITEMS.inc(len(done), op=op, outcome="applied")
+                    applied += len(done)
+                    if op != "leave_event":
+                        since: Dict[Tuple[int, int], float] = {}
+                        for it in done:
+                            p = it.payload
+                            key = (int(p.get("uid", p.get("user_id"))), int(p["invite_link_id"]))
+                            since[key] = min(since.get(key, it.created_at), it.created_at)
+                        outbox_links_written(since)
+                if error is not None:
+                    if op == "upsert_joins":
+                        rest = failed
+                        limit = OUTBOX_POISON_ATTEMPTS if done else OUTBOX_MAX_ATTEMPTS
+                    else:
+                        rest = group[len(done):]
+                        limit = OUTBOX_MAX_ATTEMPTS
+                    dead = await asyncio.to_thread(outbox.failed, [it.seq for it in rest], error, limit)
+                    OUTBOX_ITEMS.inc(len(rest) - dead, op=op, outcome="retry")
+                    if dead:
+                        OUTBOX_ITEMS.inc(dead, op=op, outcome="dead")
+                        outbox_forget([it.key for it in rest])
+                    print(f"outbox {op} error (attempt {rest[0].attempts + 1}):", error)
+                    return applied
+
+
+async def outbox_settle(links: Iterable[Tuple[int, int]], timeout: float = OUTBOX_SETTLE_SECONDS):
+    """Wait (bounded) for the queued writes of these (uid, invite_link_id) links to land, so reads right after a sync see them."""
+    links = [k for k in set(links) if k in outbox_pending]
+    if not links:
+        return
+
+    def landed() -> bool:
+        return not any(k in outbox_pending for k in links)
+
+    async def settle():
+        while not landed():
+            if not _outbox_lock.locked() and await asyncio.shield(drain_outbox(until=landed)):
+                continue
+            fut = asyncio.get_running_loop().create_future()
+            _outbox_waiters.append(fut)
+            await fut
+
+    try:
+        await asyncio.wait_for(settle(), timeout)
+    except asyncio.TimeoutError:
+        pass  # the drainer keeps going in the background
+    except Exception as ex:
+        print("outbox settle error:", ex)
+
+
+async def outbox_loop():
+    while True:
+        _outbox_wake.clear()
+        try:
+            await drain_outbox()
+        except Exception as ex:
+            print("outbox drain error:", ex)
+        delay = await asyncio.to_thread(outbox.retry_in)
+        try:
+            await asyncio.wait_for(_outbox_wake.wait(), 60 if delay is None else max(delay, 0.05))
+        except asyncio.TimeoutError:
+            pass
+
+
+# ---------------- JOIN REQUESTS (APPROVAL LINKS) ----------------
+
+join_request_limiters: Dict[int, TokenBucket] = {}  # owner uid -> limiter
+join_requests_running: Set[int] = set()  # invite_link ids being processed
+
+
+def join_request_limiter(uid: int) -> TokenBucket:
+    lim = join_request_limiters.get(uid)
+    if lim is None:
+        lim = join_request_limiters[uid] = TokenBucket(JOIN_REQUEST_RATE, burst=JOIN_REQUEST_BATCH)
+    return lim
+
+
+async def count_pending_requests(uc: TelegramClient, r: dict) -> int:
+    """Pending join requests of an approval link (one RPC, limit=1 + server count)."""
+    peer = await resolve_peer(uc, int(r["chat_id"]))
+    res = await uc(
+        functions.messages.GetChatInviteImportersRequest(
+            peer=peer,
+            link=invite_hash(r["invite_link"]),
+            offset_date=None,
+            offset_user=tl_types.InputUserEmpty(),
+            limit=1,
+            requested=True,
+        )
+    )
+    return int(getattr(res, "count", 0) or 0)
+
+
+async def iter_pending_requests(uc: TelegramClient, peer, link_part: str, page: int = JOIN_REQUEST_PAGE):
+    """Yield pages of InputUser for pending requests (requested=True), oldest offset first."""
+    offset_date = None
+    offset_user = tl_types.InputUserEmpty()
+    while True:
+        res = await uc(
+            functions.messages.GetChatInviteImportersRequest(
+                peer=peer,
+                link=link_part,
+                offset_date=offset_date,
+                offset_user=offset_user,
+                limit=page,
+                requested=True,
+            )
+        )
+        importers = getattr(res, "importers", []) or []
+        users = {u.id: u for u in (getattr(res, "users", []) or [])}
+        batch = []
+        for imp in importers:
+            u = users.get(imp.user_id)
+            if u is not None and getattr(u, "access_hash", None) is not None:
+                batch.append(types.InputUser(u.id, u.access_hash))
+        if batch:
+            yield batch
+        if len(importers) < page:
+            return
+        last = importers[-1]
+        lu = users.get(last.user_id)
+        if lu is None:
+            return
+        offset_date, offset_user = last.date, types.InputUser(lu.id, lu.access_hash)
+
+
+async def _hide_requests_batch(uc: TelegramClient, uid: int, peer, users: List, approve: bool) -> Tuple[int, int]:
+    """One container of HideChatJoinRequest calls. Returns (done, failed)."""
+    limiter = join_request_limiter(uid)
+    reqs = [functions.messages.HideChatJoinRequestRequest(peer=peer, user_id=u, approved=approve) for u in users]
+    for _ in range(3):
+        await limiter.acquire(len(reqs))
+        try:
+            await uc(reqs)
+            return len(reqs), 0
+        except errors.MultiError as ex:
+            failed = sum(1 for x in ex.exceptions if x is not None)
+            return len(reqs) - failed, failed
+        except errors.FloodWaitError as ex:
+            limiter.penalize(ex.seconds)
+    return 0, len(reqs)
+
+
+async def process_join_requests(uc: TelegramClient, uid: int, r: dict, approve: bool, progress=None) -> Dict[str, Any]:
+    """
+    Approve / decline every pending request of one approval link.
+    HideAllChatJoinRequests(link=...) does it in one RPC; if Telegram refuses,
+    page the requests and send batched HideChatJoinRequest under the limiter.
+    progress(done, failed, pending) is awaited after every batch.
+    """
+    action = "approve" if approve else "decline"
+    peer = await resolve_peer(uc, int(r["chat_id"]))
+    link_part = invite_hash(r["invite_link"])
+    pending = await count_pending_requests(uc, r)
+    if not pending:
+        return {"pending": 0, "done": 0, "failed": 0, "method": "none"}
+
+    try:
+        await join_request_limiter(uid).acquire()
+        await uc(functions.messages.HideAllChatJoinRequestsRequest(peer=peer, approved=approve, link=r["invite_link"]))
+        JOIN_REQUESTS.inc(pending, action=action, method="bulk", outcome="ok")
+        return {"pending": pending, "done": pending, "failed": 0, "method": "bulk"}
+    except Exception as ex:
+        print(f"HideAllChatJoinRequests failed for link {r['id']}, falling back to batches:", ex)
+
+    done = failed = 0
+    async for users in iter_pending_requests(uc, peer, link_part):
+        for i in range(0, len(users), JOIN_REQUEST_BATCH):
+            ok, bad = await _hide_requests_batch(uc, uid, peer, users[i:i + JOIN_REQUEST_BATCH], approve)
+            done += ok
+            failed += bad
+            if progress:
+                await progress(done, failed, pending)
+    JOIN_REQUESTS.inc(done, action=action, method="batch", outcome="ok")
+    JOIN_REQUESTS.inc(failed, action=action, method="batch", outcome="error")
+    return {"pending": pending, "done": done, "failed": failed, "method": "batch"}
+
+
+def _approval_links(uid: int) -> List[dict]:
+    return [r for r in owner_links(uid).rows if (r.get("link_type") or "normal") == "approval"]
+
+
+def join_request_action_kb(link_id: int) -> List[List[Button]]:
+    return [
+        [
+            Button.inline("✅ Approve all", data=f"jr_do:approve:{link_id}".encode()),
+            Button.inline("❌ Decline all", data=f"jr_do:decline:{link_id}".encode()),
+        ],
+        [Button.inline("✖ Cancel", data=b"jr_cancel")],
+    ]
+
+
+@router.command("requests")
+async def requests_cmd(e):
+    """Pending join requests per approval link + bulk approve/decline."""
+    uid = e.sender_id
+    try:
+        uc = await get_user_client(uid)
+    except Exception:
+        return await e.respond("🔒 Please `/login` first.", parse_mode="md")
+
+    rows = _approval_links(uid)
+    if not rows:
+        return await e.respond("ℹ️ No approval links yet. Use /create_link → **Admin Approval Link**.", parse_mode="md")
+
+    counts = await asyncio.gather(*(count_pending_requests(uc, r) for r in rows[:10]), return_exceptions=True)
+    lines = ["🛂 **Pending join requests**", ""]
+    picker_rows = []
+    for r, n in zip(rows, counts):
+        title = r.get("chat_title") or f"id:{r.get('chat_id')}"
+        n = n if isinstance(n, int) else "?"
+        lines.append(f"• {title}: `{n}`")
+        picker_rows.append({**r, "chat_title": f"({n}) {title}"})
+
+    await e.respond(
+        "\n".join(lines) + "\n\nSelect a link to approve / decline all:",
+        parse_mode="md",
+        buttons=link_picker_kb("jr", picker_rows, b"jr_cancel"),
+    )
+
+
+@router.callback(b"jr:")
+async def cb_join_requests_link(event):
+    try:
+        link_id = int(event.data.decode().split(":")[1])
+    except Exception:
+        return await event.answer("Invalid selection.", alert=True)
+    await event.edit(
+        "🛂 Approve or decline **all** pending requests for this link?",
+        parse_mode="md",
+        buttons=join_request_action_kb(link_id),
+    )
+
+
+@router.callback(b"jr_do:")
+async def cb_join_requests_do(event):
+    uid = event.sender_id
+    try:
+        _, action, raw_id = event.data.decode().split(":")
+        link_id = int(raw_id)
+    except Exception:
+        return await event.answer("Invalid action.", alert=True)
+
+    r = next((x for x in _approval_links(uid) if int(x["id"]) == link_id), None)
+    if not r:
+        return await event.answer("Link not found.", alert=True)
+    if link_id in join_requests_running:
+        return await event.answer("Already processing this link.", alert=True)
+
+    try:
+        uc = await get_user_client(uid)
+    except Exception as ex:
+        return await event.edit(f"❌ {ex}", buttons=None)
+
+    ctx = stats_pages.pop((uid, event.message_id), None)  # started from a stats view
+    if ctx and ctx.get("prefetch"):
+        ctx["prefetch"][1].cancel()
+
+    verb = "Approving" if action == "approve" else "Declining"
+    await event.edit(f"⏳ {verb} pending requests…", buttons=None)
+    last_edit = [time.monotonic()]
+
+    async def progress(done: int, failed: int, pending: int):
+        if time.monotonic() - last_edit[0] < 3:
+            return
+        last_edit[0] = time.monotonic()
+        try:
+            await event.edit(f"⏳ {verb}… {done + failed}/{pending}", buttons=None)
+        except Exception:
+            pass
+
+    join_requests_running.add(link_id)
+    try:
+        res = await process_join_requests(uc, uid, r, action == "approve", progress)
+    except Exception as ex:
+        print("join requests error:", ex)
+        return await event.edit(f"❌ Failed: `{ex}`", parse_mode="md", buttons=None)
+    finally:
+        join_requests_running.discard(link_id)
+
+    if res["method"] == "none":
+        return await event.edit("ℹ️ No pending requests.", buttons=None)
+    msg = f"✅ {'Approved' if action == 'approve' else 'Declined'} `{res['done']}` request(s)."
+    if res["failed"]:
+        msg += f"\n⚠️ `{res['failed']}` could not be processed."
+    await event.edit(msg, parse_mode="md", buttons=None)
+
+
+@router.callback(b"jr_cancel")
+async def cb_join_requests_cancel(event):
+    await event.edit("✖ Cancelled.", buttons=None)
+
+
+# ---------------- STATS COMMANDS (PER LINK, WITH SELECTION) ----------------
+
+async def _stats_template(
+    e,
+    label: str,
     since: Optional[datetime],
     until: Optional[datetime] = None,
 ):
@@ -1655,7 +2861,7 @@ async def _stats_template(
         return await e.respond("🔒 Please `/login` first.", parse_mode="md")
     
 
-    rows = sp_list_invite_links(uid)
+    rows = owner_links(uid).rows
     if not rows:
         return await e.respond(
             "ℹ️ No active invite links yet. Use /create_link first.",
@@ -1669,14 +2875,7 @@ async def _stats_template(
         "until": until,
     }
 
-    btn_rows: List[List[Button]] = []
-    for r in rows[:10]:
-        title = r.get("chat_title") or f"id:{r.get('chat_id')}"
-        short = (title[:40] + "…") if len(title) > 40 else title
-        data = f"stats:{r['id']}".encode()
-        btn_rows.append([Button.inline(short, data=data)])
-
-    btn_rows.append([Button.inline("✖ Cancel", data=b"stats_cancel")])
+    btn_rows = link_picker_kb("stats", rows, b"stats_cancel")
 
     await e.respond(
         "📊 **Select which invite link you want stats for:**",
@@ -1685,7 +2884,7 @@ async def _stats_template(
     )
 
 
-@bot.on(events.CallbackQuery(pattern=b"^stats:"))
+@router.callback(b"stats:")
 async def cb_stats_link(event):
     """User selected a specific invite_link for stats (first page)."""
     uid = event.sender_id
@@ -1712,17 +2911,11 @@ async def cb_stats_link(event):
     await sync_importers_to_db(uid)
 
     # Total joins for this link
-    total = sp_count_joins_for_link(uid, link_id, since=since, until=until)
-    left_total = sp_count_left_for_link(uid, link_id, since=since, until=until)
+    total, left_total = await link_window_counts(uid, link_id, since=since, until=until)
 
 
     # Fetch link info once and store in context
-    rows = sp_list_invite_links(uid)
-    chosen = None
-    for r in rows:
-        if int(r["id"]) == link_id:
-            chosen = r
-            break
+    chosen = owner_links(uid).get(link_id)
 
     if chosen:
         title = chosen.get("chat_title") or f"id:{chosen.get('chat_id')}"
@@ -1735,6 +2928,13 @@ async def cb_stats_link(event):
         created_at = None
         link_type = "normal"
 
+    pending = None
+    if link_type == "approval" and chosen:
+        try:
+            pending = await count_pending_requests(await get_user_client(uid), chosen)
+        except Exception as ex:
+            print("pending count error:", ex)
+
     # Normal page size
     page_size = 15
 
@@ -1745,7 +2945,8 @@ async def cb_stats_link(event):
         "label": label,
         "since": since,
         "until": until,
-        "offset": 0,
+        "page": 0,
+        "cursors": [None],  # keyset cursor each page starts after
         "page_size": page_size,
         "total": total,
         "title": title,
@@ -1753,6 +2954,7 @@ async def cb_stats_link(event):
         "created_at": created_at,
         "link_type": link_type,  # ✅ NEW
         "left_total": left_total,
+        "pending": pending,
 
 
     }
@@ -1761,7 +2963,7 @@ async def cb_stats_link(event):
     await render_stats_page(event, uid, stats_pages[key])
 
 
-@bot.on(events.CallbackQuery(pattern=b"^stats_page:"))
+@router.callback(b"stats_page:")
 async def cb_stats_page(event):
     """
     Handle pagination buttons for stats user list.
@@ -1781,28 +2983,35 @@ async def cb_stats_page(event):
 
     if action == "close":
         stats_pages.pop(key, None)
+        pending = ctx.pop("prefetch", None)
+        if pending:
+            pending[1].cancel()
         await event.edit("✖ Stats closed.", buttons=None)
         return
 
     if action == "next":
-        ctx["offset"] += ctx["page_size"]
+        if ctx["page"] + 1 >= len(ctx["cursors"]):
+            return await event.answer("No more joiners.")
+        ctx["page"] += 1
     elif action == "prev":
-        ctx["offset"] -= ctx["page_size"]
+        if ctx["page"] == 0:
+            return await event.answer("Already on first page.")
+        ctx["page"] -= 1
 
     await render_stats_page(event, uid, ctx)
 
 
-@bot.on(events.CallbackQuery(pattern=b"^stats_cancel$"))
+@router.callback(b"stats_cancel")
 async def cb_stats_cancel(event):
     stats_state.pop(event.sender_id, None)
     await event.edit("✖ Stats selection cancelled.", buttons=None)
 
 
-@bot.on(events.NewMessage(pattern=r"^/stats$"))
+@router.command("stats")
 async def stats_all_cmd(e):
     await _stats_template(e, "All time", since=None)
 
-@bot.on(events.NewMessage(pattern=r"^/(?:yesterday|yestarday)$"))
+@router.command("yesterday", "yestarday")
 async def yesterday_status_cmd(e):
     uid = e.sender_id
     if not await is_logged_in(uid):
@@ -1823,61 +3032,713 @@ async def yesterday_status_cmd(e):
 
 
 
-@bot.on(events.NewMessage(pattern=r"^/hour_status$"))
+@router.command("hour_status")
 async def stats_hour_cmd(e):
     now = datetime.now(timezone.utc)
     start = now - timedelta(hours=1)
     await _stats_template(e, "Last 1 hour", since=start)
 
 
-@bot.on(events.NewMessage(pattern=r"^/today_status$"))
+@router.command("today_status")
 async def stats_today_cmd(e):
     now = datetime.now(timezone.utc)
     start = now.replace(hour=0, minute=0, second=0, microsecond=0)
     await _stats_template(e, "Today", since=start)
 
-@bot.on(events.NewMessage(pattern=r"^/yestarday$"))  # typo support
-async def yesterday_status_cmd(e):
-    uid = e.sender_id
-    if not await is_logged_in(uid):
-        return await e.respond("🔒 Please `/login` first.", parse_mode="md")
-
-    IST = timezone(timedelta(hours=5, minutes=30))
-    now_ist = datetime.now(IST)
-
-    # ✅ yesterday range in IST
-    y_start_ist = (now_ist - timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
-    y_end_ist = y_start_ist + timedelta(days=1)
-
-    # store/filter in UTC timestamps (safe)
-    since_utc = y_start_ist.astimezone(timezone.utc)
-    until_utc = y_end_ist.astimezone(timezone.utc)
-
-    await _stats_template(e, label="Yesterday", since=since_utc, until=until_utc)
-
-
-
-@bot.on(events.NewMessage(pattern=r"^/week_status$"))
+@router.command("week_status")
 async def stats_week_cmd(e):
     now = datetime.now(timezone.utc)
     start = now - timedelta(days=7)
     await _stats_template(e, "Last 7 days", since=start)
 
 
-@bot.on(events.NewMessage(pattern=r"^/month_status$"))
+@router.command("month_status")
 async def stats_month_cmd(e):
     now = datetime.now(timezone.utc)
     start = now - timedelta(days=30)
     await _stats_template(e, "Last 30 days", since=start)
 
 
-@bot.on(events.NewMessage(pattern=r"^/year_status$"))
+@router.command("year_status")
 async def stats_year_cmd(e):
     now = datetime.now(timezone.utc)
     start = now - timedelta(days=365)
     await _stats_template(e, "Last 365 days", since=start)
 
 
+# ---------------- COLD ARCHIVE (OLD JOIN ROWS -> BUCKET) ----------------
+#  Rows that left more than ARCHIVE_AFTER_DAYS ago move, per link, into
+#  columnar objects (archive.py) in the bucket, with a join_archives
+#  manifest holding their rollups. A window that covers a whole object is
+#  counted from the manifest; only objects straddling a window edge are
+#  downloaded. Trend uses the per-day rollups; export and snapshot
+#  rebuilds stream the archived rows.
+#  Counting: archived objects are never rewritten. A member whose row was
+#  archived and who rejoins gets a second (hot) row, so windows covering
+#  both count two joins and one leave for them. Before archival the rejoin
+#  overwrote the row and moved its joined_at.
+
+link_archives: Dict[Tuple[int, int], List[dict]] = {}  # (uid, link) -> 'done' manifests
+archive_objects: Dict[str, Dict[str, Any]] = {}  # object name -> decoded columns (LRU)
+archive_windows: Dict[str, trend.WindowIndex] = {}  # object name -> window index (LRU)
+_archive_running = False
+
+
+def archives_enabled() -> bool:
+    return store.archives and store.has_objects
+
+
+@db_op
+def sp_list_archives(uid: int, invite_link_id: int) -> List[dict]:
+    return store.list_archives(uid, invite_link_id)
+
+
+@db_op
+def sp_archivable_joins(uid: int, invite_link_id: int, before: datetime, limit: int,
+                        after_id: int = 0) -> List[dict]:
+    return store.archivable_joins(uid, invite_link_id, before, limit, after_id=after_id)
+
+
+def archivable_batch(uid: int, link_id: int, before: datetime) -> List[dict]:
+    """Up to ARCHIVE_BATCH archivable rows of a link, ARCHIVE_PAGE per request (keyset on id)."""
+    rows: List[dict] = []
+    after = 0
+    while len(rows) < ARCHIVE_BATCH:
+        want = min(ARCHIVE_PAGE, ARCHIVE_BATCH - len(rows))
+        page = sp_archivable_joins(uid, link_id, before, want, after_id=after)
+        rows.extend(page)
+        if len(page) < want:
+            break
+        after = int(page[-1]["id"])
+    return rows
+
+
+@db_op
+def sp_add_archive(row: dict) -> dict:
+    return store.add_archive(row)
+
+
+@db_op
+def sp_finish_archive(archive_id: int, row_ids: List[int]):
+    store.finish_archive(archive_id, row_ids)
+
+
+@db_op
+def sp_pending_archives() -> List[dict]:
+    return store.pending_archives()
+
+
+@db_op
+def sp_put_object(object_name: str, data: bytes, content_type: str):
+    store.put_object(object_name, data, content_type)
+
+
+@db_op
+def sp_get_object(object_name: str) -> bytes:
+    return store.get_object(object_name)
+
+
+def link_archive_manifests(uid: int, link_id: int) -> List[dict]:
+    if not archives_enabled():
+        return []
+    key = (uid, link_id)
+    ms = link_archives.get(key)
+    if ms is None:
+        ms = link_archives[key] = sp_list_archives(uid, link_id)
+    return ms
+
+
+def archive_columns(object_name: str) -> Dict[str, Any]:
+    return _cached(
+        archive_objects, object_name, ARCHIVE_CACHE_MAX,
+        lambda: archive.decode(sp_get_object(object_name), object_name),
+    )
+
+
+def archived_counts(
+    uid: int,
+    link_id: int,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+) -> Tuple[int, int]:
+    """(joins, left) of archived rows joined in [since, until] (blocking: manifests, object downloads)."""
+    joins = left = 0
+    for m in link_archive_manifests(uid, link_id):
+        cover = archive.window_coverage(m, since, until)
+        if cover == "all":
+            joins += int(m["rows"])
+            left += int(m["left_rows"])
+        elif cover == "part":
+            name = m["object_name"]
+            idx = _cached(archive_windows, name, ARCHIVE_CACHE_MAX,
+                          lambda: archive.archived_window(archive_columns(name)))
+            j, l = idx.counts(since, until)
+            joins += j
+            left += l
+    return joins, left
+
+
+def archived_rows(
+    uid: int,
+    link_id: int,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+) -> Iterator[dict]:
+    """Archived join rows of a link joined in [since, until], oldest object first."""
+    for m in link_archive_manifests(uid, link_id):
+        if archive.window_coverage(m, since, until) == "none":
+            continue
+        for row in archive.iter_rows(archive_columns(m["object_name"]), since, until):
+            row["chat_id"] = m["chat_id"]
+            yield row
+
+
+def _archive_batch(uid: int, r: dict, cutoff: datetime) -> int:
+    """Move one batch of a link's old closed rows to an archive object. Returns rows moved."""
+    link_id = int(r["id"])
+    rows = archivable_batch(uid, link_id, cutoff)
+    if len(rows) < ARCHIVE_MIN_ROWS:
+        return 0
+    cols = archive.to_columns(rows)
+    name = archive.object_name(uid, link_id, cols)
+    sp_put_object(name, archive.encode(cols), "application/octet-stream")
+    m = sp_add_archive({
+        "user_id": uid,
+        "chat_id": int(r["chat_id"]),
+        "invite_link_id": link_id,
+        "object_name": name,
+        **archive.rollup(cols),
+    })
+    # manifest first, then delete: an interrupted run is finished by recover_pending_archives()
+    sp_finish_archive(int(m["id"]), list(cols["id"]))
+    return len(rows)
+
+
+def recover_pending_archives() -> int:
+    """Finish runs that stopped between writing a manifest and deleting its rows."""
+    n = 0
+    for m in sp_pending_archives():
+        try:
+            cols = archive.decode(sp_get_object(m["object_name"]), m["object_name"])
+            sp_finish_archive(int(m["id"]), list(cols["id"]))
+        except Exception as ex:
+            print(f"archive recovery {m.get('object_name')}:", ex)
+            continue
+        link_archives.pop((int(m["user_id"]), int(m["invite_link_id"])), None)
+        n += 1
+    return n
+
+
+async def run_archival() -> Dict[str, int]:
+    """One archival pass over every active owner's links."""
+    global _archive_running
+    stats = {"owners": 0, "links": 0, "objects": 0, "rows": 0, "recovered": 0}
+    if _archive_running or ARCHIVE_AFTER_DAYS <= 0 or not archives_enabled():
+        return stats
+    _archive_running = True
+    try:
+        stats["recovered"] = await asyncio.to_thread(recover_pending_archives)
+        cutoff = datetime.now(timezone.utc) - timedelta(days=ARCHIVE_AFTER_DAYS)
+        async for uid in iter_session_owners():
+            stats["owners"] += 1
+            for r in await asyncio.to_thread(sp_list_invite_links, uid):
+                link_id = int(r["id"])
+                moved = 0
+                while True:
+                    n = await asyncio.to_thread(_archive_batch, uid, r, cutoff)
+                    if not n:
+                        break
+                    moved += n
+                    stats["objects"] += 1
+                    if n < ARCHIVE_BATCH:
+                        break
+                if moved:
+                    stats["links"] += 1
+                    stats["rows"] += moved
+                    ARCHIVED_ROWS.inc(moved)
+                    link_archives.pop((uid, link_id), None)
+                    drop_link_index(uid, link_id)
+                    invalidate_trend(uid, link_id)
+    finally:
+        _archive_running = False
+    return stats
+
+
+async def archive_loop():
+    await asyncio.sleep(60)  # let startup traffic settle
+    while True:
+        t0 = time.perf_counter()
+        try:
+            st = await run_archival()
+            if st["rows"] or st["recovered"]:
+                print(f"🧊 archival: {st} in {time.perf_counter() - t0:.1f}s")
+        except Exception as ex:
+            print("archival error:", ex)
+        await asyncio.sleep(ARCHIVE_INTERVAL)
+
+
+@router.command("archive")
+async def archive_cmd(e):
+    """Admin: run an archival pass now."""
+    if not is_admin(e.sender_id):
+        return
+    if ARCHIVE_AFTER_DAYS <= 0 or not archives_enabled():
+        return await e.respond("ℹ️ Archival is off (set `ARCHIVE_AFTER_DAYS` and a bucket).", parse_mode="md")
+    if _archive_running:
+        return await e.respond("⏳ An archival pass is already running.")
+    msg = await e.respond(f"🧊 Archiving rows that left more than {ARCHIVE_AFTER_DAYS} day(s) ago...")
+    t0 = time.perf_counter()
+    try:
+        st = await run_archival()
+    except Exception as ex:
+        print("archival error:", ex)
+        return await msg.edit(f"❌ Archival failed: `{ex}`", parse_mode="md")
+    await msg.edit(
+        f"🧊 Archival done in {time.perf_counter() - t0:.1f}s\n"
+        f"owners `{st['owners']}`, links `{st['links']}`, objects `{st['objects']}`, "
+        f"rows `{st['rows']}`, recovered `{st['recovered']}`",
+        parse_mode="md",
+    )
+
+
+# ---------------- WINDOW INDEX + /overview ----------------
+#  Window counts come from trend.WindowIndex (sorted join epochs per
+#  link, two bisects per count) instead of two COUNT queries. Indexes
+#  are built from the joins table on first use and then kept current by
+#  sync_link and track_user_left.
+
+LINK_INDEX_MAX = 512  # links whose window index stays in memory
+OVERVIEW_WINDOWS = ("hour", "today", "yesterday", "week", "month", "year", "all")
+
+link_index: Dict[Tuple[int, int], trend.WindowIndex] = {}  # (uid, link) -> index, least recently used first
+link_index_builds: Dict[Tuple[int, int], "asyncio.Future"] = {}  # (uid, link) -> index build running in a thread
+link_index_stale: Set[Tuple[int, int]] = set()  # rows changed while their index was being built: don't cache it
+
+
+def _cached(cache: Dict, key, cap: int, build):
+    """Get-or-build in a dict used as an LRU (least recently used first)."""
+    val = cache.pop(key, None)
+    if val is None:
+        val = build()
+    cache[key] = val
+    while len(cache) > cap:
+        cache.pop(next(iter(cache)))
+    return val
+
+
+def build_link_index(uid: int, link_id: int) -> trend.WindowIndex:
+    """Window index over every hot joins row of a link (blocking: keyset pages)."""
+    cols = trend_columns.get((uid, link_id))
+    if cols is None:
+        cols = trend.join_columns(
+            sp_iter_joins_for_link(uid, link_id, page_size=EXPORT_PAGE_SIZE, columns="id,joined_at,left_at")
+        )
+    return trend.WindowIndex.from_columns(*cols)
+
+
+def _link_index_built(key: Tuple[int, int], fut: "asyncio.Future"):
+    link_index_builds.pop(key, None)
+    stale = key in link_index_stale
+    link_index_stale.discard(key)
+    if fut.cancelled() or fut.exception() is not None or stale:
+        return
+    _cached(link_index, key, LINK_INDEX_MAX, fut.result)
+
+
+async def get_link_index(uid: int, link_id: int) -> trend.WindowIndex:
+    """
+    Window index over the hot joins rows of a link (archived rows:
+    archived_counts). Built once in a worker thread; concurrent callers
+    share that build.
+    """
+    key = (uid, link_id)
+    idx = link_index.get(key)
+    if idx is not None:
+        return _cached(link_index, key, LINK_INDEX_MAX, lambda: idx)
+    fut = link_index_builds.get(key)
+    if fut is None:
+        fut = link_index_builds[key] = asyncio.ensure_future(asyncio.to_thread(build_link_index, uid, link_id))
+        fut.add_done_callback(lambda f: _link_index_built(key, f))
+    return await asyncio.shield(fut)
+
+
+def drop_link_index(uid: int, link_id: int):
+    """Forget a link's index (its rows changed in a way add_* can't express)."""
+    key = (uid, link_id)
+    link_index.pop(key, None)
+    if key in link_index_builds:
+        link_index_stale.add(key)
+
+
+def index_link_joins(uid: int, link_id: int, joined: Iterable[int] = (), left: Iterable[int] = ()):
+    """Apply new join rows / rows marked left (by joined_at epoch) to a loaded index."""
+    idx = link_index.get((uid, link_id))
+    if idx is not None:
+        idx.add_joins(joined)
+        idx.add_left(left)
+    elif (uid, link_id) in link_index_builds:
+        link_index_stale.add((uid, link_id))  # the build may have read the rows before these changes
+
+
+async def link_window_counts(
+    uid: int,
+    link_id: int,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+) -> Tuple[int, int]:
+    """
+    (joins, left) for rows joined in [since, until] — same filter as
+    sp_count_*_for_link, archives included. Falls back to those count
+    queries when the index can't be built.
+    """
+    try:
+        joins, left = (await get_link_index(uid, link_id)).counts(since, until)
+    except Exception as ex:
+        print(f"link index error for {link_id}:", ex)
+        joins, left = await asyncio.gather(
+            asyncio.to_thread(sp_count_joins_for_link, uid, link_id, since=since, until=until),
+            asyncio.to_thread(sp_count_left_for_link, uid, link_id, since=since, until=until),
+        )
+    if not archives_enabled() or link_archives.get((uid, link_id)) == []:
+        return joins, left  # nothing archived: skip the worker thread
+    a_joins, a_left = await asyncio.to_thread(archived_counts, uid, link_id, since, until)
+    return joins + a_joins, left + a_left
+
+
+@router.command("overview")
+async def overview_cmd(e):
+    uid = e.sender_id
+    if not await is_logged_in(uid):
+        return await e.respond("🔒 Please `/login` first.", parse_mode="md")
+
+    rows = owner_links(uid).rows
+    if not rows:
+        return await e.respond("ℹ️ No active invite links yet. Use /create_link first.", parse_mode="md")
+
+    overview_state[uid] = True
+    await e.respond(
+        "🧮 **Overview** — select invite link:",
+        parse_mode="md",
+        buttons=link_picker_kb("ov", rows, b"ov_cancel"),
+    )
+
+
+@router.callback(b"ov:")
+async def cb_overview_link(event):
+    uid = event.sender_id
+    if not overview_state.pop(uid, None):
+        return await event.answer("Session expired. Run /overview again.", alert=True)
+    try:
+        link_id = int(event.data.decode().split(":")[1])
+    except Exception:
+        return await event.answer("Invalid selection.", alert=True)
+
+    chosen = owner_links(uid).get(link_id)
+    if not chosen:
+        return await event.edit("❌ Link not found.", buttons=None)
+
+    await event.edit("⏳ Syncing join data from Telegram for this link...", buttons=None)
+    await sync_importers_to_db(uid)
+
+    lines = [
+        "🧮 **Overview**",
+        f"`{chosen.get('chat_title') or chosen.get('chat_id')}`",
+        f"🔗 `{chosen.get('invite_link') or '-'}`",
+        "",
+        "`window          joins   left    now`",
+    ]
+    for name in OVERVIEW_WINDOWS:
+        label, since, until = stats_window(name)
+        joins, left = await link_window_counts(uid, link_id, since, until)
+        lines.append(f"`{label:<14}{joins:>7}{left:>7}{joins - left:>7}`")
+    lines.append("")
+    lines.append("_now = still joined. Yesterday is the IST day._")
+    await event.edit("\n".join(lines), parse_mode="md", buttons=None)
+
+
+@router.callback(b"ov_cancel")
+async def cb_overview_cancel(event):
+    overview_state.pop(event.sender_id, None)
+    await event.edit("✖ Overview cancelled.", buttons=None)
+
+
+# ---------------- EXPORT (CSV / NDJSON) ----------------
+
+EXPORT_FIELDS = ("id", "chat_id", "joined_user_id", "joined_at", "left_at", "left_reason")
+
+
+def stats_window(name: str) -> Optional[Tuple[str, Optional[datetime], Optional[datetime]]]:
+    """Map a window name (all/hour/today/yesterday/week/month/year) to (label, since, until)."""
+    now = datetime.now(timezone.utc)
+    if name in ("all", ""):
+        return "All time", None, None
+    if name == "hour":
+        return "Last 1 hour", now - timedelta(hours=1), None
+    if name == "today":
+        return "Today", now.replace(hour=0, minute=0, second=0, microsecond=0), None
+    if name == "yesterday":
+        IST = timezone(timedelta(hours=5, minutes=30))
+        y_start_ist = (datetime.now(IST) - timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
+        y_end_ist = y_start_ist + timedelta(days=1)
+        return "Yesterday", y_start_ist.astimezone(timezone.utc), y_end_ist.astimezone(timezone.utc)
+    if name == "week":
+        return "Last 7 days", now - timedelta(days=7), None
+    if name == "month":
+        return "Last 30 days", now - timedelta(days=30), None
+    if name == "year":
+        return "Last 365 days", now - timedelta(days=365), None
+    return None
+
+
+def write_joins_export(rows: Iterable[dict], fmt: str, path: str) -> int:
+    """
+    Encode rows incrementally into a gzip'd CSV / NDJSON file.
+    Rows are consumed one by one, so memory stays flat no matter how many there are.
+    """
+    n = 0
+    with gzip.open(path, "wt", encoding="utf-8", newline="") as fh:
+        if fmt == "csv":
+            w = csv.writer(fh)
+            w.writerow(EXPORT_FIELDS)
+            for r in rows:
+                w.writerow(["" if r.get(k) is None else r.get(k) for k in EXPORT_FIELDS])
+                n += 1
+        else:
+            for r in rows:
+                fh.write(json.dumps({k: r.get(k) for k in EXPORT_FIELDS}, separators=(",", ":")))
+                fh.write("\n")
+                n += 1
+    return n
+
+
+@db_op
+def sp_upload_export(path: str, object_name: str) -> str:
+    """Upload an export file to SUPABASE_BUCKET and return a 7-day signed URL."""
+    return store.upload_file(path, object_name, "application/gzip")
+
+
+@router.command("export", args=r"(?:\s+(\w+))?(?:\s+(\w+))?")
+async def export_cmd(e):
+    """/export [all|hour|today|yesterday|week|month|year] [csv|ndjson]"""
+    uid = e.sender_id
+    if not await is_logged_in(uid):
+        return await e.respond("🔒 Please `/login` first.", parse_mode="md")
+
+    window = (e.pattern_match.group(1) or "all").lower()
+    fmt = (e.pattern_match.group(2) or "csv").lower()
+    if window in ("csv", "ndjson"):
+        window, fmt = "all", window
+    win = stats_window(window)
+    if not win or fmt not in ("csv", "ndjson"):
+        return await e.respond(
+            "⚠️ Usage: `/export [all|hour|today|yesterday|week|month|year] [csv|ndjson]`",
+            parse_mode="md",
+        )
+
+    rows = owner_links(uid).rows
+    if not rows:
+        return await e.respond("ℹ️ No active invite links yet. Use /create_link first.", parse_mode="md")
+
+    label, since, until = win
+    export_state[uid] = {"label": label, "since": since, "until": until, "fmt": fmt}
+
+    btn_rows = link_picker_kb("export", rows, b"export_cancel")
+
+    await e.respond(
+        f"📤 **Export {label} joins ({fmt.upper()})** — select invite link:",
+        parse_mode="md",
+        buttons=btn_rows,
+    )
+
+
+@router.callback(b"export:")
+async def cb_export_link(event):
+    uid = event.sender_id
+    st = export_state.pop(uid, None)
+    if not st:
+        return await event.answer("Session expired. Run /export again.", alert=True)
+    try:
+        link_id = int(event.data.decode().split(":")[1])
+    except Exception:
+        return await event.answer("Invalid selection.", alert=True)
+
+    await event.edit("⏳ Syncing and exporting join data...\nLarge links can take a while.", buttons=None)
+    await sync_importers_to_db(uid)
+
+    fmt = st["fmt"]
+    stamp = datetime.now(timezone.utc).strftime("%Y%m%d_%H%M%S")
+    name = f"joins_{link_id}_{stamp}.{fmt}.gz"
+    fd, path = tempfile.mkstemp(prefix=f"export_{uid}_", suffix=f".{fmt}.gz", dir=SESSION_DIR)
+    os.close(fd)
+    try:
+        rows = itertools.chain(
+            archived_rows(uid, link_id, since=st["since"], until=st["until"]),
+            sp_iter_joins_for_link(
+                uid, link_id, since=st["since"], until=st["until"],
+                page_size=EXPORT_PAGE_SIZE, columns=",".join(EXPORT_FIELDS),
+            ),
+        )
+        # paging + gzip encoding run in a worker thread, the event loop stays free
+        n = await asyncio.to_thread(write_joins_export, rows, fmt, path)
+        size = os.path.getsize(path)
+        caption = f"📤 {st['label']} joins — {n} row(s), {fmt.upper()} (gzip)"
+
+        if size <= EXPORT_DOC_MAX_BYTES:
+            await bot.send_file(
+                uid, path, caption=caption, force_document=True,
+                attributes=[types.DocumentAttributeFilename(name)],
+            )
+            return await event.edit(f"✅ Export ready: {n} row(s).", buttons=None)
+
+        if not SUPABASE_BUCKET or STORAGE_BACKEND != "supabase":
+            return await event.edit(
+                f"❌ Export is {size // (1024 * 1024)} MB, too big for Telegram and no `SUPABASE_BUCKET` is available.",
+                buttons=None,
+            )
+        url = await asyncio.to_thread(sp_upload_export, path, f"exports/{uid}/{name}")
+        await event.edit(f"{caption}\n\n🔗 Download (valid 7 days):\n{url}", buttons=None)
+    except Exception as ex:
+        print("export error:", ex)
+        await event.edit(f"❌ Export failed: `{ex}`", buttons=None)
+    finally:
+        try:
+            os.remove(path)
+        except Exception:
+            pass
+
+
+@router.callback(b"export_cancel")
+async def cb_export_cancel(event):
+    export_state.pop(event.sender_id, None)
+    await event.edit("✖ Export cancelled.", buttons=None)
+
+
+# ---------------- TREND (JOINS / LEAVES OVER TIME) ----------------
+
+TREND_CACHE_MAX = 256  # rendered charts kept in memory
+TREND_COLUMNS_MAX = 64  # links whose joined/left epoch columns stay in memory
+TREND_RENDER_SLOTS = asyncio.Semaphore(2)  # concurrent chart worker processes
+
+trend_columns: Dict[Tuple[int, int], Tuple[array, array]] = {}  # (uid, link) -> joined/left epochs, LRU
+trend_cache: Dict[Tuple[int, int, str, int], bytes] = {}  # (uid, link, gran, first bucket) -> PNG
+
+
+def invalidate_trend(uid: int, link_id: int):
+    """Drop cached columns + charts of a link (its joins changed)."""
+    trend_columns.pop((uid, link_id), None)
+    for k in [k for k in trend_cache if k[0] == uid and k[1] == link_id]:
+        trend_cache.pop(k, None)
+
+
+async def render_trend_png(title: str, gran: str, starts: List[int], joins: List[int], leaves: List[int]) -> bytes:
+    """Render in a `python trend.py` worker process (matplotlib never loads into the bot)."""
+    payload = json.dumps({"title": title, "gran": gran, "starts": starts, "joins": joins, "leaves": leaves})
+    async with TREND_RENDER_SLOTS:
+        proc = await asyncio.create_subprocess_exec(
+            sys.executable, trend.__file__,
+            stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE,
+        )
+        out, err = await proc.communicate(payload.encode())
+    if proc.returncode != 0 or not out:
+        raise RuntimeError(err.decode(errors="replace").strip()[-300:] or f"renderer exited {proc.returncode}")
+    return out
+
+
+def read_trend_columns(uid: int, link_id: int) -> Tuple[array, array]:
+    """joined/left epoch columns of every hot row of a link (blocking: keyset pages)."""
+    rows = sp_iter_joins_for_link(uid, link_id, page_size=EXPORT_PAGE_SIZE, columns="id,joined_at,left_at")
+    return trend.join_columns(rows)
+
+
+async def load_trend_columns(uid: int, link_id: int) -> Tuple[array, array]:
+    cols = trend_columns.get((uid, link_id))
+    if cols is None:
+        cols = await asyncio.to_thread(read_trend_columns, uid, link_id)
+    return _cached(trend_columns, (uid, link_id), TREND_COLUMNS_MAX, lambda: cols)
+
+
+@router.command("trend", args=r"(?:\s+(\w+))?")
+async def trend_cmd(e):
+    """/trend [hour|day|week] — joins and leaves per bucket for one link."""
+    uid = e.sender_id
+    if not await is_logged_in(uid):
+        return await e.respond("🔒 Please `/login` first.", parse_mode="md")
+
+    gran = (e.pattern_match.group(1) or "day").lower()
+    if gran not in trend.GRANULARITIES:
+        return await e.respond("⚠️ Usage: `/trend [hour|day|week]`", parse_mode="md")
+
+    rows = owner_links(uid).rows
+    if not rows:
+        return await e.respond("ℹ️ No active invite links yet. Use /create_link first.", parse_mode="md")
+
+    trend_state[uid] = gran
+    await e.respond(
+        f"📈 **Trend per {gran}** — select invite link:",
+        parse_mode="md",
+        buttons=link_picker_kb("trend", rows, b"trend_cancel"),
+    )
+
+
+@router.callback(b"trend:")
+async def cb_trend_link(event):
+    uid = event.sender_id
+    gran = trend_state.pop(uid, None)
+    if not gran:
+        return await event.answer("Session expired. Run /trend again.", alert=True)
+    try:
+        link_id = int(event.data.decode().split(":")[1])
+    except Exception:
+        return await event.answer("Invalid selection.", alert=True)
+
+    chosen = owner_links(uid).get(link_id)
+    if not chosen:
+        return await event.edit("❌ Link not found.", buttons=None)
+    title = chosen.get("chat_title") or f"id:{chosen.get('chat_id')}"
+
+    await event.edit("⏳ Syncing and building trend...", buttons=None)
+    await sync_importers_to_db(uid)
+
+    try:
+        joined, left = await load_trend_columns(uid, link_id)
+        starts, joins, leaves = trend.series(joined, left, gran)
+        if gran != "hour":  # archived rows left >= ARCHIVE_AFTER_DAYS (>= 2) ago: outside the 48h hour view
+            for m in await asyncio.to_thread(link_archive_manifests, uid, link_id):
+                archive.add_rollups(starts, joins, leaves, gran, archive.daily_of(m))
+        _, n = trend.GRANULARITIES[gran]
+        caption = (
+            f"📈 {title}\nPer {gran} (IST), last {n} {gran}s: "
+            f"+{sum(joins)} joined / -{sum(leaves)} left"
+        )
+
+        if not trend.have_matplotlib():
+            chart = trend.text_chart(starts, joins, leaves, gran)
+            return await event.edit(f"{caption}\n\n```\n{chart}\n```", parse_mode="md", buttons=None)
+
+        key = (uid, link_id, gran, starts[0])
+        png = trend_cache.get(key)
+        if png is None:
+            png = await render_trend_png(_safe_ascii(title) or f"link {link_id}", gran, starts, joins, leaves)
+            trend_cache[key] = png
+            while len(trend_cache) > TREND_CACHE_MAX:
+                trend_cache.pop(next(iter(trend_cache)))
+
+        await bot.send_file(
+            uid, png, caption=caption,
+            attributes=[types.DocumentAttributeFilename(f"trend_{link_id}_{gran}.png")],
+        )
+        await event.edit("✅ Trend ready.", buttons=None)
+    except Exception as ex:
+        print("trend error:", ex)
+        await event.edit(f"❌ Trend failed: `{ex}`", parse_mode="md", buttons=None)
+
+
+@router.callback(b"trend_cancel")
+async def cb_trend_cancel(event):
+    trend_state.pop(event.sender_id, None)
+    await event.edit("✖ Trend cancelled.", buttons=None)
+
+
 # ---------------- UPGRADE & PLAN CALLBACKS ----------------
 
 # ---------------- UPGRADE & PLAN CALLBACKS ----------------
@@ -1886,59 +3747,287 @@ async def stats_year_cmd(e):
 # ---------------------------------------------------------
 
 
+# ---------------- ADMIN: METRICS ----------------
+
+def is_admin(uid: int) -> bool:
+    return uid in ADMIN_UIDS
+
+
+def _top_calls(counter, hist, label: str, n: int = 8) -> List[str]:
+    per: Dict[str, List[float]] = {}
+    for key, v in list(counter.values.items()):
+        d = dict(key)
+        c = per.setdefault(d.get(label, "?"), [0.0, 0.0])
+        c[0] += v
+        if d.get("status") != "ok":
+            c[1] += v
+    out = []
+    for op, (cnt, err) in sorted(per.items(), key=lambda kv: -kv[1][0])[:n]:
+        hk = ((label, op),)
+        avg = hist.sums.get(hk, 0.0) / cnt if cnt else 0.0
+        p95 = hist.quantile(0.95, hk)
+        line = f"• `{op}` {cnt:g}× avg {avg * 1000:.0f}ms p95≤{p95 * 1000:.0f}ms"
+        if err:
+            line += f" ❗{err:g}"
+        out.append(line)
+    return out or ["• -"]
+
+
+def metrics_summary() -> str:
+    lines = ["📈 **Bot metrics**", "", "🗄️ **DB calls**"]
+    lines += _top_calls(DB_CALLS, DB_SECONDS, "op")
+    lines += ["", "📡 **MTProto requests**"]
+    lines += _top_calls(MT_CALLS, MT_SECONDS, "request")
+
+    floods = sum(FLOOD_WAITS.values.values())
+    flood_s = sum(FLOOD_WAIT_SECONDS.values.values())
+    lines += ["", f"🌊 FloodWaits: `{floods:g}` ({flood_s:g}s total)"]
+
+    n_sync = SYNC_SECONDS.count()
+    if n_sync:
+        avg = SYNC_SECONDS.sums.get((), 0.0) / n_sync
+        lines.append(
+            f"🔄 Link syncs: `{n_sync}` avg `{avg:.2f}s` p95≤`{SYNC_SECONDS.quantile(0.95, ()):g}s`"
+        )
+
+    q = sync_scheduler.stats()
+    lines.append(
+        "🚦 Sync queue: " + ", ".join(f"{lane} `{st['waiting']}` waiting / `{st['running']}` running" for lane, st in q.items())
+    )
+    ob = outbox.stats()
+    lines.append(f"📮 Outbox: `{ob['pending']}` pending (oldest `{ob['oldest_age']:.0f}s`), `{ob['dead']}` dead")
+    if reap_progress:
+        lines.append("🧹 Reaper: " + ", ".join(f"link `{k}` `{v}` rows" for k, v in reap_progress.items()))
+
+    lines += ["", f"👤 USER_CLIENT_CACHE: `{len(USER_CLIENT_CACHE)}`"]
+    lines.append("🧠 State: " + ", ".join(f"{k}=`{len(v)}`" for k, v in STATE_DICTS.items()))
+    if METRICS_PORT:
+        lines.append(f"\n_Prometheus: http://{METRICS_HOST}:{METRICS_PORT}/metrics_")
+    return "\n".join(lines)
+
+
+@router.command("metrics")
+async def metrics_cmd(e):
+    if not is_admin(e.sender_id):
+        return
+    await e.respond(metrics_summary(), parse_mode="md")
+
+
+# ---------------- ADMIN: PROFILER ----------------
+
+_profile_running = False
+
+
+@router.command("profile", args=r"(?:\s+(\d+))?")
+async def profile_cmd(e):
+    """/profile [seconds] — sample all threads + asyncio tasks, reply with a folded-stacks file."""
+    global _profile_running
+    if not is_admin(e.sender_id):
+        return
+    if _profile_running:
+        return await e.respond("⏳ A profile is already running.")
+    seconds = min(int(e.pattern_match.group(1) or 30), PROFILE_MAX_SECONDS)
+    if seconds <= 0:
+        return await e.respond("⚠️ Usage: `/profile [seconds]`", parse_mode="md")
+
+    _profile_running = True
+    path = None
+    try:
+        await e.respond(f"🔬 Profiling for {seconds}s…")
+        prof = SamplingProfiler(asyncio.get_running_loop())
+        folded = await prof.run(seconds)
+        stamp = datetime.now(timezone.utc).strftime("%Y%m%d_%H%M%S")
+        fd, path = tempfile.mkstemp(prefix="profile_", suffix=".folded", dir=SESSION_DIR)
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(folded)
+        await bot.send_file(
+            e.sender_id, path, force_document=True,
+            caption=(
+                f"🔥 {seconds}s profile, {prof.samples} thread samples, {len(prof.stacks)} stacks.\n"
+                "Open with speedscope.app or `flamegraph.pl`."
+            ),
+            attributes=[types.DocumentAttributeFilename(f"profile_{stamp}.folded")],
+        )
+    except Exception as ex:
+        print("profile error:", ex)
+        await e.respond(f"❌ Profile failed: `{ex}`", parse_mode="md")
+    finally:
+        _profile_running = False
+        if path:
+            try:
+                os.remove(path)
+            except Exception:
+                pass
+
+
+@router.command("tasks")
+async def tasks_cmd(e):
+    """Dump pending asyncio tasks and the line each one is awaiting on."""
+    if not is_admin(e.sender_id):
+        return
+    dump = format_tasks(asyncio.get_running_loop())
+    if len(dump) < 3500:
+        return await e.respond(f"```\n{dump}\n```", parse_mode="md")
+    stamp = datetime.now(timezone.utc).strftime("%Y%m%d_%H%M%S")
+    await bot.send_file(
+        e.sender_id, dump.encode("utf-8"), force_document=True,
+        caption=dump.split("\n", 1)[0],
+        attributes=[types.DocumentAttributeFilename(f"tasks_{stamp}.txt")],
+    )
+
+
 # ---------------- BOT PROFILE (DESCRIPTION + COMMANDS) ----------------
 
-async def setup_bot_profile():
-    """Set bot description + commands list."""
+BOT_INFO = {
+    "name": "Join Counter Bot",
+    "about": "Track private invite-link joins for your groups/channels.",
+    "description": (
+        "Log in with your own account, create unique private invite links for your "
+        "groups/channels, and track how many users joined via each link."
+    ),
+}
+
+BOT_COMMANDS = [
+    ("start", "Show help & all commands"),
+    ("help", "Short usage guide"),
+    ("start_demo", "Try limited demo mode"),
+    ("login", "Login your Telegram account"),
+    ("status", "Check login status"),
+    ("logout", "Delete session & stop tracking"),
+    ("create_link", "Create invite links for pinned chats"),
+    ("links", "List your invite links"),
+    ("remove_link", "Remove links & join data (with confirmation)"),
+    ("stats", "Select link & show total joins"),
+    ("hour_status", "Select link & joins last 1 hour"),
+    ("today_status", "Select link & joins today"),
+    ("week_status", "Select link & joins last 7 days"),
+    ("month_status", "Select link & joins last 30 days"),
+    ("year_status", "Select link & joins last 365 days"),
+    ("export", "Export join data as CSV / NDJSON"),
+    ("requests", "Approve / decline pending join requests"),
+    ("overview", "All windows for one link at once"),
+    ("trend", "Joins & leaves per hour / day / week (chart)"),
+]
+
+
+def bot_profile_hash() -> str:
+    blob = json.dumps({"info": BOT_INFO, "commands": BOT_COMMANDS}, sort_keys=True)
+    return hashlib.sha256(blob.encode()).hexdigest()
+
+
+async def setup_bot_profile(force: bool = False) -> str:
+    """
+    Set bot description + commands list (skipped when unchanged since the
+    last boot). Returns "set", "unchanged" or "error".
+    """
+    digest = bot_profile_hash()
+    if not force:
+        try:
+            with open(BOT_PROFILE_HASH_FILE) as f:
+                if f.read().strip() == digest:
+                    return "unchanged"
+        except OSError:
+            pass
     try:
         me = await bot.get_me()
-        await bot(
-            functions.bots.SetBotInfoRequest(
-                bot=me,
-                lang_code="en",
-                name="Join Counter Bot",
-                about="Track private invite-link joins for your groups/channels.",
-                description=(
-                    "Log in with your own account, create unique private invite links for your "
-                    "groups/channels, and track how many users joined via each link."
-                ),
-            )
-        )
-        cmds = [
-            ("start", "Show help & all commands"),
-            ("help", "Short usage guide"),
-            ("start_demo", "Try limited demo mode"),
-            ("login", "Login your Telegram account"),
-            ("status", "Check login status"),
-            ("logout", "Delete session & stop tracking"),
-            ("create_link", "Create invite links for pinned chats"),
-            ("links", "List your invite links"),
-            ("remove_link", "Remove links & join data (with confirmation)"),
-            ("stats", "Select link & show total joins"),
-            ("hour_status", "Select link & joins last 1 hour"),
-            ("today_status", "Select link & joins today"),
-            ("week_status", "Select link & joins last 7 days"),
-            ("month_status", "Select link & joins last 30 days"),
-            ("year_status", "Select link & joins last 365 days"),
-            
-        ]
+        await bot(functions.bots.SetBotInfoRequest(bot=me, lang_code="en", **BOT_INFO))
         await bot(
             functions.bots.SetBotCommandsRequest(
                 scope=types.BotCommandScopeDefault(),
                 lang_code="en",
-                commands=[types.BotCommand(c, d) for c, d in cmds],
+                commands=[types.BotCommand(c, d) for c, d in BOT_COMMANDS],
             )
         )
+        with open(BOT_PROFILE_HASH_FILE, "w") as f:
+            f.write(digest)
+        return "set"
     except Exception as e:
         print("Profile/commands set error:", e)
+        return "error"
+
+
+# ---------------- STARTUP ----------------
+
+background_tasks: Set[asyncio.Task] = set()  # asyncio only keeps weak references to running tasks
+
+
+def spawn(coro, name: str) -> asyncio.Task:
+    """Start a background task and keep it referenced until it finishes."""
+    task = asyncio.get_running_loop().create_task(coro, name=name)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
+
+async def warm_user_clients(limit: int = WARMUP_MAX_CLIENTS, concurrency: int = WARMUP_CONCURRENCY):
+    """Pre-connect the user clients of the most recently logged-in owners."""
+    t0 = time.perf_counter()
+    try:
+        sessions = await asyncio.to_thread(store.recent_sessions, limit)
+    except Exception as e:
+        print("warm-up: session list error:", e)
+        return
+    sem = asyncio.Semaphore(max(1, concurrency))
+    ok = 0
+
+    async def one(sess: dict):
+        nonlocal ok
+        async with sem:
+            try:
+                await get_user_client(int(sess["user_id"]), sess)
+                ok += 1
+            except Exception as e:
+                print(f"warm-up {sess.get('user_id')}: {e}")
+
+    await asyncio.gather(*(one(s) for s in sessions))
+    took = time.perf_counter() - t0
+    STARTUP_SECONDS.set(took, phase="warmup")
+    print(f"🔥 warm-up: {ok}/{len(sessions)} user clients connected in {took:.2f}s")
+
+
+async def startup() -> Dict[str, float]:
+    """Boot phases: bot login → metrics → bot profile; user-client warm-up runs in the background."""
+    timings: Dict[str, float] = {}
+
+    async def phase(name: str, coro):
+        t0 = time.perf_counter()
+        try:
+            return await coro
+        finally:
+            timings[name] = time.perf_counter() - t0
+            STARTUP_SECONDS.set(timings[name], phase=name)
+
+    await phase("bot_login", bot.start(bot_token=BOT_TOKEN))
+    if METRICS_PORT:
+        await phase("metrics_server", start_http_server(METRICS_HOST, METRICS_PORT))
+        print(f"📈 Metrics on http://{METRICS_HOST}:{METRICS_PORT}/metrics")
+    profile = await phase("bot_profile", setup_bot_profile())
+    if WARMUP_MAX_CLIENTS > 0:
+        spawn(warm_user_clients(), "warm_user_clients")
+    if ARCHIVE_AFTER_DAYS > 0 and archives_enabled():
+        spawn(archive_loop(), "archive_loop")
+    if LINK_RECONCILE_INTERVAL > 0:
+        spawn(reconcile_loop(), "reconcile_loop")
+    spawn(outbox_loop(), "outbox_loop")
+    spawn(reaper_loop(), "reaper_loop")
+
+    total = sum(timings.values())
+    STARTUP_SECONDS.set(total, phase="total")
+    print(
+        f"⏱️ startup {total:.2f}s — "
+        + ", ".join(f"{k} {v:.2f}s" for k, v in timings.items())
+        + {"set": "", "unchanged": " (profile unchanged, skipped)", "error": " (profile update failed)"}[profile]
+    )
+    return timings
+
 
 # ---------------- RUN ----------------
 
 if __name__ == "__main__":
-    print("🤖 Join Counter Bot ready!")
+    check_config()
     loop = asyncio.get_event_loop()
-    try:
-        loop.run_until_complete(setup_bot_profile())
-    except Exception as e:
-        print("setup_bot_profile error:", e)
+    watchdog = LoopWatchdog(threshold=LOOP_LAG_THRESHOLD)
+    watchdog.start(loop)
+    loop.run_until_complete(startup())
+    print("🤖 Join Counter Bot ready!")
     bot.run_until_disconnected()
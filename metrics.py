@@ -0,0 +1,226 @@
+import asyncio
+import bisect
+import threading
+import time
+from functools import wraps
+from typing import Callable, Dict, List, Tuple, Any, Optional
+
+# ---------------- METRICS REGISTRY ----------------
+#  Tiny in-process registry (counters, gauges, histograms with labels)
+#  rendered in Prometheus text format. No external deps.
+# ---------------------------------------------------
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+def _key(labels: Dict[str, Any]) -> LabelKey:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _esc(v: str) -> str:
+    return v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _fmt_labels(key: LabelKey, extra: Optional[Tuple[str, str]] = None) -> str:
+    items = list(key) + ([extra] if extra else [])
+    if not items:
+        return ""
+    return "{" + ",".join(f'{k}="{_esc(v)}"' for k, v in items) + "}"
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, doc: str):
+        self.name = name
+        self.doc = doc
+        self.lock = threading.Lock()  # sp_* calls also run in worker threads
+
+    def render(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, doc: str):
+        super().__init__(name, doc)
+        self.values: Dict[LabelKey, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels):
+        k = _key(labels)
+        with self.lock:
+            self.values[k] = self.values.get(k, 0.0) + amount
+
+    def get(self, **labels) -> float:
+        return self.values.get(_key(labels), 0.0)
+
+    def render(self) -> List[str]:
+        return [f"{self.name}{_fmt_labels(k)} {v:g}" for k, v in sorted(self.values.items())]
+
+
+class Gauge(Metric):
+    """Set directly, or backed by a callback evaluated at scrape time."""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, doc: str, fn: Optional[Callable[[], Dict[LabelKey, float]]] = None):
+        super().__init__(name, doc)
+        self.values: Dict[LabelKey, float] = {}
+        self.fn = fn
+
+    def set(self, value: float, **labels):
+        with self.lock:
+            self.values[_key(labels)] = value
+
+    def snapshot(self) -> Dict[LabelKey, float]:
+        if self.fn:
+            try:
+                return self.fn()
+            except Exception:
+                return {}
+        return dict(self.values)
+
+    def render(self) -> List[str]:
+        return [f"{self.name}{_fmt_labels(k)} {v:g}" for k, v in sorted(self.snapshot().items())]
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, doc: str, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, doc)
+        self.buckets = tuple(sorted(buckets))
+        # label key -> [bucket counts..., +Inf count], sum
+        self.counts: Dict[LabelKey, List[int]] = {}
+        self.sums: Dict[LabelKey, float] = {}
+
+    def observe(self, value: float, **labels):
+        k = _key(labels)
+        i = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            c = self.counts.get(k)
+            if c is None:
+                c = self.counts[k] = [0] * (len(self.buckets) + 1)
+                self.sums[k] = 0.0
+            c[i] += 1
+            self.sums[k] += value
+
+    def count(self, **labels) -> int:
+        return sum(self.counts.get(_key(labels), ()))
+
+    def quantile(self, q: float, key: LabelKey) -> float:
+        """Bucket upper bound holding the q-quantile (good enough for summaries)."""
+        c = self.counts.get(key)
+        if not c:
+            return 0.0
+        target = q * sum(c)
+        run = 0
+        for i, n in enumerate(c):
+            run += n
+            if run >= target:
+                return self.buckets[i] if i < len(self.buckets) else float("inf")
+        return float("inf")
+
+    def render(self) -> List[str]:
+        out = []
+        for k in sorted(self.counts):
+            c = self.counts[k]
+            run = 0
+            for bound, n in zip(self.buckets, c):
+                run += n
+                out.append(f"{self.name}_bucket{_fmt_labels(k, ('le', f'{bound:g}'))} {run}")
+            run += c[-1]
+            out.append(f"{self.name}_bucket{_fmt_labels(k, ('le', '+Inf'))} {run}")
+            out.append(f"{self.name}_sum{_fmt_labels(k)} {self.sums[k]:g}")
+            out.append(f"{self.name}_count{_fmt_labels(k)} {run}")
+        return out
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: Dict[str, Metric] = {}
+
+    def _add(self, m: Metric) -> Any:
+        existing = self.metrics.get(m.name)
+        if existing is not None:
+            return existing
+        self.metrics[m.name] = m
+        return m
+
+    def counter(self, name: str, doc: str) -> Counter:
+        return self._add(Counter(name, doc))
+
+    def gauge(self, name: str, doc: str, fn=None) -> Gauge:
+        return self._add(Gauge(name, doc, fn))
+
+    def histogram(self, name: str, doc: str, buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        return self._add(Histogram(name, doc, buckets))
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for m in self.metrics.values():
+            lines.append(f"# HELP {m.name} {m.doc}")
+            lines.append(f"# TYPE {m.name} {m.kind}")
+            lines.extend(m.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+def timed_call(counter: Counter, hist: Histogram, label: str, op: str):
+    """Decorator: count calls (status=ok/error) and observe latency, labelled {label: op}."""
+
+    def deco(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            t0 = time.perf_counter()
+            status = "ok"
+            try:
+                return fn(*args, **kwargs)
+            except BaseException:
+                status = "error"
+                raise
+            finally:
+                hist.observe(time.perf_counter() - t0, **{label: op})
+                counter.inc(**{label: op, "status": status})
+
+        return wrapper
+
+    return deco
+
+
+# ---------------- HTTP EXPOSITION ----------------
+
+async def _handle_http(reader: asyncio.StreamReader, writer: asyncio.StreamWriter, registry: Registry):
+    try:
+        request_line = await asyncio.wait_for(reader.readline(), timeout=5)
+        while True:  # drain headers
+            line = await asyncio.wait_for(reader.readline(), timeout=5)
+            if not line or line in (b"\r\n", b"\n"):
+                break
+        parts = request_line.decode("latin-1").split()
+        path = parts[1] if len(parts) > 1 else "/"
+        if path.split("?")[0] in ("/metrics", "/"):
+            body = registry.render().encode()
+            head = "HTTP/1.1 200 OK\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+        else:
+            body = b"not found\n"
+            head = "HTTP/1.1 404 Not Found\r\nContent-Type: text/plain\r\n"
+        writer.write(f"{head}Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body)
+        await writer.drain()
+    except Exception:
+        pass
+    finally:
+        try:
+            writer.close()
+        except Exception:
+            pass
+
+
+async def start_http_server(host: str, port: int, registry: Registry = REGISTRY) -> asyncio.AbstractServer:
+    """Serve GET /metrics on host:port (Prometheus text format)."""
+    return await asyncio.start_server(lambda r, w: _handle_http(r, w, registry), host, port)
@@ -0,0 +1,246 @@
+"""
+Versioned schema for the Supabase (Postgres) backend.
+
+    python migrate.py              # apply pending migrations/NNNN_*.sql in order
+    python migrate.py --status     # applied / pending migrations
+    python migrate.py --dry-run    # print what would run
+    python migrate.py --explain    # EXPLAIN the hot queries, fail on a Seq Scan
+
+Connects with DATABASE_URL (Supabase: Project settings -> Database ->
+connection string) or --dsn. Needs psycopg (3) or psycopg2; the bot
+itself only talks PostgREST and does not.
+"""
+import argparse
+import hashlib
+import json
+import os
+import re
+import sys
+from typing import Any, Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+try:  # psycopg 3, else psycopg2; only this script needs a Postgres driver
+    import psycopg as pg
+except ImportError:  # pragma: no cover
+    try:
+        import psycopg2 as pg
+    except ImportError:
+        pg = None
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "migrations")
+MIGRATION_RE = re.compile(r"^(\d{4})_([a-z0-9_]+)\.sql$")
+LOCK_ID = 0x6A6F696E  # pg_advisory_lock key: one runner at a time
+
+SCHEMA_TABLE = """
+create table if not exists schema_migrations (
+    version    integer primary key,
+    name       text not null,
+    checksum   text not null,
+    applied_at timestamptz not null default now()
+)
+"""
+
+
+class Migration(NamedTuple):
+    version: int
+    name: str
+    sql: str
+    checksum: str
+
+
+def load_migrations(path: str = MIGRATIONS_DIR) -> List[Migration]:
+    """migrations/NNNN_name.sql files, by version (duplicate versions are an error)."""
+    out: Dict[int, Migration] = {}
+    for fn in sorted(os.listdir(path)):
+        m = MIGRATION_RE.match(fn)
+        if not m:
+            continue
+        version = int(m.group(1))
+        if version in out:
+            raise ValueError(f"duplicate migration version {version:04d}: {fn}")
+        with open(os.path.join(path, fn), "r", encoding="utf-8") as f:
+            sql = f.read()
+        out[version] = Migration(version, m.group(2), sql, hashlib.sha256(sql.encode()).hexdigest())
+    return [out[v] for v in sorted(out)]
+
+
+def connect(dsn: str):
+    if pg is None:
+        raise RuntimeError("migrate.py needs psycopg or psycopg2 (pip install psycopg[binary])")
+    conn = pg.connect(dsn)
+    conn.autocommit = True  # each migration runs in its own explicit transaction
+    return conn
+
+
+def applied_versions(conn) -> Dict[int, Tuple[str, str]]:
+    """version -> (name, checksum) of the migrations already applied."""
+    with conn.cursor() as cur:
+        cur.execute(SCHEMA_TABLE)
+        cur.execute("select version, name, checksum from schema_migrations")
+        return {v: (n, c) for v, n, c in cur.fetchall()}
+
+
+def plan(migrations: List[Migration], applied: Dict[int, Tuple[str, str]]) -> List[Migration]:
+    """Pending migrations; an applied file that was edited since is an error."""
+    changed = [m for m in migrations if m.version in applied and applied[m.version][1] != m.checksum]
+    if changed:
+        names = ", ".join(f"{m.version:04d}_{m.name}" for m in changed)
+        raise RuntimeError(f"applied migrations were edited: {names} (add a new migration instead)")
+    return [m for m in migrations if m.version not in applied]
+
+
+def apply(conn, migrations: List[Migration]) -> List[Migration]:
+    """Apply pending migrations in order, each atomically with its schema_migrations row."""
+    with conn.cursor() as cur:
+        cur.execute("select pg_advisory_lock(%s)", (LOCK_ID,))
+        try:
+            pending = plan(migrations, applied_versions(conn))
+            for m in pending:
+                cur.execute("begin")
+                try:
+                    cur.execute(m.sql)
+                    cur.execute(
+                        "insert into schema_migrations (version, name, checksum) values (%s, %s, %s)",
+                        (m.version, m.name, m.checksum),
+                    )
+                    cur.execute("commit")
+                except Exception:
+                    cur.execute("rollback")
+                    raise
+                print(f"applied {m.version:04d}_{m.name}")
+            return pending
+        finally:
+            cur.execute("select pg_advisory_unlock(%s)", (LOCK_ID,))
+
+
+# ---------------- QUERY PLAN CHECK ----------------
+#  The Postgres form of what PostgREST sends for the bot's hot queries
+#  (storage.SupabaseStorage). Planned with enable_seqscan = off: if the
+#  plan still has a Seq Scan, no index can serve the query at any size.
+# ---------------------------------------------------
+
+HOT_QUERIES: List[Tuple[str, str]] = [
+    ("list_invite_links",
+     "select * from invite_links where user_id = 1 and is_active = true order by created_at desc"),
+    ("chat_links",
+     "select * from invite_links where chat_id = -1001 and is_active = true"),
+    ("recent_sessions",
+     "select user_id, session_file from user_sessions where is_active = true order by created_at desc limit 100"),
+    ("session_owners",
+     "select user_id, session_file from user_sessions where is_active = true and user_id > 0 "
+     "order by user_id limit 1000"),
+    ("fetch_joins",
+     "select * from joins where user_id = 1 and invite_link_id = 1 and joined_at >= '2024-01-01' "
+     "order by joined_at desc, id desc limit 20"),
+    ("count_joins",
+     "select count(*) from joins where user_id = 1 and invite_link_id = 1 "
+     "and joined_at >= '2024-01-01' and joined_at <= '2024-02-01'"),
+    ("count_left",
+     "select count(*) from joins where user_id = 1 and invite_link_id = 1 and left_at is not null "
+     "and joined_at >= '2024-01-01' and joined_at <= '2024-02-01'"),
+    ("latest_join",
+     "select id, invite_link_id, joined_at, left_at from joins where user_id = 1 and chat_id = -1001 "
+     "and joined_user_id = 7 order by joined_at desc limit 1"),
+    ("latest_joins",
+     "select id, invite_link_id, joined_user_id, joined_at, left_at from joins where user_id = 1 "
+     "and chat_id = -1001 and joined_user_id in (7, 8) order by joined_user_id, joined_at desc limit 1000"),
+    ("mark_left_rows",
+     "update joins set left_at = now(), left_reason = 'left', left_seen_at = now() where id in (7, 8) "
+     "and left_at is null"),
+    ("mark_left_members",
+     "update joins set left_at = now(), left_reason = 'left', left_seen_at = now() where user_id = 1 "
+     "and invite_link_id = 1 and joined_user_id in (7, 8) and left_at is null"),
+    ("archivable_joins",
+     "select * from joins where user_id = 1 and invite_link_id = 1 and left_at < '2024-01-01' "
+     "and id > 1 order by id limit 1000"),
+    ("list_archives",
+     "select * from join_archives where user_id = 1 and invite_link_id = 1 and state = 'done' "
+     "order by min_joined"),
+    ("tombstoned_links",
+     "select * from invite_links where removed_at is not null order by id limit 100"),
+    ("delete_join_chunk",
+     "select id from joins where user_id = 1 and invite_link_id = 1 limit 500"),
+]
+
+
+def _plan_nodes(node: dict) -> Iterator[dict]:
+    yield node
+    for child in node.get("Plans", ()):
+        yield from _plan_nodes(child)
+
+
+def seq_scans(plan_json: Any) -> List[str]:
+    """Relations read by a Seq Scan anywhere in an EXPLAIN (FORMAT JSON) result."""
+    if isinstance(plan_json, str):
+        plan_json = json.loads(plan_json)
+    root = plan_json[0]["Plan"]
+    return [n.get("Relation Name", "?") for n in _plan_nodes(root) if n.get("Node Type") == "Seq Scan"]
+
+
+def index_names(plan_json: Any) -> List[str]:
+    if isinstance(plan_json, str):
+        plan_json = json.loads(plan_json)
+    return [n["Index Name"] for n in _plan_nodes(plan_json[0]["Plan"]) if "Index Name" in n]
+
+
+def check_plans(conn) -> List[Tuple[str, List[str], List[str]]]:
+    """(query, indexes used, seq-scanned tables) per hot query; nothing is executed."""
+    out = []
+    with conn.cursor() as cur:
+        cur.execute("begin")
+        try:
+            cur.execute("set local enable_seqscan = off")
+            for name, sql in HOT_QUERIES:
+                cur.execute("explain (format json) " + sql)
+                plan_json = cur.fetchone()[0]
+                out.append((name, index_names(plan_json), seq_scans(plan_json)))
+        finally:
+            cur.execute("rollback")
+    return out
+
+
+def print_plans(rows: List[Tuple[str, List[str], List[str]]]) -> bool:
+    ok = True
+    for name, indexes, scans in rows:
+        if scans:
+            ok = False
+            print(f"FAIL {name:<20} seq scan on {', '.join(scans)}")
+        else:
+            print(f"ok   {name:<20} {', '.join(indexes) or '-'}")
+    return ok
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    ap = argparse.ArgumentParser(description="Apply versioned SQL migrations to the Supabase database")
+    ap.add_argument("--dsn", default=os.getenv("DATABASE_URL", ""), help="postgres connection string")
+    ap.add_argument("--status", action="store_true", help="list applied / pending migrations")
+    ap.add_argument("--dry-run", action="store_true", help="show pending migrations without applying")
+    ap.add_argument("--explain", action="store_true", help="check the hot queries use an index")
+    args = ap.parse_args(argv)
+
+    migrations = load_migrations()
+    if not args.dsn:
+        ap.error("no database: set DATABASE_URL or pass --dsn")
+
+    conn = connect(args.dsn)
+    try:
+        if args.status or args.dry_run:
+            applied = applied_versions(conn)
+            pending = plan(migrations, applied)
+            for m in migrations:
+                state = "pending" if m in pending else "applied"
+                print(f"{state:<8} {m.version:04d}_{m.name}")
+            if args.dry_run:
+                for m in pending:
+                    print(f"\n-- {m.version:04d}_{m.name}\n{m.sql}")
+            return 0
+        if args.explain:
+            return 0 if print_plans(check_plans(conn)) else 1
+        if not apply(conn, migrations):
+            print("schema is up to date")
+        return 0
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
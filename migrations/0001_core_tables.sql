@@ -0,0 +1,45 @@
+-- Core tables of the Supabase backend (storage.SupabaseStorage).
+-- Unique constraints double as the upsert conflict targets:
+--   user_sessions  on_conflict=user_id
+--   invite_links   on_conflict=user_id,chat_id,invite_link
+--   joins          on_conflict=user_id,chat_id,invite_link_id,joined_user_id
+
+create table if not exists user_sessions (
+    user_id      bigint primary key,
+    phone        text,
+    session_file text,
+    is_active    boolean not null default true,
+    created_at   timestamptz not null default now()
+);
+
+create table if not exists invite_links (
+    id              bigint generated by default as identity primary key,
+    user_id         bigint not null,
+    chat_id         bigint not null,
+    chat_title      text,
+    invite_link     text not null,
+    link_type       text not null default 'normal' check (link_type in ('normal', 'approval')),
+    is_active       boolean not null default true,
+    created_at      timestamptz not null default now(),
+    usage_count     integer,
+    requested_count integer,
+    constraint invite_links_owner_link_key unique (user_id, chat_id, invite_link)
+);
+
+create table if not exists joins (
+    id             bigint generated by default as identity primary key,
+    user_id        bigint not null,
+    chat_id        bigint not null,
+    invite_link_id bigint not null,
+    joined_user_id bigint not null,
+    joined_at      timestamptz,
+    left_at        timestamptz,
+    left_reason    text,
+    left_seen_at   timestamptz,
+    constraint joins_member_key unique (user_id, chat_id, invite_link_id, joined_user_id)
+);
+
+-- only the service role (the bot) reads / writes these tables
+alter table user_sessions enable row level security;
+alter table invite_links enable row level security;
+alter table joins enable row level security;
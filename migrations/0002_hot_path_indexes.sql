@@ -0,0 +1,35 @@
+-- Indexes behind the bot's hot queries (checked by `python migrate.py --explain`
+-- and the bench `explain` case).
+
+-- list_invite_links: active links of an owner, newest first
+create index if not exists invite_links_owner_idx
+    on invite_links (user_id, created_at desc) where is_active;
+
+-- owners_for_chat (leave events)
+create index if not exists invite_links_chat_idx
+    on invite_links (chat_id, user_id) where is_active;
+
+-- recent_sessions (boot warm-up, archival pass)
+create index if not exists user_sessions_recent_idx
+    on user_sessions (created_at desc) where is_active;
+
+-- count_joins, fetch_joins (keyset pages on joined_at, id), list_link_joins,
+-- delete_links; includes the left_at column so counts stay index-only
+create index if not exists joins_link_time_idx
+    on joins (user_id, invite_link_id, joined_at, id) include (left_at);
+
+-- count_left: rows that left, by join time
+create index if not exists joins_link_left_idx
+    on joins (user_id, invite_link_id, joined_at) where left_at is not null;
+
+-- archivable_joins: rows that left before a cutoff
+create index if not exists joins_link_left_at_idx
+    on joins (user_id, invite_link_id, left_at) where left_at is not null;
+
+-- latest_join (track_user_left): newest row of a member in a chat
+create index if not exists joins_member_idx
+    on joins (user_id, chat_id, joined_user_id, joined_at desc);
+
+-- mark_left_members: still-active rows of these members of a link
+create index if not exists joins_link_open_idx
+    on joins (user_id, invite_link_id, joined_user_id) where left_at is null;
@@ -0,0 +1,36 @@
+-- Cold-archive manifests (archive.py) and user-client auth keys
+-- (sessions.py, SESSION_BACKEND=db).
+
+create table if not exists join_archives (
+    id             bigint generated by default as identity primary key,
+    user_id        bigint not null,
+    chat_id        bigint not null,
+    invite_link_id bigint not null,
+    object_name    text not null unique,
+    rows           integer not null,
+    left_rows      integer not null,
+    min_joined     bigint not null,   -- epoch seconds
+    max_joined     bigint not null,
+    daily          text,              -- JSON: IST day -> [joins, leaves]
+    state          text not null default 'pending' check (state in ('pending', 'done')),
+    created_at     timestamptz not null default now()
+);
+
+-- list_archives / delete_links (per link), pending_archives (recovery)
+create index if not exists join_archives_link_idx
+    on join_archives (user_id, invite_link_id, state, min_joined);
+create index if not exists join_archives_pending_idx
+    on join_archives (id) where state = 'pending';
+
+create table if not exists telethon_sessions (
+    session_key    text primary key,
+    dc_id          integer not null,
+    server_address text,
+    port           integer,
+    auth_key       text,              -- base64
+    takeout_id     bigint,
+    updated_at     timestamptz not null default now()
+);
+
+alter table join_archives enable row level security;
+alter table telethon_sessions enable row level security;
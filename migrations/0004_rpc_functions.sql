@@ -0,0 +1,53 @@
+-- RPC functions (PostgREST /rpc/<name>). Security invoker: callers see
+-- only what row level security lets them see; the bot uses the service role.
+
+-- Leave event in one round trip: for every owner tracking the chat, mark
+-- the member's latest join row left (if it is still open). Returns the
+-- rows it marked. Replaces owners_for_chat + latest_join + mark_left.
+create or replace function mark_member_left(
+    p_chat_id bigint,
+    p_joined_user_id bigint,
+    p_reason text,
+    p_when timestamptz default now()
+)
+returns table (user_id bigint, invite_link_id bigint, joined_at timestamptz)
+language sql
+as $$
+    with owners as (
+        select distinct l.user_id
+        from invite_links l
+        where l.chat_id = p_chat_id and l.is_active
+    ),
+    latest as (
+        select distinct on (j.user_id) j.id, j.left_at
+        from joins j
+        join owners o on o.user_id = j.user_id
+        where j.chat_id = p_chat_id and j.joined_user_id = p_joined_user_id
+        order by j.user_id, j.joined_at desc
+    )
+    update joins j
+    set left_at = p_when, left_reason = p_reason, left_seen_at = p_when
+    from latest
+    where j.id = latest.id and latest.left_at is null
+    returning j.user_id, j.invite_link_id, j.joined_at;
+$$;
+
+-- Joins and leaves of one link in a joined_at window (either end open)
+-- in one index-only pass: the same filter as count_joins / count_left.
+create or replace function join_window_counts(
+    p_user_id bigint,
+    p_invite_link_id bigint,
+    p_since timestamptz default null,
+    p_until timestamptz default null
+)
+returns table (join_count bigint, left_count bigint)
+language sql
+stable
+as $$
+    select count(*), count(*) filter (where j.left_at is not null)
+    from joins j
+    where j.user_id = p_user_id
+      and j.invite_link_id = p_invite_link_id
+      and (p_since is null or j.joined_at >= p_since)
+      and (p_until is null or j.joined_at <= p_until);
+$$;
@@ -0,0 +1,38 @@
+-- Frozen links: dead on Telegram's side (revoked, expired, at their usage
+-- limit, or in a chat the owner can no longer read). They stay listed with
+-- their final counts but are never synced again and leave events skip them.
+
+alter table invite_links add column if not exists frozen_at timestamptz;
+alter table invite_links add column if not exists frozen_reason text
+    check (frozen_reason in ('revoked', 'expired', 'exhausted', 'chat_left'));
+
+-- mark_member_left (0004) without frozen links: their owners are not
+-- tracking the chat through them, and their rows keep their final state.
+create or replace function mark_member_left(
+    p_chat_id bigint,
+    p_joined_user_id bigint,
+    p_reason text,
+    p_when timestamptz default now()
+)
+returns table (user_id bigint, invite_link_id bigint, joined_at timestamptz)
+language sql
+as $$
+    with live as (
+        select l.id, l.user_id
+        from invite_links l
+        where l.chat_id = p_chat_id and l.is_active and l.frozen_at is null
+    ),
+    latest as (
+        select distinct on (j.user_id) j.id, j.left_at, j.invite_link_id
+        from joins j
+        where j.chat_id = p_chat_id and j.joined_user_id = p_joined_user_id
+          and j.user_id in (select live.user_id from live)
+        order by j.user_id, j.joined_at desc
+    )
+    update joins j
+    set left_at = p_when, left_reason = p_reason, left_seen_at = p_when
+    from latest
+    where j.id = latest.id and latest.left_at is null
+      and latest.invite_link_id in (select live.id from live)
+    returning j.user_id, j.invite_link_id, j.joined_at;
+$$;
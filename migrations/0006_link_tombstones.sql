@@ -0,0 +1,9 @@
+-- /remove_link only tombstones links (is_active = false) and answers at
+-- once. The reaper (login.py) deletes their join rows in bounded chunks,
+-- records its progress in reaped_rows, then deletes the link row itself.
+
+alter table invite_links add column if not exists reaped_rows bigint;
+
+-- tombstoned_links: removed links still being reaped
+create index if not exists invite_links_removed_idx
+    on invite_links (id) where not is_active;
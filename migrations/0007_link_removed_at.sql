@@ -0,0 +1,11 @@
+-- Removed links get their own tombstone. is_active = false alone also
+-- matched rows deactivated for other reasons, and a re-added link flipped
+-- it back while the reaper kept deleting its rows. The reaper now only
+-- picks rows with removed_at set; save_invite_link refuses them.
+
+alter table invite_links add column if not exists removed_at timestamptz;
+
+-- tombstoned_links: removed links still being reaped
+drop index if exists invite_links_removed_idx;
+create index if not exists invite_links_removed_at_idx
+    on invite_links (id) where removed_at is not null;
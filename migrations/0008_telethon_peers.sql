@@ -0,0 +1,12 @@
+-- Chat / channel access hashes of each user client (sessions.py). Only
+-- the auth key was stored, so after a restart get_input_entity(chat_id)
+-- failed for every chat until the client happened to see it again.
+
+create table if not exists telethon_peers (
+    session_key text not null,
+    peer_id     bigint not null,      -- marked id (-100...)
+    access_hash bigint not null,
+    primary key (session_key, peer_id)
+);
+
+alter table telethon_peers enable row level security;
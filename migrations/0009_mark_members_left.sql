@@ -0,0 +1,36 @@
+-- Leave events in batches: mark_member_left (0005) for many members of
+-- one chat in one round trip. The outbox drainer sends every queued leave
+-- of a chat at once; one leave per member (a second one would find the
+-- row already left). Returns the rows it marked.
+create or replace function mark_members_left(
+    p_chat_id bigint,
+    p_joined_user_ids bigint[],
+    p_reasons text[],
+    p_whens timestamptz[]
+)
+returns table (user_id bigint, invite_link_id bigint, joined_user_id bigint, joined_at timestamptz)
+language sql
+as $$
+    with leaves as (
+        select * from unnest(p_joined_user_ids, p_reasons, p_whens) as v(joined_user_id, reason, left_when)
+    ),
+    live as (
+        select l.id, l.user_id
+        from invite_links l
+        where l.chat_id = p_chat_id and l.is_active and l.frozen_at is null
+    ),
+    latest as (
+        select distinct on (j.user_id, j.joined_user_id) j.id, j.left_at, j.invite_link_id, j.joined_user_id
+        from joins j
+        where j.chat_id = p_chat_id and j.joined_user_id = any(p_joined_user_ids)
+          and j.user_id in (select live.user_id from live)
+        order by j.user_id, j.joined_user_id, j.joined_at desc
+    )
+    update joins j
+    set left_at = lv.left_when, left_reason = lv.reason, left_seen_at = lv.left_when
+    from latest
+    join leaves lv on lv.joined_user_id = latest.joined_user_id
+    where j.id = latest.id and latest.left_at is null
+      and latest.invite_link_id in (select live.id from live)
+    returning j.user_id, j.invite_link_id, j.joined_user_id, j.joined_at;
+$$;
@@ -0,0 +1,163 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Iterator, List, NamedTuple, Optional, Sequence, Tuple
+
+# ---------------- WRITE OUTBOX ----------------
+#  Durable FIFO of pending DB writes in a local WAL sqlite file.
+#  Handlers append (one fsync'd transaction, shared by the writes queued
+#  at the same moment) and return; a drainer in login.py replays the
+#  head in batches and deletes what was applied.
+#  Every item has an idempotency key: enqueueing the same write twice
+#  keeps one copy, and every op is safe to replay after a crash between
+#  "applied" and "deleted".
+#  On failure the head waits with exponential backoff; order is kept
+#  (a leave is never applied before the join it refers to). Items that
+#  keep failing for max_attempts are parked as 'dead'.
+# -----------------------------------------------
+
+OUTBOX_SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    seq        INTEGER PRIMARY KEY AUTOINCREMENT,
+    key        TEXT NOT NULL UNIQUE,
+    op         TEXT NOT NULL,
+    payload    TEXT NOT NULL,
+    state      TEXT NOT NULL DEFAULT 'pending',
+    attempts   INTEGER NOT NULL DEFAULT 0,
+    next_at    REAL NOT NULL DEFAULT 0,
+    last_error TEXT,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS outbox_pending_idx ON outbox (state, seq);
+"""
+
+BACKOFF_MAX = 300.0  # seconds
+
+
+class OutboxItem(NamedTuple):
+    seq: int
+    key: str
+    op: str
+    payload: Any
+    attempts: int
+    created_at: float
+
+
+class Outbox:
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.lock = threading.Lock()
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=FULL")  # an accepted write survives power loss
+        self.db.executescript(OUTBOX_SCHEMA)
+
+    def put(self, op: str, items: Sequence[Tuple[str, Any]]) -> List[str]:
+        """Append (key, payload) writes in one transaction. Returns the keys that were new."""
+        return self.put_many([(op, items)])[0]
+
+    def put_many(self, batches: Sequence[Tuple[str, Sequence[Tuple[str, Any]]]]) -> List[List[str]]:
+        """put() for several (op, items) batches in one transaction (one fsync). New keys per batch."""
+        now = time.time()
+        out: List[List[str]] = []
+        with self.lock:
+            self.db.execute("BEGIN")
+            try:
+                for op, items in batches:
+                    new = []
+                    for key, payload in items:
+                        cur = self.db.execute(
+                            "INSERT OR IGNORE INTO outbox (key, op, payload, created_at) VALUES (?, ?, ?, ?)",
+                            (key, op, json.dumps(payload, separators=(",", ":")), now),
+                        )
+                        if cur.rowcount:
+                            new.append(key)
+                    out.append(new)
+                self.db.execute("COMMIT")
+            except Exception:
+                self.db.execute("ROLLBACK")
+                raise
+        return out
+
+    def head(self, limit: int) -> List[OutboxItem]:
+        """Oldest pending items that are due (empty while the head is backing off)."""
+        now = time.time()
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT seq, key, op, payload, attempts, next_at, created_at FROM outbox "
+                "WHERE state = 'pending' ORDER BY seq LIMIT ?",
+                (limit,),
+            ).fetchall()
+        out = []
+        for seq, key, op, payload, attempts, next_at, created_at in rows:
+            if next_at > now:
+                break
+            out.append(OutboxItem(seq, key, op, json.loads(payload), attempts, created_at))
+        return out
+
+    def done(self, seqs: Sequence[int]):
+        with self.lock:
+            self.db.execute("BEGIN")
+            self.db.executemany("DELETE FROM outbox WHERE seq = ?", [(s,) for s in seqs])
+            self.db.execute("COMMIT")
+
+    def failed(self, seqs: Sequence[int], error: str, max_attempts: int) -> int:
+        """Back off these items (or park them as dead). Returns how many died."""
+        with self.lock:
+            attempts = max(
+                (r[0] for r in self.db.execute(
+                    f"SELECT attempts FROM outbox WHERE seq IN ({','.join('?' * len(seqs))})", tuple(seqs))),
+                default=0,
+            ) + 1
+            state = "dead" if attempts >= max_attempts else "pending"
+            delay = min(BACKOFF_MAX, 2.0 ** min(attempts, 16))
+            self.db.execute("BEGIN")
+            self.db.executemany(
+                "UPDATE outbox SET attempts = ?, next_at = ?, last_error = ?, state = ? WHERE seq = ?",
+                [(attempts, time.time() + delay, error[:500], state, s) for s in seqs],
+            )
+            self.db.execute("COMMIT")
+        return len(seqs) if state == "dead" else 0
+
+    def pending_for_link(self, invite_link_id: int) -> int:
+        """Pending items whose payload belongs to this invite link (join upserts / left marks)."""
+        with self.lock:
+            return self.db.execute(
+                "SELECT COUNT(*) FROM outbox WHERE state = 'pending' "
+                "AND json_extract(payload, '$.invite_link_id') = ?",
+                (invite_link_id,),
+            ).fetchone()[0]
+
+    def retry_in(self) -> Optional[float]:
+        """Seconds until the head is due (0 = now), None when nothing is pending."""
+        with self.lock:
+            r = self.db.execute(
+                "SELECT next_at FROM outbox WHERE state = 'pending' ORDER BY seq LIMIT 1"
+            ).fetchone()
+        return None if r is None else max(0.0, r[0] - time.time())
+
+    def stats(self) -> dict:
+        """pending / dead counts and the age (s) of the oldest pending item."""
+        with self.lock:
+            counts = dict(self.db.execute("SELECT state, COUNT(*) FROM outbox GROUP BY state").fetchall())
+            oldest = self.db.execute("SELECT MIN(created_at) FROM outbox WHERE state = 'pending'").fetchone()[0]
+        return {
+            "pending": counts.get("pending", 0),
+            "dead": counts.get("dead", 0),
+            "oldest_age": time.time() - oldest if oldest else 0.0,
+        }
+
+
+def runs(items: Sequence[OutboxItem]) -> Iterator[Tuple[str, List[OutboxItem]]]:
+    """Consecutive items grouped by op (order preserved)."""
+    group: List[OutboxItem] = []
+    for it in items:
+        if group and it.op != group[0].op:
+            yield group[0].op, group
+            group = []
+        group.append(it)
+    if group:
+        yield group[0].op, group
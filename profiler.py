@@ -0,0 +1,130 @@
+import asyncio
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from typing import List, Optional
+
+import tracing
+
+# ---------------- RUNTIME PROFILER ----------------
+#  Wall-clock sampling profiler for the running bot:
+#    - a thread samples the stack of every OS thread (on-CPU work,
+#      including whatever task the event loop is executing right now)
+#    - a loop task samples the await chain of every pending asyncio task
+#      (where each handler / background job is waiting)
+#  Output is the collapsed "frame;frame;frame count" format understood by
+#  flamegraph.pl, speedscope and inferno.
+# ---------------------------------------------------
+
+
+def _frame_label(f) -> str:
+    code = f.f_code
+    name = getattr(code, "co_qualname", code.co_name)
+    mod = f.f_globals.get("__name__", os.path.basename(code.co_filename))
+    return f"{mod}.{name}".replace(";", ":")
+
+
+def await_chain(coro) -> List[object]:
+    """Frames of a coroutine and everything it awaits, outermost first (+ leaf awaitable)."""
+    out: List[object] = []
+    for _ in range(200):
+        if coro is None:
+            break
+        f = getattr(coro, "cr_frame", None) or getattr(coro, "gi_frame", None) or getattr(coro, "ag_frame", None)
+        nxt = getattr(coro, "cr_await", None) or getattr(coro, "gi_yieldfrom", None) or getattr(coro, "ag_await", None)
+        if f is not None:
+            out.append(f)
+        elif not hasattr(coro, "cr_frame") and not hasattr(coro, "gi_frame"):
+            out.append(coro)  # Future / other awaitable at the bottom
+            break
+        coro = nxt
+    return out
+
+
+def _leaf_label(obj) -> str:
+    name = type(obj).__name__
+    return "Future" if name == "FutureIter" else name
+
+
+def _task_label(task: asyncio.Task) -> str:
+    root = tracing.ACTIVE.get(task)
+    if root is not None:
+        return f"handler:{root.name}"
+    return f"task:{task.get_name()}"
+
+
+class SamplingProfiler:
+    def __init__(self, loop: Optional[asyncio.AbstractEventLoop] = None, interval: float = 0.005,
+                 task_interval: float = 0.02):
+        self.loop = loop or asyncio.get_event_loop()
+        self.interval = interval
+        self.task_interval = task_interval
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+
+    def _sample_threads(self):
+        names = {t.ident: t.name for t in threading.enumerate()}
+        me = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for tid, frame in sys._current_frames().items():
+                if tid == me:
+                    continue
+                labels = []
+                f = frame
+                while f is not None:
+                    labels.append(_frame_label(f))
+                    f = f.f_back
+                labels.append(f"thread:{names.get(tid, tid)}")
+                self.stacks[";".join(reversed(labels))] += 1
+            self.samples += 1
+
+    async def _sample_tasks(self):
+        me = asyncio.current_task()
+        while not self._stop.is_set():
+            for task in asyncio.all_tasks(self.loop):
+                if task is me or task.done():
+                    continue
+                parts = [_task_label(task)]
+                for item in await_chain(task.get_coro()):
+                    parts.append(_frame_label(item) if hasattr(item, "f_code") else f"<{_leaf_label(item)}>")
+                self.stacks["asyncio;" + ";".join(parts)] += 1
+            await asyncio.sleep(self.task_interval)
+
+    async def run(self, seconds: float) -> str:
+        """Profile for `seconds` and return the collapsed stacks text."""
+        t = threading.Thread(target=self._sample_threads, name="profiler", daemon=True)
+        t.start()
+        sampler = self.loop.create_task(self._sample_tasks(), name="profiler-tasks")
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            self._stop.set()
+            await sampler
+            await asyncio.to_thread(t.join)
+        return self.folded()
+
+    def folded(self) -> str:
+        return "".join(f"{stack} {n}\n" for stack, n in self.stacks.most_common())
+
+
+def format_tasks(loop: Optional[asyncio.AbstractEventLoop] = None) -> str:
+    """Human readable dump of all pending tasks and the line each one is awaiting on."""
+    loop = loop or asyncio.get_event_loop()
+    tasks = [t for t in asyncio.all_tasks(loop) if not t.done()]
+    lines = [f"{len(tasks)} pending task(s) @ {time.strftime('%Y-%m-%d %H:%M:%S')}", ""]
+    for task in sorted(tasks, key=lambda t: t.get_name()):
+        root = tracing.ACTIVE.get(task)
+        head = f"● {task.get_name()}"
+        if root is not None:
+            head += f"  [handler {root.name}, {root.duration:.1f}s]"
+        lines.append(head)
+        for item in await_chain(task.get_coro()):
+            if hasattr(item, "f_code"):
+                lines.append(f"    {_frame_label(item)}  ({os.path.basename(item.f_code.co_filename)}:{item.f_lineno})")
+            else:
+                lines.append(f"    ⏳ {_leaf_label(item)}")
+        lines.append("")
+    return "\n".join(lines)
@@ -0,0 +1,40 @@
+import asyncio
+import time
+from typing import Optional
+
+# ---------------- RATE LIMITING ----------------
+#  Async token bucket shared by code paths that fire many MTProto
+#  requests from one owner's account (bulk join-request handling, ...).
+# -----------------------------------------------
+
+
+class TokenBucket:
+    """`rate` tokens per second, at most `burst` banked. acquire() waits for tokens."""
+
+    def __init__(self, rate: float, burst: Optional[float] = None):
+        self.rate = max(rate, 0.001)
+        self.burst = burst if burst is not None else max(1.0, rate)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, n: float = 1.0):
+        # FIFO: one waiter refills at a time; requests larger than the
+        # burst wait for a full bucket and leave it in debt
+        async with self._lock:
+            self._refill()
+            need = min(n, self.burst)
+            while self.tokens < need:
+                await asyncio.sleep((need - self.tokens) / self.rate)
+                self._refill()
+            self.tokens -= n
+
+    def penalize(self, seconds: float):
+        """Drain the bucket for `seconds` (e.g. after a FloodWait)."""
+        self._refill()
+        self.tokens = min(self.tokens, 0.0) - seconds * self.rate
@@ -0,0 +1,81 @@
+import re
+from typing import Callable, Dict, List, Optional, Pattern, Tuple
+
+# ---------------- UPDATE ROUTER ----------------
+#  One NewMessage and one CallbackQuery handler for the whole bot,
+#  instead of a Telethon handler (and a regex test) per command:
+#    /command [args]  -> dict lookup on the first word, then that one
+#                        command's argument regex (sets e.pattern_match)
+#    callback data    -> dict lookup on the prefix up to the first ":"
+#                        ("stats:12" -> b"stats:"), else the whole data
+#    other text       -> the first text handler whose state holds the
+#                        sender (e.g. a login in progress); else dropped
+#  Routing cost does not grow with the number of commands.
+# -----------------------------------------------
+
+Handler = Callable
+
+
+def callback_key(data: bytes) -> bytes:
+    """Routing key of callback data: b"stats:12" -> b"stats:", b"cal_reset" -> b"cal_reset"."""
+    k = data.find(b":")
+    return data if k < 0 else data[:k + 1]
+
+
+class Router:
+    def __init__(self, wrap: Optional[Callable[[Handler], Handler]] = None):
+        self.wrap = wrap or (lambda fn: fn)  # e.g. tracing.traced_handler, applied per route
+        self.commands: Dict[str, Tuple[Pattern, Handler]] = {}
+        self.callbacks: Dict[bytes, Handler] = {}
+        self.texts: List[Tuple[Callable[[int], bool], Handler]] = []
+
+    # ---- registration ----
+    def command(self, *names: str, args: str = ""):
+        """Handle /name (and aliases). `args` is a regex for what may follow the command."""
+        def deco(fn):
+            pattern = re.compile(rf"^/(?:{'|'.join(map(re.escape, names))}){args}$")
+            for name in names:
+                key = f"/{name}"
+                if key in self.commands:
+                    raise ValueError(f"command {key} registered twice")
+                self.commands[key] = (pattern, self.wrap(fn))
+            return fn
+        return deco
+
+    def callback(self, *keys: bytes):
+        """Handle callback data with these routing keys (see callback_key)."""
+        def deco(fn):
+            for key in keys:
+                if callback_key(key) != key:
+                    raise ValueError(f"callback key {key!r} must end at its first ':'")
+                if key in self.callbacks:
+                    raise ValueError(f"callback {key!r} registered twice")
+                self.callbacks[key] = self.wrap(fn)
+            return fn
+        return deco
+
+    def text(self, active: Callable[[int], bool]):
+        """Handle non-command messages from senders for which active(sender_id) is true."""
+        def deco(fn):
+            self.texts.append((active, self.wrap(fn)))
+            return fn
+        return deco
+
+    # ---- dispatch ----
+    async def on_message(self, e):
+        text = e.raw_text or ""
+        if text.startswith("/"):
+            route = self.commands.get(text.split(None, 1)[0])
+            if route is not None:
+                m = route[0].match(text)
+                if m is not None:
+                    e.pattern_match = m
+                    return await route[1](e)
+        for active, fn in self.texts:
+            if active(e.sender_id):
+                return await fn(e)
+
+    async def on_callback(self, e):
+        fn = self.callbacks.get(callback_key(e.data or b""))
+        if fn is not None:
+            return await fn(e)
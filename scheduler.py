@@ -0,0 +1,159 @@
+import asyncio
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Callable, Deque, Dict, Optional
+
+# ---------------- FAIR-SHARE SYNC SCHEDULER ----------------
+#  Admission control for link syncs (one unit of work = one link):
+#    - at most `slots` units run at once, at most `per_owner` per owner
+#    - two lanes: "interactive" (a user is waiting on /stats, ...) is
+#      always served first; "background" never takes the last
+#      `reserve` slots, so an interactive request finds one free
+#    - inside a lane, owners take turns by deficit round-robin: each
+#      turn adds `quantum` to the owner's deficit, a unit runs when
+#      the deficit covers its cost. An owner with hundreds of huge
+#      links gets the same share as one with a single small link.
+# ------------------------------------------------------------
+
+LANES = ("interactive", "background")
+
+
+class _Waiter:
+    __slots__ = ("owner", "cost", "lane", "fut", "queued_at", "position")
+
+    def __init__(self, owner: int, cost: float, lane: str, position: int):
+        self.owner = owner
+        self.cost = cost
+        self.lane = lane
+        self.fut: Optional[asyncio.Future] = None
+        self.queued_at = time.monotonic()
+        self.position = position  # units waiting in the lane ahead of this one
+
+
+class _Lane:
+    """Per-owner FIFO queues served by deficit round-robin."""
+
+    def __init__(self):
+        self.queues: Dict[int, Deque[_Waiter]] = {}
+        self.ring: Deque[int] = deque()  # owners with waiting units, in turn order
+        self.deficit: Dict[int, float] = {}
+        self.waiting = 0
+        self.running = 0
+
+    def push(self, w: _Waiter):
+        q = self.queues.get(w.owner)
+        if q is None:
+            q = self.queues[w.owner] = deque()
+            self.ring.append(w.owner)
+            self.deficit[w.owner] = 0.0
+        q.append(w)
+        self.waiting += 1
+
+    def discard(self, w: _Waiter):
+        q = self.queues.get(w.owner)
+        if q is None or w not in q:
+            return
+        q.remove(w)
+        self.waiting -= 1
+        if not q:
+            self._drop_owner(w.owner)
+
+    def _drop_owner(self, owner: int):
+        del self.queues[owner]
+        self.deficit.pop(owner, None)
+        self.ring.remove(owner)
+
+    def pop(self, eligible: Callable[[int], bool], quantum: float) -> Optional[_Waiter]:
+        """Next unit by DRR among owners for which eligible(owner) holds (None if none)."""
+        if not any(eligible(o) for o in self.ring):
+            return None
+        while True:
+            owner = self.ring[0]
+            if eligible(owner):
+                q = self.queues[owner]
+                if self.deficit[owner] >= q[0].cost:
+                    w = q.popleft()
+                    self.waiting -= 1
+                    self.deficit[owner] -= w.cost
+                    if not q:
+                        self._drop_owner(owner)
+                    return w
+                self.deficit[owner] += quantum
+            self.ring.rotate(-1)
+
+
+class FairScheduler:
+    def __init__(self, slots: int, per_owner: int, quantum: float = 1.0, reserve: int = 1,
+                 on_admit: Optional[Callable[[str, float, int], None]] = None):
+        self.slots = max(1, slots)
+        self.per_owner = max(1, per_owner)
+        self.quantum = max(quantum, 0.001)
+        self.reserve = min(max(0, reserve), self.slots - 1)  # slots background work may not take
+        self.on_admit = on_admit  # (lane, seconds waited, queue position) per admitted unit
+        self.lanes: Dict[str, _Lane] = {name: _Lane() for name in LANES}
+        self.owner_running: Dict[int, int] = {}
+        self.running = 0
+
+    def _eligible(self, owner: int) -> bool:
+        return self.owner_running.get(owner, 0) < self.per_owner
+
+    def _lane_open(self, lane: str) -> bool:
+        if self.running >= self.slots:
+            return False
+        return lane == "interactive" or self.running < self.slots - self.reserve
+
+    def _admit(self, w: _Waiter):
+        self.running += 1
+        self.lanes[w.lane].running += 1
+        self.owner_running[w.owner] = self.owner_running.get(w.owner, 0) + 1
+        if self.on_admit is not None:
+            self.on_admit(w.lane, time.monotonic() - w.queued_at, w.position)
+
+    def _dispatch(self):
+        for name in LANES:  # interactive first
+            lane = self.lanes[name]
+            while lane.waiting and self._lane_open(name):
+                w = lane.pop(self._eligible, self.quantum)
+                if w is None:
+                    break
+                self._admit(w)
+                w.fut.set_result(None)
+
+    def _release(self, w: _Waiter):
+        self.running -= 1
+        self.lanes[w.lane].running -= 1
+        n = self.owner_running.get(w.owner, 0) - 1
+        if n > 0:
+            self.owner_running[w.owner] = n
+        else:
+            self.owner_running.pop(w.owner, None)
+        self._dispatch()
+
+    @asynccontextmanager
+    async def slot(self, owner: int, cost: float = 1.0, interactive: bool = True):
+        """Hold one unit of sync capacity for `owner` (waits for its fair turn)."""
+        lane = LANES[0] if interactive else LANES[1]
+        w = _Waiter(owner, max(cost, 0.001), lane, self.lanes[lane].waiting)
+        w.fut = asyncio.get_running_loop().create_future()
+        self.lanes[lane].push(w)
+        self._dispatch()  # admits it right away when there is room
+        try:
+            await w.fut
+        except BaseException:
+            if w.fut.done() and not w.fut.cancelled():
+                self._release(w)  # admitted just as we were cancelled
+            else:
+                self.lanes[lane].discard(w)
+            raise
+        try:
+            yield
+        finally:
+            self._release(w)
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        """lane -> waiting / running units and owners queued."""
+        return {
+            name: {"waiting": lane.waiting, "running": lane.running, "owners": len(lane.queues)}
+            for name, lane in self.lanes.items()
+        }
@@ -0,0 +1,191 @@
+import os
+import sqlite3
+import threading
+from datetime import datetime, timezone
+from typing import Dict, Optional
+
+from telethon.crypto import AuthKey
+from telethon.sessions import MemorySession
+
+# ---------------- USER-CLIENT SESSIONS ----------------
+#  Telethon sessions of the owners' accounts, without one .session
+#  sqlite file per owner:
+#    StoredSession  - MemorySession whose auth state (dc, address, port,
+#                     auth key, takeout) and chat / channel access
+#                     hashes are loaded from / saved to a session store;
+#                     users, files and update states stay in memory
+#    SqliteSessionStore - one WAL sqlite file for every owner
+#  storage.Storage implements the same load_auth / save_auth /
+#  delete_auth / load_peers / save_peers methods, so sessions can also
+#  live in the database and any worker can serve any owner. Legacy
+#  .session files (auth key + their entities' access hashes) are
+#  imported on first use.
+# -------------------------------------------------------
+
+SESSION_SCHEMA = """
+CREATE TABLE IF NOT EXISTS telethon_sessions (
+    session_key    TEXT PRIMARY KEY,
+    dc_id          INTEGER NOT NULL,
+    server_address TEXT,
+    port           INTEGER,
+    auth_key       BLOB,
+    takeout_id     INTEGER,
+    updated_at     TEXT
+);
+CREATE TABLE IF NOT EXISTS telethon_peers (
+    session_key TEXT NOT NULL,
+    peer_id     INTEGER NOT NULL,
+    access_hash INTEGER NOT NULL,
+    PRIMARY KEY (session_key, peer_id)
+);
+"""
+
+AUTH_FIELDS = ("dc_id", "server_address", "port", "auth_key", "takeout_id")
+
+
+class SqliteSessionStore:
+    """Auth state of every user client in one WAL sqlite file (one handle, shared)."""
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.db.row_factory = sqlite3.Row
+        self.lock = threading.Lock()
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript(SESSION_SCHEMA)
+
+    def load_auth(self, session_key: str) -> Optional[dict]:
+        with self.lock:
+            r = self.db.execute(
+                "SELECT dc_id, server_address, port, auth_key, takeout_id FROM telethon_sessions WHERE session_key = ?",
+                (session_key,),
+            ).fetchone()
+        return dict(r) if r else None
+
+    def save_auth(self, session_key: str, auth: dict):
+        with self.lock:
+            self.db.execute(
+                "INSERT INTO telethon_sessions (session_key, dc_id, server_address, port, auth_key, takeout_id, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (session_key) DO UPDATE SET dc_id = excluded.dc_id, "
+                "server_address = excluded.server_address, port = excluded.port, "
+                "auth_key = excluded.auth_key, takeout_id = excluded.takeout_id, updated_at = excluded.updated_at",
+                (session_key, *(auth[f] for f in AUTH_FIELDS), datetime.now(timezone.utc).isoformat()),
+            )
+
+    def delete_auth(self, session_key: str):
+        with self.lock:
+            self.db.execute("DELETE FROM telethon_sessions WHERE session_key = ?", (session_key,))
+            self.db.execute("DELETE FROM telethon_peers WHERE session_key = ?", (session_key,))
+
+    def load_peers(self, session_key: str) -> Dict[int, int]:
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT peer_id, access_hash FROM telethon_peers WHERE session_key = ?", (session_key,)
+            ).fetchall()
+        return {int(r[0]): int(r[1]) for r in rows}
+
+    def save_peers(self, session_key: str, peers: Dict[int, int]):
+        with self.lock:
+            self.db.executemany(
+                "INSERT INTO telethon_peers (session_key, peer_id, access_hash) VALUES (?, ?, ?) "
+                "ON CONFLICT (session_key, peer_id) DO UPDATE SET access_hash = excluded.access_hash",
+                [(session_key, p, h) for p, h in peers.items()],
+            )
+
+
+def read_session_file(path: str) -> Optional[dict]:
+    """Auth state of a legacy Telethon .session file (None if missing / empty)."""
+    if not os.path.exists(path):
+        return None
+    try:
+        db = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+        try:
+            r = db.execute("SELECT dc_id, server_address, port, auth_key, takeout_id FROM sessions").fetchone()
+        finally:
+            db.close()
+    except sqlite3.Error:
+        return None
+    if not r or not r[3]:
+        return None
+    return dict(zip(AUTH_FIELDS, r))
+
+
+def read_session_peers(path: str) -> Dict[int, int]:
+    """Chat / channel access hashes (marked id -> hash) of a legacy .session file."""
+    if not os.path.exists(path):
+        return {}
+    try:
+        db = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+        try:
+            rows = db.execute("SELECT id, hash FROM entities WHERE id < 0").fetchall()
+        finally:
+            db.close()
+    except sqlite3.Error:
+        return {}
+    return {int(i): int(h) for i, h in rows}
+
+
+class StoredSession(MemorySession):
+    """
+    Telethon session backed by a session store. Auth state is persisted
+    on save() when it changed; the access hash of every chat / channel
+    the client sees is persisted as soon as it is new, so
+    get_input_entity(chat_id) works after a restart without get_dialogs.
+    Users, files and update states stay in memory for the life of the
+    client.
+    """
+
+    def __init__(self, store, session_key: str, legacy_path: Optional[str] = None):
+        super().__init__()
+        self.store = store
+        self.session_key = session_key
+        auth = store.load_auth(session_key)
+        if auth is None and legacy_path:
+            auth = read_session_file(legacy_path)
+            if auth is not None:
+                store.save_auth(session_key, auth)
+        self._peers = store.load_peers(session_key)
+        if not self._peers and legacy_path:
+            self._peers = read_session_peers(legacy_path)  # also covers owners imported before peers were kept
+            if self._peers:
+                store.save_peers(session_key, self._peers)
+        self._entities |= {(p, h, None, None, None) for p, h in self._peers.items()}
+        if auth is not None:
+            self.set_dc(auth["dc_id"], auth["server_address"], auth["port"])
+            key = auth["auth_key"]
+            self._auth_key = AuthKey(data=bytes(key)) if key else None
+            self._takeout_id = auth["takeout_id"]
+        self._saved = self._auth_row()
+
+    def _auth_row(self) -> dict:
+        return {
+            "dc_id": self._dc_id,
+            "server_address": self._server_address,
+            "port": self._port,
+            "auth_key": self._auth_key.key if self._auth_key else None,
+            "takeout_id": self._takeout_id,
+        }
+
+    def process_entities(self, tlo):
+        rows = self._entities_to_rows(tlo)
+        self._entities |= set(rows)
+        new = {}
+        for peer_id, access_hash, _, _, _ in rows:
+            if peer_id < 0 and self._peers.get(peer_id) != access_hash:
+                new[peer_id] = access_hash
+        if new:
+            self.store.save_peers(self.session_key, new)
+            self._peers.update(new)
+
+    def save(self):
+        row = self._auth_row()
+        if row != self._saved and row["auth_key"]:
+            self.store.save_auth(self.session_key, row)
+            self._saved = row
+
+    def delete(self):
+        self.store.delete_auth(self.session_key)
+        self._saved = {}
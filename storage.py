@@ -0,0 +1,1300 @@
+import base64
+import os
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from datetime import datetime, timezone
+from typing import Dict, List, Tuple, Any, Optional
+
+# ---------------- STORAGE INTERFACE ----------------
+#  Everything the bot persists (sessions, invite links, joins, counts)
+#  goes through one Storage object. STORAGE_BACKEND picks the impl:
+#    supabase -> hosted PostgREST tables (default)
+#    sqlite   -> embedded single file, for local / edge deployments
+# ----------------------------------------------------
+
+
+def utc_iso(value: Any) -> Optional[str]:
+    """Normalize datetime / ISO string to a fixed-width UTC ISO string (sorts lexically)."""
+    if value is None:
+        return None
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc).isoformat(timespec="microseconds")
+
+
+def now_iso() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+ROW_PAGE = 1000  # PostgREST caps every response at 1000 rows
+
+REMOVED_LINK_MSG = "this link was just removed and its join data is still being deleted, try again in a few minutes"
+
+
+class Storage(ABC):
+    """Persistence interface used by login.py (all methods are blocking)."""
+
+    name = "base"
+    archives = False  # join_archives manifests exist (cold archive reads / cleanup)
+
+    # ---- sessions ----
+    @abstractmethod
+    def get_session(self, uid: int) -> Optional[dict]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def upsert_session(self, uid: int, phone: str, session_file: str):
+        raise NotImplementedError
+
+    @abstractmethod
+    def delete_session(self, uid: int):
+        raise NotImplementedError
+
+    @abstractmethod
+    def recent_sessions(self, limit: int) -> List[dict]:
+        """Active sessions, most recently (re)logged-in first."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def session_owners(self, after: int, limit: int) -> List[dict]:
+        """One keyset page of active sessions (user_id, session_file) with user_id > after, by user_id."""
+        raise NotImplementedError
+
+    # ---- telethon auth state (SESSION_BACKEND=db, see sessions.py) ----
+    @abstractmethod
+    def load_auth(self, session_key: str) -> Optional[dict]:
+        """dc_id, server_address, port, auth_key (bytes), takeout_id of one user client."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def save_auth(self, session_key: str, auth: dict):
+        raise NotImplementedError
+
+    @abstractmethod
+    def delete_auth(self, session_key: str):
+        """Drop the auth state and the stored access hashes of one user client."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def load_peers(self, session_key: str) -> Dict[int, int]:
+        """Marked chat / channel id -> access hash seen by one user client."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def save_peers(self, session_key: str, peers: Dict[int, int]):
+        raise NotImplementedError
+
+    # ---- invite links ----
+    @abstractmethod
+    def save_invite_link(self, uid: int, chat_id: int, chat_title: str, link: str, link_type: str) -> Optional[dict]:
+        """
+        Upsert an active link; returns the stored row (with its id). Raises
+        RuntimeError for a removed link whose rows are still being reaped.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def list_invite_links(self, uid: int) -> List[dict]:
+        """Active links of one owner, newest first."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def chat_links(self, chat_id: int) -> List[dict]:
+        """Active links in this chat: id, user_id, frozen_at (None unless frozen)."""
+        raise NotImplementedError
+
+    def owners_for_chat(self, chat_id: int) -> List[int]:
+        """Owners that track at least one live (active, not frozen) link in this chat."""
+        return sorted({int(r["user_id"]) for r in self.chat_links(chat_id) if not r.get("frozen_at")})
+
+    @abstractmethod
+    def delete_links(self, uid: int, link_ids: List[int]):
+        """Delete invite_links rows and all their join rows."""
+        raise NotImplementedError
+
+    # removal in the background: tombstone now, join rows in chunks, then delete_links
+    @abstractmethod
+    def tombstone_links(self, uid: int, link_ids: List[int]):
+        """Mark links removed (removed_at set, is_active = false); their rows stay until reaped."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def tombstoned_links(self, limit: int) -> List[dict]:
+        """Removed links still waiting for the reaper: id, user_id, reaped_rows (oldest first)."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def link_removed(self, link_id: int) -> bool:
+        """True while this link is tombstoned (False once it is gone or active again)."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def delete_join_chunk(self, uid: int, invite_link_id: int, limit: int) -> int:
+        """Delete up to `limit` join rows of one link. Returns rows deleted."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def set_link_reaped(self, link_id: int, rows: int):
+        """Progress of a removal: join rows deleted so far."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def set_link_counters(self, link_id: int, usage: int, requested: int):
+        """Remember Telegram's usage / requested counters seen at the last full sync."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def freeze_links(self, uid: int, link_ids: List[int], reason: str):
+        """Mark links dead on Telegram's side: kept with their counts, no longer synced or marked left."""
+        raise NotImplementedError
+
+    # ---- joins ----
+    @abstractmethod
+    def upsert_joins(self, rows: List[dict]):
+        """Upsert on (user_id, chat_id, invite_link_id, joined_user_id)."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def fetch_joins(
+        self,
+        uid: int,
+        invite_link_id: int,
+        since: Optional[datetime] = None,
+        until: Optional[datetime] = None,
+        after: Optional[Tuple[str, int]] = None,
+        limit: int = 20,
+        desc: bool = True,
+        columns: str = "*",
+    ) -> List[dict]:
+        """One keyset page ordered by (joined_at, id)."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def latest_join(self, uid: int, chat_id: int, joined_user_id: int) -> Optional[dict]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def latest_joins(self, uid: int, chat_id: int, joined_user_ids: List[int]) -> List[dict]:
+        """latest_join of many members: the newest row of each that has one (plus joined_user_id)."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def mark_left(self, row_id: int, reason: str, when: Optional[str] = None):
+        raise NotImplementedError
+
+    @abstractmethod
+    def mark_left_rows(self, row_ids: List[int], reason: str, when: Optional[str] = None):
+        """mark_left of many rows at once (rows already left are kept as they are)."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def mark_left_members(self, uid: int, invite_link_id: int, joined_user_ids: List[int],
+                          reason: str, when: Optional[str] = None):
+        """Mark the still-active rows of these joiners of one link as left."""
+        raise NotImplementedError
+
+    def mark_member_left(self, chat_id: int, joined_user_id: int, reason: str,
+                         when: Optional[str] = None) -> List[dict]:
+        """
+        Leave event: for every owner tracking the chat, mark the member's latest
+        join row left (if still open). Returns the marked rows
+        (user_id, invite_link_id, joined_at).
+        """
+        when = when or now_iso()
+        links = self.chat_links(chat_id)
+        frozen = {int(r["id"]) for r in links if r.get("frozen_at")}
+        marked = []
+        for uid in sorted({int(r["user_id"]) for r in links if not r.get("frozen_at")}):
+            row = self.latest_join(uid, chat_id, joined_user_id)
+            if not row or row.get("left_at") or int(row.get("invite_link_id") or 0) in frozen:
+                continue
+            self.mark_left(row["id"], reason, when)
+            marked.append({"user_id": uid, "invite_link_id": row.get("invite_link_id"), "joined_at": row.get("joined_at")})
+        return marked
+
+    def mark_members_left(self, chat_id: int, leaves: List[dict]) -> List[dict]:
+        """
+        mark_member_left for many leave events of one chat (joined_user_id,
+        reason, when; one per member): one chat_links read, one latest_joins
+        per owner and one update per (reason, when). Returns the marked rows
+        (user_id, invite_link_id, joined_user_id, joined_at).
+        """
+        links = self.chat_links(chat_id)
+        frozen = {int(r["id"]) for r in links if r.get("frozen_at")}
+        by_member = {int(lv["joined_user_id"]): lv for lv in leaves}
+        marked = []
+        for uid in sorted({int(r["user_id"]) for r in links if not r.get("frozen_at")}):
+            groups: Dict[Tuple[str, str], List[int]] = {}
+            for row in self.latest_joins(uid, chat_id, list(by_member)):
+                if row.get("left_at") or int(row.get("invite_link_id") or 0) in frozen:
+                    continue
+                lv = by_member[int(row["joined_user_id"])]
+                groups.setdefault((lv["reason"], lv.get("when") or now_iso()), []).append(row["id"])
+                marked.append({"user_id": uid, "invite_link_id": row.get("invite_link_id"),
+                               "joined_user_id": row["joined_user_id"], "joined_at": row.get("joined_at")})
+            for (reason, when), row_ids in groups.items():
+                self.mark_left_rows(row_ids, reason, when)
+        return marked
+
+    # ---- counts ----
+    @abstractmethod
+    def count_joins(self, uid: int, invite_link_id: int,
+                    since: Optional[datetime] = None, until: Optional[datetime] = None) -> int:
+        raise NotImplementedError
+
+    @abstractmethod
+    def count_left(self, uid: int, invite_link_id: int,
+                   since: Optional[datetime] = None, until: Optional[datetime] = None) -> int:
+        raise NotImplementedError
+
+    # ---- cold archive ----
+    @abstractmethod
+    def archivable_joins(self, uid: int, invite_link_id: int, before: datetime, limit: int,
+                         after_id: int = 0) -> List[dict]:
+        """Full join rows of one link that left before `before`, id > after_id, lowest id first."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def add_archive(self, row: dict) -> dict:
+        """Insert a join_archives manifest row (state 'pending'); returns it with its id."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def finish_archive(self, archive_id: int, row_ids: List[int]):
+        """Delete the archived join rows, then mark the manifest 'done' (safe to repeat)."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def list_archives(self, uid: int, invite_link_id: int) -> List[dict]:
+        """'done' manifests of one link, oldest first."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def pending_archives(self) -> List[dict]:
+        """Manifests whose join rows may not be deleted yet (interrupted runs)."""
+        raise NotImplementedError
+
+    # ---- files ----
+    def upload_file(self, path: str, object_name: str, content_type: str) -> str:
+        """Upload a local file to the bucket, return a download URL."""
+        raise RuntimeError(f"{self.name} storage has no file bucket")
+
+    def put_object(self, object_name: str, data: bytes, content_type: str):
+        raise RuntimeError(f"{self.name} storage has no file bucket")
+
+    def get_object(self, object_name: str) -> bytes:
+        raise RuntimeError(f"{self.name} storage has no file bucket")
+
+    def remove_objects(self, object_names: List[str]):
+        raise RuntimeError(f"{self.name} storage has no file bucket")
+
+    @property
+    def has_objects(self) -> bool:
+        """True when put_object / get_object work (cold archive enabled)."""
+        return False
+
+
+# ---------------- SUPABASE ----------------
+
+def _count_from_response(res) -> int:
+    try:
+        if hasattr(res, "count") and res.count is not None:
+            return int(res.count)
+    except Exception:
+        pass
+    try:
+        return len(res.data or [])
+    except Exception:
+        return 0
+
+
+def _keyset_filter(cursor: Tuple[str, int], desc: bool) -> str:
+    """PostgREST `or` filter that continues after a (joined_at, id) cursor."""
+    ts, row_id = cursor
+    op = "lt" if desc else "gt"
+    return f'joined_at.{op}."{ts}",and(joined_at.eq."{ts}",id.{op}.{int(row_id)})'
+
+
+class SupabaseStorage(Storage):
+    name = "supabase"
+
+    def __init__(self, client=None, bucket: str = "", url: str = "", key: str = "", archives: bool = False,
+                 rpc: bool = False):
+        self._client = client
+        self.bucket = bucket
+        self.archives = archives  # the join_archives table is only queried once archival is configured
+        self.rpc = rpc  # migrations/0004_rpc_functions.sql is applied
+        self.url = url
+        self.key = key
+
+    @property
+    def client(self):
+        """supabase Client, created on first use (importing the bot stays offline)."""
+        if self._client is None:
+            from supabase import create_client  # only needed for the hosted backend
+            self._client = create_client(self.url, self.key)
+        return self._client
+
+    def table(self, name: str):
+        return self.client.table(name)
+
+    # ---- sessions ----
+    def get_session(self, uid: int) -> Optional[dict]:
+        res = self.table("user_sessions").select("*").eq("user_id", uid).limit(1).execute()
+        return res.data[0] if res.data else None
+
+    def upsert_session(self, uid: int, phone: str, session_file: str):
+        payload = {
+            "user_id": uid,
+            "phone": phone,
+            "session_file": session_file,
+            "is_active": True,
+            "created_at": now_iso(),
+        }
+        try:
+            self.table("user_sessions").upsert(payload, on_conflict="user_id").execute()
+        except Exception:
+            existing = self.table("user_sessions").select("user_id").eq("user_id", uid).limit(1).execute()
+            if existing and existing.data:
+                self.table("user_sessions").update(payload).eq("user_id", uid).execute()
+            else:
+                self.table("user_sessions").insert(payload).execute()
+
+    def delete_session(self, uid: int):
+        self.table("user_sessions").delete().eq("user_id", uid).execute()
+
+    def recent_sessions(self, limit: int) -> List[dict]:
+        res = (
+            self.table("user_sessions")
+            .select("user_id,session_file,created_at")
+            .eq("is_active", True)
+            .order("created_at", desc=True)
+            .limit(limit)
+            .execute()
+        )
+        return res.data or []
+
+    def session_owners(self, after: int, limit: int) -> List[dict]:
+        res = (
+            self.table("user_sessions")
+            .select("user_id,session_file")
+            .eq("is_active", True)
+            .gt("user_id", after)
+            .order("user_id")
+            .limit(limit)
+            .execute()
+        )
+        return res.data or []
+
+    def load_auth(self, session_key: str) -> Optional[dict]:
+        res = (
+            self.table("telethon_sessions")
+            .select("dc_id,server_address,port,auth_key,takeout_id")
+            .eq("session_key", session_key)
+            .limit(1)
+            .execute()
+        )
+        if not res.data:
+            return None
+        row = dict(res.data[0])
+        row["auth_key"] = base64.b64decode(row["auth_key"]) if row.get("auth_key") else None
+        return row
+
+    def save_auth(self, session_key: str, auth: dict):
+        key = auth.get("auth_key")
+        self.table("telethon_sessions").upsert(
+            {
+                "session_key": session_key,
+                **auth,
+                "auth_key": base64.b64encode(key).decode() if key else None,
+                "updated_at": now_iso(),
+            },
+            on_conflict="session_key",
+        ).execute()
+
+    def delete_auth(self, session_key: str):
+        self.table("telethon_sessions").delete().eq("session_key", session_key).execute()
+        self.table("telethon_peers").delete().eq("session_key", session_key).execute()
+
+    def load_peers(self, session_key: str) -> Dict[int, int]:
+        peers: Dict[int, int] = {}
+        after = None
+        while True:
+            q = self.table("telethon_peers").select("peer_id,access_hash").eq("session_key", session_key)
+            if after is not None:
+                q = q.gt("peer_id", after)
+            rows = q.order("peer_id").limit(ROW_PAGE).execute().data or []
+            peers.update((int(r["peer_id"]), int(r["access_hash"])) for r in rows)
+            if len(rows) < ROW_PAGE:
+                return peers
+            after = rows[-1]["peer_id"]
+
+    def save_peers(self, session_key: str, peers: Dict[int, int]):
+        rows = [{"session_key": session_key, "peer_id": p, "access_hash": h} for p, h in peers.items()]
+        for i in range(0, len(rows), ROW_PAGE):
+            self.table("telethon_peers").upsert(rows[i : i + ROW_PAGE], on_conflict="session_key,peer_id").execute()
+
+    # ---- invite links ----
+    def save_invite_link(self, uid: int, chat_id: int, chat_title: str, link: str, link_type: str) -> Optional[dict]:
+        fields = {"chat_title": chat_title, "link_type": link_type, "is_active": True, "created_at": now_iso()}
+        # PostgREST upserts take no WHERE: refresh a live row, else insert one (DO NOTHING on conflict).
+        # A tombstoned row matches neither write, so it is never revived.
+        for _ in range(2):  # second round: the row was inserted by someone else in between
+            res = (
+                self.table("invite_links")
+                .update(fields)
+                .eq("user_id", uid)
+                .eq("chat_id", chat_id)
+                .eq("invite_link", link)
+                .is_("removed_at", "null")
+                .execute()
+            )
+            if res.data:
+                return res.data[0]
+            res = self.table("invite_links").upsert(
+                {"user_id": uid, "chat_id": chat_id, "invite_link": link, **fields},
+                on_conflict="user_id,chat_id,invite_link",
+                ignore_duplicates=True,
+            ).execute()
+            if res.data:
+                return res.data[0]
+        raise RuntimeError(REMOVED_LINK_MSG)
+
+    def list_invite_links(self, uid: int) -> List[dict]:
+        res = (
+            self.table("invite_links")
+            .select("*")
+            .eq("user_id", uid)
+            .eq("is_active", True)
+            .order("created_at", desc=True)
+            .execute()
+        )
+        return res.data or []
+
+    def chat_links(self, chat_id: int) -> List[dict]:
+        res = (
+            self.table("invite_links")
+            .select("*")  # frozen_at only exists once migrations/0005 is applied
+            .eq("chat_id", chat_id)
+            .eq("is_active", True)
+            .execute()
+        )
+        return [{"id": r["id"], "user_id": r["user_id"], "frozen_at": r.get("frozen_at")} for r in (res.data or [])]
+
+    def delete_links(self, uid: int, link_ids: List[int]):
+        # 0) archived join rows: bucket objects + manifests
+        archives: List[dict] = []
+        if self.archives:
+            archives = (
+                self.table("join_archives")
+                .select("id,object_name")
+                .eq("user_id", uid)
+                .in_("invite_link_id", link_ids)
+                .execute()
+            ).data or []
+        if archives:
+            if self.has_objects:
+                self.remove_objects([a["object_name"] for a in archives])
+            self.table("join_archives").delete().in_("id", [a["id"] for a in archives]).execute()
+
+        # 1) delete join rows
+        self.table("joins") \
+            .delete() \
+            .eq("user_id", uid) \
+            .in_("invite_link_id", link_ids) \
+            .execute()
+
+        # 2) delete invite_links rows
+        self.table("invite_links") \
+            .delete() \
+            .eq("user_id", uid) \
+            .in_("id", link_ids) \
+            .execute()
+
+    def set_link_counters(self, link_id: int, usage: int, requested: int):
+        self.table("invite_links").update(
+            {"usage_count": usage, "requested_count": requested}
+        ).eq("id", link_id).execute()
+
+    def freeze_links(self, uid: int, link_ids: List[int], reason: str):
+        self.table("invite_links").update(
+            {"frozen_at": now_iso(), "frozen_reason": reason}
+        ).eq("user_id", uid).in_("id", link_ids).execute()
+
+    def tombstone_links(self, uid: int, link_ids: List[int]):
+        self.table("invite_links").update(
+            {"is_active": False, "removed_at": now_iso()}
+        ).eq("user_id", uid).in_("id", link_ids).execute()
+
+    def tombstoned_links(self, limit: int) -> List[dict]:
+        res = (
+            self.table("invite_links")
+            .select("*")  # reaped_rows only exists once migrations/0006 is applied
+            .not_.is_("removed_at", "null")
+            .order("id")
+            .limit(limit)
+            .execute()
+        )
+        return [{"id": r["id"], "user_id": r["user_id"], "reaped_rows": r.get("reaped_rows")} for r in (res.data or [])]
+
+    def link_removed(self, link_id: int) -> bool:
+        res = self.table("invite_links").select("id,removed_at").eq("id", link_id).execute()
+        return bool(res.data and res.data[0].get("removed_at"))
+
+    def delete_join_chunk(self, uid: int, invite_link_id: int, limit: int) -> int:
+        # PostgREST deletes have no LIMIT: pick the ids, then delete exactly those
+        ids = [
+            r["id"] for r in (
+                self.table("joins")
+                .select("id")
+                .eq("user_id", uid)
+                .eq("invite_link_id", invite_link_id)
+                .limit(limit)
+                .execute()
+            ).data or []
+        ]
+        if ids:
+            self.table("joins").delete().in_("id", ids).execute()
+        return len(ids)
+
+    def set_link_reaped(self, link_id: int, rows: int):
+        self.table("invite_links").update({"reaped_rows": rows}).eq("id", link_id).execute()
+
+    # ---- joins ----
+    def upsert_joins(self, rows: List[dict]):
+        from postgrest.types import ReturnMethod  # ships with supabase-py
+
+        self.table("joins").upsert(
+            rows,
+            on_conflict="user_id,chat_id,invite_link_id,joined_user_id",
+            returning=ReturnMethod.minimal,  # no row echo: writes cost no response payload
+        ).execute()
+
+    def fetch_joins(self, uid, invite_link_id, since=None, until=None,
+                    after=None, limit=20, desc=True, columns="*") -> List[dict]:
+        q = (
+            self.table("joins")
+            .select(columns)
+            .eq("user_id", uid)
+            .eq("invite_link_id", invite_link_id)
+        )
+        if since:
+            q = q.gte("joined_at", since.isoformat())
+        if until:
+            q = q.lte("joined_at", until.isoformat())
+        if after:
+            q = q.or_(_keyset_filter(after, desc))
+
+        q = q.order("joined_at", desc=desc).order("id", desc=desc).limit(limit)
+        return q.execute().data or []
+
+    def latest_join(self, uid: int, chat_id: int, joined_user_id: int) -> Optional[dict]:
+        jr = (
+            self.table("joins")
+            .select("id,invite_link_id,joined_at,left_at")
+            .eq("user_id", uid)
+            .eq("chat_id", chat_id)
+            .eq("joined_user_id", joined_user_id)
+            .order("joined_at", desc=True)
+            .limit(1)
+            .execute()
+        )
+        return jr.data[0] if jr.data else None
+
+    def latest_joins(self, uid: int, chat_id: int, joined_user_ids: List[int]) -> List[dict]:
+        out = []
+        for i in range(0, len(joined_user_ids), 200):  # keep the in.() filter URL short
+            chunk = joined_user_ids[i:i + 200]
+            rows = (
+                self.table("joins")
+                .select("id,invite_link_id,joined_user_id,joined_at,left_at")
+                .eq("user_id", uid)
+                .eq("chat_id", chat_id)
+                .in_("joined_user_id", chunk)
+                .order("joined_user_id")
+                .order("joined_at", desc=True)
+                .limit(ROW_PAGE)
+                .execute()
+            ).data or []
+            seen = set()
+            for r in rows:  # newest row of each member comes first
+                if r["joined_user_id"] not in seen:
+                    seen.add(r["joined_user_id"])
+                    out.append(r)
+            if len(rows) == ROW_PAGE:  # cut off: members past the last one returned may still have rows
+                last = rows[-1]["joined_user_id"]
+                out.extend(self.latest_joins(uid, chat_id, [j for j in chunk if j > last]))
+        return out
+
+    def mark_left(self, row_id: int, reason: str, when: Optional[str] = None):
+        when = when or now_iso()
+        self.table("joins").update({
+            "left_at": when,
+            "left_reason": reason,
+            "left_seen_at": when,
+        }).eq("id", row_id).execute()
+
+    def mark_left_rows(self, row_ids: List[int], reason: str, when: Optional[str] = None):
+        when = when or now_iso()
+        for i in range(0, len(row_ids), 200):  # keep the in.() filter URL short
+            self.table("joins").update({
+                "left_at": when,
+                "left_reason": reason,
+                "left_seen_at": when,
+            }).in_("id", row_ids[i:i + 200]).is_("left_at", "null").execute()
+
+    def mark_left_members(self, uid, invite_link_id, joined_user_ids, reason, when=None):
+        when = when or now_iso()
+        for i in range(0, len(joined_user_ids), 200):  # keep the in.() filter URL short
+            self.table("joins").update({
+                "left_at": when,
+                "left_reason": reason,
+                "left_seen_at": when,
+            }).eq("user_id", uid).eq("invite_link_id", invite_link_id) \
+                .in_("joined_user_id", joined_user_ids[i:i + 200]) \
+                .is_("left_at", "null").execute()
+
+    def mark_member_left(self, chat_id, joined_user_id, reason, when=None) -> List[dict]:
+        if not self.rpc:
+            return super().mark_member_left(chat_id, joined_user_id, reason, when)
+        res = self.client.rpc("mark_member_left", {
+            "p_chat_id": chat_id,
+            "p_joined_user_id": joined_user_id,
+            "p_reason": reason,
+            "p_when": when or now_iso(),
+        }).execute()
+        return res.data or []
+
+    def mark_members_left(self, chat_id, leaves) -> List[dict]:
+        if not self.rpc:
+            return super().mark_members_left(chat_id, leaves)
+        res = self.client.rpc("mark_members_left", {
+            "p_chat_id": chat_id,
+            "p_joined_user_ids": [lv["joined_user_id"] for lv in leaves],
+            "p_reasons": [lv["reason"] for lv in leaves],
+            "p_whens": [lv.get("when") or now_iso() for lv in leaves],
+        }).execute()
+        return res.data or []
+
+    # ---- counts ----
+    def _count(self, uid, invite_link_id, since, until, left_only: bool) -> int:
+        q = (
+            self.table("joins")
+            .select("id", count="exact")
+            .eq("user_id", uid)
+            .eq("invite_link_id", invite_link_id)
+        )
+        if left_only:
+            q = q.not_.is_("left_at", "null")
+        if since:
+            q = q.gte("joined_at", since.isoformat())
+        if until:
+            q = q.lte("joined_at", until.isoformat())
+        return _count_from_response(q.execute())
+
+    def count_joins(self, uid, invite_link_id, since=None, until=None) -> int:
+        return self._count(uid, invite_link_id, since, until, left_only=False)
+
+    def count_left(self, uid, invite_link_id, since=None, until=None) -> int:
+        return self._count(uid, invite_link_id, since, until, left_only=True)
+
+    # ---- cold archive ----
+    def archivable_joins(self, uid, invite_link_id, before, limit, after_id=0) -> List[dict]:
+        return (
+            self.table("joins")
+            .select("*")
+            .eq("user_id", uid)
+            .eq("invite_link_id", invite_link_id)
+            .lt("left_at", before.isoformat())
+            .gt("id", after_id)
+            .order("id")
+            .limit(limit)
+            .execute()
+        ).data or []
+
+    def add_archive(self, row: dict) -> dict:
+        res = self.table("join_archives").insert({**row, "state": "pending", "created_at": now_iso()}).execute()
+        return res.data[0]
+
+    def finish_archive(self, archive_id: int, row_ids: List[int]):
+        for i in range(0, len(row_ids), 200):  # keep the in.() filter URL short
+            self.table("joins").delete().in_("id", row_ids[i:i + 200]).execute()
+        self.table("join_archives").update({"state": "done"}).eq("id", archive_id).execute()
+
+    def list_archives(self, uid: int, invite_link_id: int) -> List[dict]:
+        return (
+            self.table("join_archives")
+            .select("*")
+            .eq("user_id", uid)
+            .eq("invite_link_id", invite_link_id)
+            .eq("state", "done")
+            .order("min_joined")
+            .execute()
+        ).data or []
+
+    def pending_archives(self) -> List[dict]:
+        return (self.table("join_archives").select("*").eq("state", "pending").execute()).data or []
+
+    # ---- files ----
+    @property
+    def has_objects(self) -> bool:
+        return bool(self.bucket)
+
+    def put_object(self, object_name: str, data: bytes, content_type: str):
+        if not self.bucket:
+            raise RuntimeError("SUPABASE_BUCKET is not set")
+        self.client.storage.from_(self.bucket).upload(
+            object_name, data, {"content-type": content_type, "upsert": "true"},
+        )
+
+    def get_object(self, object_name: str) -> bytes:
+        if not self.bucket:
+            raise RuntimeError("SUPABASE_BUCKET is not set")
+        return self.client.storage.from_(self.bucket).download(object_name)
+
+    def remove_objects(self, object_names: List[str]):
+        if not self.bucket:
+            raise RuntimeError("SUPABASE_BUCKET is not set")
+        self.client.storage.from_(self.bucket).remove(object_names)
+
+    def upload_file(self, path: str, object_name: str, content_type: str) -> str:
+        if not self.bucket:
+            raise RuntimeError("SUPABASE_BUCKET is not set")
+        bucket = self.client.storage.from_(self.bucket)
+        bucket.upload(object_name, path, {"content-type": content_type, "upsert": "true"})
+        signed = bucket.create_signed_url(object_name, 7 * 24 * 3600)
+        return signed.get("signedURL") or signed.get("signedUrl") or object_name
+
+
+# ---------------- SQLITE ----------------
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS user_sessions (
+    user_id      INTEGER PRIMARY KEY,
+    phone        TEXT,
+    session_file TEXT,
+    is_active    INTEGER NOT NULL DEFAULT 1,
+    created_at   TEXT
+);
+CREATE INDEX IF NOT EXISTS user_sessions_recent_idx ON user_sessions (created_at) WHERE is_active = 1;
+
+CREATE TABLE IF NOT EXISTS telethon_sessions (
+    session_key    TEXT PRIMARY KEY,
+    dc_id          INTEGER NOT NULL,
+    server_address TEXT,
+    port           INTEGER,
+    auth_key       BLOB,
+    takeout_id     INTEGER,
+    updated_at     TEXT
+);
+
+CREATE TABLE IF NOT EXISTS telethon_peers (
+    session_key TEXT NOT NULL,
+    peer_id     INTEGER NOT NULL,
+    access_hash INTEGER NOT NULL,
+    PRIMARY KEY (session_key, peer_id)
+);
+
+CREATE TABLE IF NOT EXISTS invite_links (
+    id          INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id     INTEGER NOT NULL,
+    chat_id     INTEGER NOT NULL,
+    chat_title  TEXT,
+    invite_link TEXT NOT NULL,
+    link_type   TEXT NOT NULL DEFAULT 'normal',
+    is_active   INTEGER NOT NULL DEFAULT 1,
+    created_at  TEXT,
+    usage_count     INTEGER,
+    requested_count INTEGER,
+    frozen_at       TEXT,
+    frozen_reason   TEXT,
+    reaped_rows     INTEGER,
+    removed_at      TEXT,
+    UNIQUE (user_id, chat_id, invite_link)
+);
+CREATE INDEX IF NOT EXISTS invite_links_owner_idx ON invite_links (user_id, is_active, created_at);
+CREATE INDEX IF NOT EXISTS invite_links_chat_idx ON invite_links (chat_id) WHERE is_active = 1;
+
+CREATE TABLE IF NOT EXISTS joins (
+    id             INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id        INTEGER NOT NULL,
+    chat_id        INTEGER NOT NULL,
+    invite_link_id INTEGER NOT NULL,
+    joined_user_id INTEGER NOT NULL,
+    joined_at      TEXT,
+    left_at        TEXT,
+    left_reason    TEXT,
+    left_seen_at   TEXT,
+    UNIQUE (user_id, chat_id, invite_link_id, joined_user_id)
+);
+CREATE INDEX IF NOT EXISTS joins_link_time_idx ON joins (user_id, invite_link_id, joined_at, id);
+CREATE INDEX IF NOT EXISTS joins_link_left_idx ON joins (user_id, invite_link_id, joined_at) WHERE left_at IS NOT NULL;
+CREATE INDEX IF NOT EXISTS joins_member_idx ON joins (user_id, chat_id, joined_user_id, joined_at);
+CREATE INDEX IF NOT EXISTS joins_link_open_idx ON joins (user_id, invite_link_id, joined_user_id) WHERE left_at IS NULL;
+CREATE INDEX IF NOT EXISTS joins_link_left_at_idx ON joins (user_id, invite_link_id, left_at) WHERE left_at IS NOT NULL;
+
+CREATE TABLE IF NOT EXISTS join_archives (
+    id             INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id        INTEGER NOT NULL,
+    chat_id        INTEGER NOT NULL,
+    invite_link_id INTEGER NOT NULL,
+    object_name    TEXT NOT NULL,
+    rows           INTEGER NOT NULL,
+    left_rows      INTEGER NOT NULL,
+    min_joined     INTEGER NOT NULL,
+    max_joined     INTEGER NOT NULL,
+    daily          TEXT,
+    state          TEXT NOT NULL DEFAULT 'pending',
+    created_at     TEXT
+);
+CREATE INDEX IF NOT EXISTS join_archives_link_idx ON join_archives (user_id, invite_link_id, state);
+CREATE INDEX IF NOT EXISTS join_archives_pending_idx ON join_archives (id) WHERE state = 'pending';
+"""
+
+ARCHIVE_COLUMNS = ("user_id", "chat_id", "invite_link_id", "object_name", "rows", "left_rows",
+                   "min_joined", "max_joined", "daily")
+
+JOIN_COLUMNS = ("id", "user_id", "chat_id", "invite_link_id", "joined_user_id",
+                "joined_at", "left_at", "left_reason", "left_seen_at")
+
+
+class SqliteStorage(Storage):
+    """
+    Embedded single-file backend.
+    WAL mode (readers never block the writer), covering indexes for the
+    count / page queries and executemany for bulk join upserts.
+    """
+
+    name = "sqlite"
+    archives = True
+
+    def __init__(self, path: str):
+        self.path = path
+        self.objects_dir = os.path.splitext(path)[0] + "_objects"  # local stand-in for the bucket
+        self.db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.db.row_factory = sqlite3.Row
+        self.lock = threading.Lock()  # export / page fetches run in worker threads
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute("PRAGMA foreign_keys=OFF")
+        self.db.executescript(SQLITE_SCHEMA)
+        self._add_missing_columns("invite_links", {
+            "usage_count": "INTEGER", "requested_count": "INTEGER", "frozen_at": "TEXT", "frozen_reason": "TEXT",
+            "reaped_rows": "INTEGER", "removed_at": "TEXT",
+        })
+        self.db.execute("DROP INDEX IF EXISTS invite_links_removed_idx")  # is_active = 0, before removed_at
+        self.db.execute(
+            "CREATE INDEX IF NOT EXISTS invite_links_removed_at_idx ON invite_links (id) WHERE removed_at IS NOT NULL"
+        )
+
+    def _add_missing_columns(self, table: str, columns: Dict[str, str]):
+        """CREATE TABLE IF NOT EXISTS keeps old tables as they were; add newer columns."""
+        have = {r[1] for r in self.db.execute(f"PRAGMA table_info({table})")}
+        for name, decl in columns.items():
+            if name not in have:
+                self.db.execute(f"ALTER TABLE {table} ADD COLUMN {name} {decl}")
+
+    def _all(self, sql: str, args: tuple = ()) -> List[dict]:
+        with self.lock:
+            return [dict(r) for r in self.db.execute(sql, args).fetchall()]
+
+    def _one(self, sql: str, args: tuple = ()) -> Optional[dict]:
+        with self.lock:
+            r = self.db.execute(sql, args).fetchone()
+        return dict(r) if r else None
+
+    def _exec(self, sql: str, args: tuple = ()):
+        with self.lock:
+            self.db.execute(sql, args)
+
+    @staticmethod
+    def _bool_row(r: Optional[dict]) -> Optional[dict]:
+        if r and "is_active" in r:
+            r["is_active"] = bool(r["is_active"])
+        return r
+
+    # ---- sessions ----
+    def get_session(self, uid: int) -> Optional[dict]:
+        return self._bool_row(self._one("SELECT * FROM user_sessions WHERE user_id = ?", (uid,)))
+
+    def upsert_session(self, uid: int, phone: str, session_file: str):
+        self._exec(
+            "INSERT INTO user_sessions (user_id, phone, session_file, is_active, created_at) "
+            "VALUES (?, ?, ?, 1, ?) "
+            "ON CONFLICT (user_id) DO UPDATE SET phone = excluded.phone, "
+            "session_file = excluded.session_file, is_active = 1, created_at = excluded.created_at",
+            (uid, phone, session_file, now_iso()),
+        )
+
+    def delete_session(self, uid: int):
+        self._exec("DELETE FROM user_sessions WHERE user_id = ?", (uid,))
+
+    def recent_sessions(self, limit: int) -> List[dict]:
+        return self._all(
+            "SELECT user_id, session_file, created_at FROM user_sessions "
+            "WHERE is_active = 1 ORDER BY created_at DESC LIMIT ?",
+            (limit,),
+        )
+
+    def session_owners(self, after: int, limit: int) -> List[dict]:
+        return self._all(
+            "SELECT user_id, session_file FROM user_sessions WHERE is_active = 1 AND user_id > ? "
+            "ORDER BY user_id LIMIT ?",
+            (after, limit),
+        )
+
+    def load_auth(self, session_key: str) -> Optional[dict]:
+        return self._one(
+            "SELECT dc_id, server_address, port, auth_key, takeout_id FROM telethon_sessions WHERE session_key = ?",
+            (session_key,),
+        )
+
+    def save_auth(self, session_key: str, auth: dict):
+        self._exec(
+            "INSERT INTO telethon_sessions (session_key, dc_id, server_address, port, auth_key, takeout_id, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT (session_key) DO UPDATE SET dc_id = excluded.dc_id, "
+            "server_address = excluded.server_address, port = excluded.port, "
+            "auth_key = excluded.auth_key, takeout_id = excluded.takeout_id, updated_at = excluded.updated_at",
+            (session_key, auth["dc_id"], auth["server_address"], auth["port"], auth["auth_key"],
+             auth["takeout_id"], now_iso()),
+        )
+
+    def delete_auth(self, session_key: str):
+        self._exec("DELETE FROM telethon_sessions WHERE session_key = ?", (session_key,))
+        self._exec("DELETE FROM telethon_peers WHERE session_key = ?", (session_key,))
+
+    def load_peers(self, session_key: str) -> Dict[int, int]:
+        rows = self._all("SELECT peer_id, access_hash FROM telethon_peers WHERE session_key = ?", (session_key,))
+        return {r["peer_id"]: r["access_hash"] for r in rows}
+
+    def save_peers(self, session_key: str, peers: Dict[int, int]):
+        with self.lock:
+            self.db.executemany(
+                "INSERT INTO telethon_peers (session_key, peer_id, access_hash) VALUES (?, ?, ?) "
+                "ON CONFLICT (session_key, peer_id) DO UPDATE SET access_hash = excluded.access_hash",
+                [(session_key, p, h) for p, h in peers.items()],
+            )
+
+    # ---- invite links ----
+    def save_invite_link(self, uid: int, chat_id: int, chat_title: str, link: str, link_type: str) -> Optional[dict]:
+        self._exec(
+            "INSERT INTO invite_links (user_id, chat_id, chat_title, invite_link, link_type, is_active, created_at) "
+            "VALUES (?, ?, ?, ?, ?, 1, ?) "
+            "ON CONFLICT (user_id, chat_id, invite_link) DO UPDATE SET chat_title = excluded.chat_title, "
+            "link_type = excluded.link_type, is_active = 1, created_at = excluded.created_at "
+            "WHERE invite_links.removed_at IS NULL",
+            (uid, chat_id, chat_title, link, link_type, now_iso()),
+        )
+        row = self._bool_row(self._one(
+            "SELECT * FROM invite_links WHERE user_id = ? AND chat_id = ? AND invite_link = ?",
+            (uid, chat_id, link),
+        ))
+        if row and row.get("removed_at"):
+            raise RuntimeError(REMOVED_LINK_MSG)
+        return row
+
+    def list_invite_links(self, uid: int) -> List[dict]:
+        rows = self._all(
+            "SELECT * FROM invite_links WHERE user_id = ? AND is_active = 1 ORDER BY created_at DESC",
+            (uid,),
+        )
+        return [self._bool_row(r) for r in rows]
+
+    def chat_links(self, chat_id: int) -> List[dict]:
+        return self._all(
+            "SELECT id, user_id, frozen_at FROM invite_links WHERE chat_id = ? AND is_active = 1",
+            (chat_id,),
+        )
+
+    def delete_links(self, uid: int, link_ids: List[int]):
+        marks = ",".join("?" * len(link_ids))
+        with self.lock:
+            self.db.execute("BEGIN")
+            try:
+                archived = self.db.execute(
+                    f"SELECT object_name FROM join_archives WHERE user_id = ? AND invite_link_id IN ({marks})",
+                    (uid, *link_ids),
+                ).fetchall()
+                self.db.execute(
+                    f"DELETE FROM join_archives WHERE user_id = ? AND invite_link_id IN ({marks})",
+                    (uid, *link_ids),
+                )
+                self.db.execute(
+                    f"DELETE FROM joins WHERE user_id = ? AND invite_link_id IN ({marks})",
+                    (uid, *link_ids),
+                )
+                self.db.execute(
+                    f"DELETE FROM invite_links WHERE user_id = ? AND id IN ({marks})",
+                    (uid, *link_ids),
+                )
+                self.db.execute("COMMIT")
+            except Exception:
+                self.db.execute("ROLLBACK")
+                raise
+        self.remove_objects([r["object_name"] for r in archived])
+
+    def set_link_counters(self, link_id: int, usage: int, requested: int):
+        self._exec(
+            "UPDATE invite_links SET usage_count = ?, requested_count = ? WHERE id = ?",
+            (usage, requested, link_id),
+        )
+
+    def freeze_links(self, uid: int, link_ids: List[int], reason: str):
+        marks = ",".join("?" * len(link_ids))
+        self._exec(
+            f"UPDATE invite_links SET frozen_at = ?, frozen_reason = ? WHERE user_id = ? AND id IN ({marks})",
+            (now_iso(), reason, uid, *link_ids),
+        )
+
+    def tombstone_links(self, uid: int, link_ids: List[int]):
+        marks = ",".join("?" * len(link_ids))
+        self._exec(
+            f"UPDATE invite_links SET is_active = 0, removed_at = ? WHERE user_id = ? AND id IN ({marks})",
+            (now_iso(), uid, *link_ids),
+        )
+
+    def tombstoned_links(self, limit: int) -> List[dict]:
+        return self._all(
+            "SELECT id, user_id, reaped_rows FROM invite_links WHERE removed_at IS NOT NULL ORDER BY id LIMIT ?",
+            (limit,),
+        )
+
+    def link_removed(self, link_id: int) -> bool:
+        return self._one("SELECT 1 FROM invite_links WHERE id = ? AND removed_at IS NOT NULL", (link_id,)) is not None
+
+    def delete_join_chunk(self, uid: int, invite_link_id: int, limit: int) -> int:
+        with self.lock:
+            cur = self.db.execute(
+                "DELETE FROM joins WHERE id IN "
+                "(SELECT id FROM joins WHERE user_id = ? AND invite_link_id = ? LIMIT ?)",
+                (uid, invite_link_id, limit),
+            )
+            return cur.rowcount
+
+    def set_link_reaped(self, link_id: int, rows: int):
+        self._exec("UPDATE invite_links SET reaped_rows = ? WHERE id = ?", (rows, link_id))
+
+    # ---- joins ----
+    def upsert_joins(self, rows: List[dict]):
+        args = [
+            (
+                r["user_id"], r["chat_id"], r["invite_link_id"], r["joined_user_id"],
+                utc_iso(r.get("joined_at")), utc_iso(r.get("left_at")),
+                r.get("left_reason"), utc_iso(r.get("left_seen_at")),
+            )
+            for r in rows
+        ]
+        with self.lock:
+            self.db.execute("BEGIN")
+            try:
+                self.db.executemany(
+                    "INSERT INTO joins (user_id, chat_id, invite_link_id, joined_user_id, "
+                    "joined_at, left_at, left_reason, left_seen_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?) "
+                    "ON CONFLICT (user_id, chat_id, invite_link_id, joined_user_id) DO UPDATE SET "
+                    "joined_at = excluded.joined_at, left_at = excluded.left_at, "
+                    "left_reason = excluded.left_reason, left_seen_at = excluded.left_seen_at",
+                    args,
+                )
+                self.db.execute("COMMIT")
+            except Exception:
+                self.db.execute("ROLLBACK")
+                raise
+
+    def fetch_joins(self, uid, invite_link_id, since=None, until=None,
+                    after=None, limit=20, desc=True, columns="*") -> List[dict]:
+        if columns.strip() != "*":
+            cols = [c.strip() for c in columns.split(",")]
+            bad = [c for c in cols if c not in JOIN_COLUMNS]
+            if bad:
+                raise ValueError(f"unknown joins column(s): {bad}")
+            columns = ", ".join(cols)
+        sql = f"SELECT {columns} FROM joins WHERE user_id = ? AND invite_link_id = ?"
+        args: List[Any] = [uid, invite_link_id]
+        if since:
+            sql += " AND joined_at >= ?"
+            args.append(utc_iso(since))
+        if until:
+            sql += " AND joined_at <= ?"
+            args.append(utc_iso(until))
+        if after:
+            op = "<" if desc else ">"
+            sql += f" AND (joined_at {op} ? OR (joined_at = ? AND id {op} ?))"
+            args += [after[0], after[0], int(after[1])]
+        order = "DESC" if desc else "ASC"
+        sql += f" ORDER BY joined_at {order}, id {order} LIMIT ?"
+        args.append(limit)
+        return self._all(sql, tuple(args))
+
+    def latest_join(self, uid: int, chat_id: int, joined_user_id: int) -> Optional[dict]:
+        return self._one(
+            "SELECT id, invite_link_id, joined_at, left_at FROM joins WHERE user_id = ? AND chat_id = ? AND joined_user_id = ? "
+            "ORDER BY joined_at DESC LIMIT 1",
+            (uid, chat_id, joined_user_id),
+        )
+
+    def latest_joins(self, uid: int, chat_id: int, joined_user_ids: List[int]) -> List[dict]:
+        out = []
+        for i in range(0, len(joined_user_ids), 500):  # sqlite bound-parameter limit
+            chunk = joined_user_ids[i:i + 500]
+            rows = self._all(
+                "SELECT id, invite_link_id, joined_user_id, joined_at, left_at FROM joins "
+                f"WHERE user_id = ? AND chat_id = ? AND joined_user_id IN ({','.join('?' * len(chunk))}) "
+                "ORDER BY joined_user_id, joined_at DESC",
+                (uid, chat_id, *chunk),
+            )
+            seen = set()
+            for r in rows:
+                if r["joined_user_id"] not in seen:
+                    seen.add(r["joined_user_id"])
+                    out.append(r)
+        return out
+
+    def mark_left(self, row_id: int, reason: str, when: Optional[str] = None):
+        when = utc_iso(when or now_iso())
+        self._exec(
+            "UPDATE joins SET left_at = ?, left_reason = ?, left_seen_at = ? WHERE id = ?",
+            (when, reason, when, row_id),
+        )
+
+    def mark_left_rows(self, row_ids: List[int], reason: str, when: Optional[str] = None):
+        when = utc_iso(when or now_iso())
+        with self.lock:
+            self.db.execute("BEGIN")
+            try:
+                self.db.executemany(
+                    "UPDATE joins SET left_at = ?, left_reason = ?, left_seen_at = ? WHERE id = ? AND left_at IS NULL",
+                    [(when, reason, when, i) for i in row_ids],
+                )
+                self.db.execute("COMMIT")
+            except Exception:
+                self.db.execute("ROLLBACK")
+                raise
+
+    def mark_left_members(self, uid, invite_link_id, joined_user_ids, reason, when=None):
+        when = utc_iso(when or now_iso())
+        with self.lock:
+            self.db.execute("BEGIN")
+            try:
+                self.db.executemany(
+                    "UPDATE joins SET left_at = ?, left_reason = ?, left_seen_at = ? "
+                    "WHERE user_id = ? AND invite_link_id = ? AND joined_user_id = ? AND left_at IS NULL",
+                    [(when, reason, when, uid, invite_link_id, j) for j in joined_user_ids],
+                )
+                self.db.execute("COMMIT")
+            except Exception:
+                self.db.execute("ROLLBACK")
+                raise
+
+    # ---- counts ----
+    def _count(self, uid, invite_link_id, since, until, left_only: bool) -> int:
+        sql = "SELECT COUNT(*) FROM joins WHERE user_id = ? AND invite_link_id = ?"
+        args: List[Any] = [uid, invite_link_id]
+        if left_only:
+            sql += " AND left_at IS NOT NULL"
+        if since:
+            sql += " AND joined_at >= ?"
+            args.append(utc_iso(since))
+        if until:
+            sql += " AND joined_at <= ?"
+            args.append(utc_iso(until))
+        with self.lock:
+            return int(self.db.execute(sql, tuple(args)).fetchone()[0])
+
+    def count_joins(self, uid, invite_link_id, since=None, until=None) -> int:
+        return self._count(uid, invite_link_id, since, until, left_only=False)
+
+    def count_left(self, uid, invite_link_id, since=None, until=None) -> int:
+        return self._count(uid, invite_link_id, since, until, left_only=True)
+
+    # ---- cold archive ----
+    def archivable_joins(self, uid, invite_link_id, before, limit, after_id=0) -> List[dict]:
+        return self._all(
+            "SELECT * FROM joins WHERE user_id = ? AND invite_link_id = ? AND left_at < ? AND id > ? "
+            "ORDER BY id LIMIT ?",
+            (uid, invite_link_id, utc_iso(before), after_id, limit),
+        )
+
+    def add_archive(self, row: dict) -> dict:
+        with self.lock:
+            cur = self.db.execute(
+                f"INSERT INTO join_archives ({', '.join(ARCHIVE_COLUMNS)}, state, created_at) "
+                f"VALUES ({', '.join('?' * len(ARCHIVE_COLUMNS))}, 'pending', ?)",
+                (*(row[c] for c in ARCHIVE_COLUMNS), now_iso()),
+            )
+            return dict(row, id=cur.lastrowid, state="pending")
+
+    def finish_archive(self, archive_id: int, row_ids: List[int]):
+        with self.lock:
+            self.db.execute("BEGIN")
+            try:
+                self.db.executemany("DELETE FROM joins WHERE id = ?", [(i,) for i in row_ids])
+                self.db.execute("UPDATE join_archives SET state = 'done' WHERE id = ?", (archive_id,))
+                self.db.execute("COMMIT")
+            except Exception:
+                self.db.execute("ROLLBACK")
+                raise
+
+    def list_archives(self, uid: int, invite_link_id: int) -> List[dict]:
+        return self._all(
+            "SELECT * FROM join_archives WHERE user_id = ? AND invite_link_id = ? AND state = 'done' "
+            "ORDER BY min_joined",
+            (uid, invite_link_id),
+        )
+
+    def pending_archives(self) -> List[dict]:
+        return self._all("SELECT * FROM join_archives WHERE state = 'pending'")
+
+    # ---- files (local directory next to the db file) ----
+    @property
+    def has_objects(self) -> bool:
+        return True
+
+    def _object_path(self, object_name: str) -> str:
+        path = os.path.normpath(os.path.join(self.objects_dir, object_name))
+        if not path.startswith(os.path.normpath(self.objects_dir) + os.sep):
+            raise ValueError(f"bad object name: {object_name!r}")
+        return path
+
+    def put_object(self, object_name: str, data: bytes, content_type: str):
+        path = self._object_path(object_name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + ".tmp", "wb") as f:
+            f.write(data)
+        os.replace(path + ".tmp", path)
+
+    def get_object(self, object_name: str) -> bytes:
+        with open(self._object_path(object_name), "rb") as f:
+            return f.read()
+
+    def remove_objects(self, object_names: List[str]):
+        for name in object_names:
+            try:
+                os.remove(self._object_path(name))
+            except OSError:
+                pass
+
+
+# ---------------- FACTORY ----------------
+
+def make_storage(backend: str, **cfg) -> Storage:
+    """
+    Build the configured backend.
+    supabase: needs supabase_url, supabase_key (optional bucket, archives, rpc)
+    sqlite:   needs sqlite_path
+    """
+    backend = (backend or "supabase").lower()
+    if backend == "sqlite":
+        return SqliteStorage(cfg["sqlite_path"])
+    if backend == "supabase":
+        return SupabaseStorage(
+            bucket=cfg.get("bucket", ""),
+            url=cfg["supabase_url"],
+            key=cfg["supabase_key"],
+            archives=cfg.get("archives", False),
+            rpc=cfg.get("rpc", False),
+        )
+    raise ValueError(f"Unknown STORAGE_BACKEND: {backend!r} (use 'supabase' or 'sqlite')")
@@ -0,0 +1,190 @@
+import asyncio
+import contextvars
+import sys
+import threading
+import time
+import traceback
+import weakref
+from contextlib import contextmanager
+from functools import wraps
+from typing import Dict, List, Any, Optional
+
+from metrics import REGISTRY
+
+# ---------------- TRACING ----------------
+#  One root span per bot event handler, child spans for every DB / MTProto
+#  call made inside it (contextvars follow awaits and asyncio.to_thread).
+#  Children are aggregated per name on the parent, so a sync doing 100k
+#  GetParticipant calls still costs one dict entry.
+# -----------------------------------------
+
+HANDLER_SECONDS = REGISTRY.histogram("joinbot_handler_seconds", "Bot event handler latency")
+LOOP_LAG = REGISTRY.histogram(
+    "joinbot_event_loop_lag_seconds", "Extra delay of the loop heartbeat",
+    buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0),
+)
+LOOP_BLOCKED = REGISTRY.counter("joinbot_event_loop_blocked_total", "Loop stalls over the threshold by handler")
+
+SLOW_HANDLER_SECONDS = 1.0  # log span tree of handlers slower than this (0 = never)
+
+
+class Span:
+    __slots__ = ("name", "start", "end", "parent", "children", "__weakref__")
+
+    def __init__(self, name: str, parent: Optional["Span"] = None):
+        self.name = name
+        self.start = time.perf_counter()
+        self.end: Optional[float] = None
+        self.parent = parent
+        # child name -> [count, total seconds, max seconds]
+        self.children: Dict[str, List[float]] = {}
+
+    @property
+    def duration(self) -> float:
+        return (self.end or time.perf_counter()) - self.start
+
+    def root(self) -> "Span":
+        s = self
+        while s.parent is not None:
+            s = s.parent
+        return s
+
+    def record_child(self, name: str, took: float):
+        c = self.children.get(name)
+        if c is None:
+            self.children[name] = [1, took, took]
+        else:
+            c[0] += 1
+            c[1] += took
+            if took > c[2]:
+                c[2] = took
+
+    def format(self, top: int = 12) -> str:
+        lines = [f"{self.name} {self.duration * 1000:.0f}ms"]
+        kids = sorted(self.children.items(), key=lambda kv: -kv[1][1])
+        for name, (n, total, mx) in kids[:top]:
+            lines.append(f"  ├ {name} ×{n:g} total {total * 1000:.0f}ms max {mx * 1000:.0f}ms")
+        if len(kids) > top:
+            lines.append(f"  └ … {len(kids) - top} more")
+        return "\n".join(lines)
+
+
+_current: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar("joinbot_span", default=None)
+
+# task -> root span, so the watchdog thread can name the handler that blocks
+ACTIVE: "weakref.WeakKeyDictionary[asyncio.Task, Span]" = weakref.WeakKeyDictionary()
+
+
+def current_span() -> Optional[Span]:
+    return _current.get()
+
+
+@contextmanager
+def span(name: str):
+    """Child span (no-op outside a traced handler)."""
+    parent = _current.get()
+    if parent is None:
+        yield None
+        return
+    s = Span(name, parent)
+    token = _current.set(s)
+    try:
+        yield s
+    finally:
+        _current.reset(token)
+        s.end = time.perf_counter()
+        parent.record_child(name, s.end - s.start)
+
+
+def traced_handler(fn):
+    """Wrap an async event handler in a root span (+ latency metric, slow log)."""
+    name = getattr(fn, "__name__", "handler")
+
+    @wraps(fn)
+    async def wrapper(*args, **kwargs):
+        root = Span(name)
+        token = _current.set(root)
+        task = asyncio.current_task()
+        if task is not None:
+            ACTIVE[task] = root
+        try:
+            return await fn(*args, **kwargs)
+        finally:
+            _current.reset(token)
+            root.end = time.perf_counter()
+            if task is not None:
+                ACTIVE.pop(task, None)
+            HANDLER_SECONDS.observe(root.duration, handler=name)
+            if SLOW_HANDLER_SECONDS and root.duration >= SLOW_HANDLER_SECONDS:
+                print("🐢 slow handler:\n" + root.format())
+
+    return wrapper
+
+
+# ---------------- EVENT LOOP WATCHDOG ----------------
+
+class LoopWatchdog:
+    """
+    Heartbeat task on the loop + a checker thread.
+    If the heartbeat is late by more than `threshold`, the thread grabs the
+    loop thread's stack and the running task's handler span while the loop
+    is still blocked, and logs them.
+    """
+
+    def __init__(self, threshold: float = 0.25, interval: float = 0.1):
+        self.threshold = threshold
+        self.interval = interval
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.loop_thread_id: Optional[int] = None
+        self.beat = time.monotonic()
+        self.reported_beat = 0.0
+        self.task: Optional[asyncio.Task] = None
+        self.thread: Optional[threading.Thread] = None
+        self.stopping = threading.Event()
+        self.stalls: List[Dict[str, Any]] = []  # last few stalls, newest last
+
+    def start(self, loop: Optional[asyncio.AbstractEventLoop] = None):
+        self.loop = loop or asyncio.get_event_loop()
+        self.loop_thread_id = threading.get_ident()
+        self.beat = time.monotonic()
+        self.task = self.loop.create_task(self._heartbeat())
+        self.thread = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopping.set()
+        if self.task:
+            self.task.cancel()
+
+    async def _heartbeat(self):
+        while True:
+            t0 = time.monotonic()
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            LOOP_LAG.observe(max(0.0, now - t0 - self.interval))
+            self.beat = now
+
+    def _running_handler(self) -> str:
+        try:
+            task = asyncio.current_task(self.loop)  # read-only peek from this thread
+        except Exception:
+            task = None
+        if task is None:
+            return "(loop callback)"
+        root = ACTIVE.get(task)
+        return root.name if root is not None else task.get_name()
+
+    def _watch(self):
+        while not self.stopping.wait(self.interval / 2):
+            beat = self.beat
+            lag = time.monotonic() - beat - self.interval
+            if lag < self.threshold or beat == self.reported_beat:
+                continue
+            self.reported_beat = beat  # one report per stall
+            frame = sys._current_frames().get(self.loop_thread_id)
+            stack = "".join(traceback.format_stack(frame, limit=25)) if frame else "(no frame)"
+            handler = self._running_handler()
+            LOOP_BLOCKED.inc(handler=handler)
+            self.stalls.append({"at": time.time(), "lag": lag, "handler": handler, "stack": stack})
+            del self.stalls[:-20]
+            print(f"⚠️ event loop blocked {lag:.3f}s+ in {handler}:\n{stack}")
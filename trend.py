@@ -0,0 +1,213 @@
+import io
+import json
+import math
+import sys
+import time
+from array import array
+from bisect import bisect_left, bisect_right, insort
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from typing import Any, Iterable, List, Optional, Tuple
+
+try:  # vectorized bucketing; a plain loop is used without numpy
+    import numpy as np
+except ImportError:  # pragma: no cover
+    np = None
+
+# ---------------- JOIN TRENDS ----------------
+#  Columnar (joined_at, left_at) epochs for one link, bucketed per
+#  hour / day / week in IST (UTC+5:30, like the rest of the bot), and a
+#  PNG renderer run as a worker process (`python trend.py`, JSON on
+#  stdin, PNG on stdout; matplotlib optional). Nothing here imports
+#  login.py, so the worker stays light.
+# ---------------------------------------------
+
+IST_OFFSET = 5 * 3600 + 30 * 60
+IST = timezone(timedelta(seconds=IST_OFFSET))
+
+# granularity -> (bucket seconds, buckets shown)
+GRANULARITIES = {
+    "hour": (3600, 48),
+    "day": (86400, 30),
+    "week": (7 * 86400, 26),
+}
+_WEEK_SHIFT = 3 * 86400  # 1970-01-01 was a Thursday; shift so weeks start on Monday
+
+
+def epoch_of(value: Any) -> int:
+    """datetime / ISO string -> epoch seconds (-1 when empty)."""
+    if not value:
+        return -1
+    if not isinstance(value, datetime):
+        try:
+            value = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+        except ValueError:
+            return -1
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return int(value.timestamp())
+
+
+def join_columns(rows: Iterable[dict]) -> Tuple[array, array]:
+    """joined_at / left_at epoch seconds as int64 columns (-1 = not left)."""
+    joined, left = array("q"), array("q")
+    for r in rows:
+        joined.append(epoch_of(r.get("joined_at")))
+        left.append(epoch_of(r.get("left_at")))
+    return joined, left
+
+
+def _shift(gran: str) -> int:
+    return IST_OFFSET + (_WEEK_SHIFT if gran == "week" else 0)
+
+
+def bucket_start(epoch: int, gran: str) -> int:
+    """UTC epoch where the IST bucket containing `epoch` starts."""
+    size, _ = GRANULARITIES[gran]
+    shift = _shift(gran)
+    return (epoch + shift) // size * size - shift
+
+
+def series(joined: array, left: array, gran: str, now: Optional[int] = None) -> Tuple[List[int], List[int], List[int]]:
+    """
+    (bucket start epochs, joins per bucket, leaves per bucket) for the last
+    N buckets of `gran`, the current (partial) bucket last.
+    Joins are counted at joined_at, leaves at left_at.
+    """
+    size, n = GRANULARITIES[gran]
+    now = int(now if now is not None else datetime.now(timezone.utc).timestamp())
+    first = bucket_start(now, gran) - (n - 1) * size
+    shift = _shift(gran)
+    starts = [first + i * size for i in range(n)]
+
+    if np is not None:
+        def count(col: array) -> List[int]:
+            a = np.frombuffer(col, dtype=np.int64) if len(col) else np.empty(0, dtype=np.int64)
+            a = a[(a >= first) & (a < first + n * size)]
+            idx = (a + shift) // size - (first + shift) // size
+            return np.bincount(idx, minlength=n)[:n].tolist()
+    else:
+        def count(col: array) -> List[int]:
+            base = (first + shift) // size
+            c = Counter((t + shift) // size - base for t in col if first <= t < first + n * size)
+            return [c.get(i, 0) for i in range(n)]
+
+    return starts, count(joined), count(left)
+
+
+def bucket_label(epoch: int, gran: str) -> str:
+    dt = datetime.fromtimestamp(epoch, IST)
+    if gran == "hour":
+        return dt.strftime("%d %b %H:00")
+    return dt.strftime("%d %b")
+
+
+def text_chart(starts: List[int], joins: List[int], leaves: List[int], gran: str, rows: int = 14) -> str:
+    """Fallback when matplotlib is not installed: last `rows` buckets as bars."""
+    tail = list(zip(starts, joins, leaves))[-rows:]
+    peak = max([j for _, j, _ in tail] + [1])
+    lines = []
+    for s, j, l in tail:
+        bar = "█" * max(0, round(j / peak * 12))
+        lines.append(f"{bucket_label(s, gran):>12} {bar:<12} +{j} -{l}")
+    return "\n".join(lines)
+
+
+def render_png(title: str, gran: str, starts: List[int], joins: List[int], leaves: List[int]) -> bytes:
+    """PNG bar chart (joins up, leaves down). Runs in a worker process."""
+    import matplotlib
+
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    labels = [bucket_label(s, gran) for s in starts]
+    x = list(range(len(starts)))
+    fig, ax = plt.subplots(figsize=(10, 4.5), dpi=110)
+    try:
+        ax.bar(x, joins, color="#2e9e5b", label="joins")
+        ax.bar(x, [-v for v in leaves], color="#d9534f", label="leaves")
+        ax.axhline(0, color="#555", linewidth=0.8)
+        step = max(1, len(x) // 12)
+        ax.set_xticks(x[::step])
+        ax.set_xticklabels(labels[::step], rotation=35, ha="right", fontsize=8)
+        ax.set_title(title, fontsize=11)
+        ax.set_ylabel(f"per {gran} (IST)")
+        ax.legend(loc="upper left", fontsize=8)
+        ax.grid(axis="y", alpha=0.3)
+        fig.tight_layout()
+        buf = io.BytesIO()
+        fig.savefig(buf, format="png")
+        return buf.getvalue()
+    finally:
+        plt.close(fig)
+
+
+def have_matplotlib() -> bool:
+    try:
+        import matplotlib  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+# ---------------- WINDOW INDEX ----------------
+#  Per-link sorted joined_at epochs of every join row, plus those of the
+#  rows that have left. A window count (joined_at in [since, until], the
+#  same filter as storage.count_joins / count_left) is two bisects.
+# -----------------------------------------------
+
+
+def _since_epoch(dt: Optional[datetime]) -> Optional[int]:
+    return math.ceil(dt.timestamp()) if dt is not None else None
+
+
+def _until_epoch(dt: Optional[datetime]) -> Optional[int]:
+    return math.floor(dt.timestamp()) if dt is not None else None
+
+
+class WindowIndex:
+    """Sorted join epochs of one link (all rows / rows that left)."""
+
+    __slots__ = ("joined", "left", "built_at")
+
+    def __init__(self, joined: Iterable[int] = (), left: Iterable[int] = ()):
+        self.joined = array("q", sorted(joined))
+        self.left = array("q", sorted(left))
+        self.built_at = time.time()  # rows written after this are applied with add_*
+
+    @classmethod
+    def from_columns(cls, joined: array, left: array) -> "WindowIndex":
+        """From join_columns() output (left = -1 while still joined)."""
+        return cls(joined, (j for j, l in zip(joined, left) if l >= 0))
+
+    def __len__(self) -> int:
+        return len(self.joined)
+
+    @property
+    def nbytes(self) -> int:
+        return (len(self.joined) + len(self.left)) * 8
+
+    @staticmethod
+    def _count(col: array, lo: Optional[int], hi: Optional[int]) -> int:
+        a = bisect_left(col, lo) if lo is not None else 0
+        b = bisect_right(col, hi) if hi is not None else len(col)
+        return max(0, b - a)
+
+    def counts(self, since: Optional[datetime] = None, until: Optional[datetime] = None) -> Tuple[int, int]:
+        """(joins, left) for rows joined in [since, until] (either end open when None)."""
+        lo, hi = _since_epoch(since), _until_epoch(until)
+        return self._count(self.joined, lo, hi), self._count(self.left, lo, hi)
+
+    def add_joins(self, epochs: Iterable[int]):
+        for t in epochs:
+            insort(self.joined, t)
+
+    def add_left(self, epochs: Iterable[int]):
+        """Rows (by their joined_at epoch) that were just marked left."""
+        for t in epochs:
+            insort(self.left, t)
+
+
+if __name__ == "__main__":
+    args = json.load(sys.stdin)
+    sys.stdout.buffer.write(render_png(args["title"], args["gran"], args["starts"], args["joins"], args["leaves"]))